@@ -0,0 +1,85 @@
+import glob
+import shutil
+
+import geopandas as gpd
+import numpy as np
+import pytest
+from pyproj import CRS
+
+import treedata.radolan.buffer_city_shape as buffer_city_shape
+import treedata.radolan.polygonize_weather_data as polygonize_weather_data
+from treedata.radolan.buffer_city_shape import create_buffered_city_shape, read_buffered_city_shape
+from treedata.radolan.polygonize_weather_data import mask_asc_file, read_asc_header, write_asc_grid, \
+    polygonize_asc_file, radolan_proj
+
+# window of the RADOLAN grid around Leipzig
+grid_header = {'xllcorner': 122538.0, 'yllcorner': -4208645.0, 'cellsize': 1000.0, 'nodata_value': -1.0}
+
+
+def fail(*args):
+    raise AssertionError("cache not used")
+
+
+def test_create_buffered_city_shape(tmp_path, monkeypatch):
+    shutil.copy("resources/city_shape/city_shape.geojson", tmp_path / "city_shape.geojson")
+    key, geometry = create_buffered_city_shape('city_shape', 'city_shape-buffered', 2000, 1000,
+                                               city_shape_path=str(tmp_path))
+    assert (tmp_path / "city_shape-buffered.shp").is_file()
+    assert glob.glob(f"{tmp_path}/cache/buffered-{key}.wkb")
+
+    monkeypatch.setattr(buffer_city_shape, 'buffer_city_shape', fail)
+    cached_key, cached_geometry = create_buffered_city_shape('city_shape', 'city_shape-buffered', 2000, 1000,
+                                                             city_shape_path=str(tmp_path))
+    assert cached_key == key
+    assert cached_geometry.equals(geometry)
+    with pytest.raises(AssertionError):
+        create_buffered_city_shape('city_shape', 'city_shape-buffered', 3000, 1000, city_shape_path=str(tmp_path))
+
+    _, read_geometry = read_buffered_city_shape('city_shape-buffered', city_shape_path=str(tmp_path))
+    assert abs(read_geometry.area - geometry.area) / geometry.area < 1e-6
+
+
+def test_mask_asc_file(tmp_path, monkeypatch):
+    shutil.copy("resources/city_shape/city_shape.geojson", tmp_path / "city_shape.geojson")
+    city_shape_buffer = create_buffered_city_shape('city_shape', 'city_shape-buffered', 2000, 1000,
+                                                   city_shape_path=str(tmp_path))
+    grid = np.arange(100 * 100, dtype=float).reshape(100, 100)
+    write_asc_grid(f"{tmp_path}/grid.asc", grid_header, grid)
+
+    mask_asc_file(city_shape_buffer, f"{tmp_path}/grid.asc", f"{tmp_path}/masked.asc", f"{tmp_path}/cache")
+    header = read_asc_header(f"{tmp_path}/masked.asc")
+    with open(f"{tmp_path}/masked.prj") as f:
+        assert CRS.from_wkt(f.read()).equals(CRS.from_proj4(radolan_proj))
+    masked = np.loadtxt(f"{tmp_path}/masked.asc", skiprows=len(header))
+    assert masked.shape == (header['nrows'], header['ncols'])
+    assert masked.shape[0] < 100 and masked.shape[1] < 100
+    # kept cells still have their values at the same position of the grid
+    row_offset = int((grid_header['yllcorner'] + 100 * 1000 - header['yllcorner']) / 1000) - masked.shape[0]
+    col_offset = int((header['xllcorner'] - grid_header['xllcorner']) / 1000)
+    window = grid[row_offset:row_offset + masked.shape[0], col_offset:col_offset + masked.shape[1]]
+    kept = masked != -1
+    assert np.array_equal(masked[kept], window[kept])
+    assert kept[masked.shape[0] // 2, masked.shape[1] // 2]
+    assert not kept[0, 0]
+
+    monkeypatch.setattr(polygonize_weather_data, 'rasterize_grid_mask', fail)
+    mask_asc_file(city_shape_buffer, f"{tmp_path}/grid.asc", f"{tmp_path}/masked-again.asc", f"{tmp_path}/cache")
+    with open(f"{tmp_path}/masked.asc") as f, open(f"{tmp_path}/masked-again.asc") as g:
+        assert f.read() == g.read()
+
+
+@pytest.mark.skipif(shutil.which('gdal_polygonize.py') is None, reason="GDAL command line tools not installed")
+def test_polygonize_asc_file_keeps_radolan_crs(tmp_path, monkeypatch):
+    shutil.copy("resources/city_shape/city_shape.geojson", tmp_path / "city_shape.geojson")
+    city_shape_buffer = create_buffered_city_shape('city_shape', 'city_shape-buffered', 2000, 1000,
+                                                   city_shape_path=str(tmp_path))
+    monkeypatch.setattr(polygonize_weather_data, 'get_cache_path', lambda: f"{tmp_path}/cache")
+    monkeypatch.setattr(polygonize_weather_data, 'path', f"{tmp_path}/")
+    write_asc_grid(f"{tmp_path}/grid.asc", grid_header, np.ones((100, 100)))
+
+    polygonize_asc_file(city_shape_buffer, f"{tmp_path}/grid.asc", f"{tmp_path}/grid-masked.asc", "grid")
+    polygons = gpd.read_file(f"{tmp_path}/grid.shp")
+    assert len(polygons) > 0
+    assert polygons.crs is not None and polygons.crs.equals(CRS.from_proj4(radolan_proj))
+    # as done by join_radolan_data
+    assert polygons.to_crs("epsg:3857").crs.equals("epsg:3857")
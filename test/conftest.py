@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the pipeline modules import each other relative to the treedata folder, as main.py is run from there
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'treedata'))
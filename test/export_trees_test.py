@@ -0,0 +1,81 @@
+import csv
+import gzip
+import json
+import threading
+from functools import partial
+
+import pyarrow as pa
+
+from treedata.radolan.export_trees import run_writers
+from treedata.radolan.write_radolan_csvs import trees_export_schema, write_trees_csvs, write_trees_csv_partitions
+from treedata.radolan.write_radolan_delta import with_export_sequence
+
+trees = pa.Table.from_pylist([
+    {"id": "1", "lng": 12.37, "lat": 51.34, "radolan_sum": 10, "radolan_sum_total": 30, "age": 25.0},
+    {"id": "2", "lng": 12.38, "lat": 51.35, "radolan_sum": 0, "radolan_sum_total": 0, "age": None},
+    {"id": "3", "lng": 12.39, "lat": 51.36, "radolan_sum": 5, "radolan_sum_total": 5, "age": 3.0},
+], schema=trees_export_schema)
+
+
+def read_csv(file_path):
+    with open(file_path, newline='') as f:
+        return list(csv.reader(f))
+
+
+def test_run_writers_shares_trees():
+    seen = []
+    barrier = threading.Barrier(2, timeout=5)
+
+    def writer(name, data):
+        # both writers run at the same time
+        barrier.wait()
+        seen.append(data)
+        return {f"/{name}": name}
+
+    files, timings = run_writers(trees, {"a": partial(writer, "a"), "b": partial(writer, "b")})
+    assert files == {"a": {"/a": "a"}, "b": {"/b": "b"}}
+    assert set(timings) == {"a", "b"}
+    assert all(data is trees for data in seen)
+
+
+def test_write_trees_csvs(tmp_path):
+    files = write_trees_csvs(trees, f"{tmp_path}/")
+    assert sorted(files.values()) == ["trees-total.csv", "trees-total.csv.gz", "trees.csv", "trees.csv.gz"]
+    assert read_csv(f"{tmp_path}/trees.csv") == [
+        ['id', 'lng', 'lat', 'radolan_sum', 'age'],
+        ['1', '12.37', '51.34', '10', '25'], ['2', '12.38', '51.35', '0', '10'], ['3', '12.39', '51.36', '5', '3']
+    ]
+    assert [row[3] for row in read_csv(f"{tmp_path}/trees-total.csv")[1:]] == ['30', '0', '5']
+    with gzip.open(f"{tmp_path}/trees.csv.gz", 'rt') as f, open(f"{tmp_path}/trees.csv") as g:
+        assert f.read() == g.read()
+
+
+def test_write_trees_csv_partitions(tmp_path):
+    files = write_trees_csv_partitions(trees, f"{tmp_path}/", partition_zoom=12)
+    with open(f"{tmp_path}/trees-partitions.json") as f:
+        index = json.load(f)
+    assert index["zoom"] == 12
+    # trees 2 and 3 lie in one tile of zoom 12, tree 1 in the tile south of it
+    assert [(partition["file"], partition["rows"]) for partition in index["partitions"]] == [
+        ("trees-120212021300.csv", 2), ("trees-120212021302.csv", 1)
+    ]
+    assert index["partitions"][0]["bbox"] == [12.38, 51.35, 12.39, 51.36]
+    west, south, east, north = index["partitions"][0]["tile_bbox"]
+    assert west <= 12.38 and east >= 12.39 and south <= 51.35 and north >= 51.36
+    assert index["partitions"][1]["tile_bbox"][3] == south
+    assert read_csv(f"{tmp_path}/trees-120212021302.csv")[1:] == [['1', '12.37', '51.34', '10', '25']]
+    assert [row[3] for row in read_csv(f"{tmp_path}/trees-total-120212021300.csv")[1:]] == ['0', '5']
+    assert "trees-partitions.json" in files.values() and "trees-total-partitions.json" in files.values()
+    assert "trees-120212021300.csv.gz" in files.values()
+
+
+def test_write_trees_csvs_with_sequence(tmp_path):
+    files = write_trees_csvs(with_export_sequence(trees, 7), f"{tmp_path}/")
+    assert "trees-export.json" in files.values()
+    with open(f"{tmp_path}/trees-export.json") as f:
+        assert json.load(f) == {
+            "sequence": 7, "files": ["trees-total.csv", "trees-total.csv.gz", "trees.csv", "trees.csv.gz"]
+        }
+    write_trees_csv_partitions(with_export_sequence(trees, 7), f"{tmp_path}/", partition_zoom=12)
+    with open(f"{tmp_path}/trees-partitions.json") as f:
+        assert json.load(f)["sequence"] == 7
@@ -0,0 +1,26 @@
+import geopandas
+from shapely import Point, box
+
+from treedata.trees.geo_within import get_district, get_districts
+
+
+def test_get_districts():
+    city_shape = geopandas.GeoDataFrame(
+        {'bez': ['West', 'East', 'Overlap']},
+        geometry=[box(0, 0, 1, 1), box(1, 0, 2, 1), box(1.5, 0, 2, 1)],
+        crs="epsg:4326"
+    )
+    points = geopandas.GeoSeries(
+        [Point(0.5, 0.5), Point(1.75, 0.5), Point(1.0, 0.5), Point(5, 0.5)],
+        index=[10, 11, 12, 13],
+        crs="epsg:4326"
+    )
+    districts = get_districts(points, city_shape)
+    assert list(districts.index) == [10, 11, 12, 13]
+    # same first match as the per point lookup
+    assert districts[10] == get_district(0.5, 0.5, city_shape) == 'West'
+    assert districts[11] == get_district(1.75, 0.5, city_shape) == 'East'
+    # on the border between two districts the first nearest one is taken
+    assert districts[12] == 'West'
+    # far outside of the city no district is assigned
+    assert districts[13] is None
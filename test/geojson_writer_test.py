@@ -0,0 +1,49 @@
+import datetime
+import gzip
+import json
+import os
+
+import geopandas
+import pytest
+from shapely import Point
+
+from treedata.utils.geojson_writer import GeoJsonWriter, write_geojson
+
+
+def test_geojson_writer(tmp_path):
+    file_path = f"{tmp_path}/features.geojson"
+    with GeoJsonWriter(file_path, properties={"version": 2}) as writer:
+        writer.write_feature({"type": "Feature", "properties": {"id": 1}, "geometry": None})
+        writer.write_raw_feature('{"type": "Feature", "properties": {"id": 2}, "geometry": null}')
+    assert writer.feature_count == 2
+    with open(file_path) as f:
+        collection = json.load(f)
+    assert collection["type"] == "FeatureCollection"
+    assert collection["properties"] == {"version": 2}
+    assert [feature["properties"]["id"] for feature in collection["features"]] == [1, 2]
+
+
+def test_geojson_writer_removes_file_on_error(tmp_path):
+    file_path = f"{tmp_path}/features.geojson"
+    with pytest.raises(ValueError):
+        with GeoJsonWriter(file_path) as writer:
+            writer.write_feature({"type": "Feature", "properties": {}, "geometry": None})
+            raise ValueError("aborted")
+    assert not os.path.exists(file_path)
+
+
+def test_write_geojson(tmp_path):
+    data = geopandas.GeoDataFrame(
+        {'name': ['a', 'b'], 'planted': [datetime.datetime(2023, 7, 1), datetime.datetime(2023, 7, 2)]},
+        geometry=[Point(12.123456789, 51.1), Point(12.2, 51.2)],
+        index=[5, 6],
+        crs="epsg:4326"
+    )
+    file_path = write_geojson(data, f"{tmp_path}/features.geojson.gz", precision=5, compress=True,
+                              date_format="%Y-%m-%d")
+    with gzip.open(file_path) as f:
+        collection = json.load(f)
+    features = collection["features"]
+    assert [feature["id"] for feature in features] == ["5", "6"]
+    assert features[0]["properties"] == {"name": "a", "planted": "2023-07-01"}
+    assert features[0]["geometry"]["coordinates"] == [12.12346, 51.1]
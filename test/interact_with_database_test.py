@@ -0,0 +1,27 @@
+import pandas as pd
+import shapely
+
+from treedata.utils.interact_with_database import get_staging_rows, staging_columns
+
+
+def test_get_staging_rows():
+    trees = pd.DataFrame({
+        'id': pd.array(["1", "2"], dtype='string[pyarrow]'),
+        'artbot': pd.Series(["Acer", None], dtype='category'),
+        'baumhoehe': [8.0, None],
+        'pflanzjahr': ["1990", "keine Angabe"],
+        'aend_dat': ["2023-12-23", None],
+        'lat': [51.33, None],
+        'lng': [12.38, 12.4],
+    })
+    rows = get_staging_rows(trees)
+    assert list(rows.columns) == staging_columns
+    assert list(rows['baumhoehe']) == [8, pd.NA]
+    assert list(rows['pflanzjahr']) == [1990, pd.NA]
+    assert rows['aend_dat'].iloc[0] == pd.Timestamp("2023-12-23")
+    geom = shapely.from_wkb(rows['geom'].iloc[0])
+    assert shapely.get_srid(geom) == 4326 and (geom.x, geom.y) == (12.38, 51.33)
+    assert rows['geom'].iloc[1] is None
+    assert rows['standortnr'].isna().all()
+    # missing columns are None, not NaN, on their way to COPY
+    assert list(rows['standortnr']) == [None, None]
@@ -0,0 +1,62 @@
+import os
+
+import geopandas as gpd
+import pandas as pd
+import pytest
+
+from treedata.utils.intermediate_files import write_intermediate, read_intermediate, read_intermediate_batches, \
+    IntermediateWriter
+
+
+def test_intermediate_round_trip(tmp_path):
+    trees = gpd.GeoDataFrame({
+        'objectid': [3, 1, 2],
+        'gattung': ["Quercus", None, "Acer"],
+        'pflanzjahr': pd.array([1990, None, 2014], dtype='Int32'),
+    }, geometry=gpd.points_from_xy([12.3, 12.1, 12.2], [51.3, 51.1, 51.2]), crs=4326)
+    for intermediate_format in ['parquet', 'fgb', 'geojson']:
+        file_name = f"{tmp_path}/trees"
+        write_intermediate(trees, file_name, intermediate_format)
+        result = read_intermediate(file_name, intermediate_format)
+        assert list(result['objectid']) == [3, 1, 2], intermediate_format
+        assert list(result['gattung'].fillna("")) == ["Quercus", "", "Acer"], intermediate_format
+        assert result.geometry.geom_equals(trees.geometry).all(), intermediate_format
+        batches = list(read_intermediate_batches(file_name, intermediate_format, 2))
+        assert [list(batch.index) for batch in batches] == [[0, 1], [2]], intermediate_format
+        assert list(pd.concat(batches)['objectid']) == [3, 1, 2], intermediate_format
+        assert batches[0].crs.equals("epsg:4326"), intermediate_format
+
+
+
+def test_intermediate_writer(tmp_path):
+    trees = gpd.GeoDataFrame({
+        'objectid': [3, 1, 2],
+        'gattung': pd.Series(["Quercus", None, "Acer"], dtype='category'),
+        'pflanzjahr': pd.array([1990, None, 2014], dtype='Int32'),
+    }, geometry=gpd.points_from_xy([12.3, 12.1, 12.2], [51.3, 51.1, 51.2]), crs=4326)
+    for intermediate_format in ['parquet', 'fgb', 'geojson']:
+        file_name = f"{tmp_path}/trees"
+        with IntermediateWriter(file_name, intermediate_format) as writer:
+            # the categories of the batches differ
+            writer.write_frame(trees.iloc[:2].assign(gattung=trees['gattung'].iloc[:2].cat.remove_unused_categories()))
+            writer.write_frame(trees.iloc[2:].assign(gattung=trees['gattung'].iloc[2:].cat.remove_unused_categories()))
+        assert writer.feature_count == 3, intermediate_format
+        result = read_intermediate(file_name, intermediate_format)
+        assert list(result['objectid']) == [3, 1, 2], intermediate_format
+        assert list(result['gattung'].fillna("")) == ["Quercus", "", "Acer"], intermediate_format
+        assert result.geometry.geom_equals(trees.geometry).all(), intermediate_format
+        batches = list(read_intermediate_batches(file_name, intermediate_format, 2))
+        assert list(pd.concat(batches)['objectid']) == [3, 1, 2], intermediate_format
+
+
+def test_intermediate_writer_keeps_file_on_error(tmp_path):
+    trees = gpd.GeoDataFrame({'objectid': [1]}, geometry=gpd.points_from_xy([12.3], [51.3]), crs=4326)
+    file_name = f"{tmp_path}/trees"
+    write_intermediate(trees, file_name, 'parquet')
+    with pytest.raises(ValueError):
+        with IntermediateWriter(file_name, 'parquet') as writer:
+            writer.write_frame(trees.assign(objectid=[2]))
+            raise ValueError("aborted")
+    # the file of the previous run is left as it is
+    assert list(read_intermediate(file_name, 'parquet')['objectid']) == [1]
+    assert os.listdir(tmp_path) == ["trees.parquet"]
@@ -0,0 +1,24 @@
+from treedata.migrations.migrate import find_missing_indexes
+
+
+def test_find_missing_indexes():
+    existing_tables = {"trees", "radolan_data"}
+    existing_indexes = [
+        ("trees", "btree", ["id"]),
+        ("trees", "gist", ["geom"]),
+        ("trees", "btree", ["standortnr", "id"]),
+        ("radolan_data", "btree", ["measured_at", "geom_id"]),
+    ]
+    required = [
+        ("trees", "gist", ["geom"]),
+        ("trees", "btree", ["standortnr"]),
+        ("radolan_data", "btree", ["geom_id", "measured_at"]),
+        ("radolan_data", "gist", ["measured_at"]),
+        ("trees_watered", "btree", ["tree_id", "timestamp"]),
+    ]
+    missing = find_missing_indexes(existing_indexes, existing_tables, required)
+    # leading columns have to match, tables not present are ignored
+    assert missing == [
+        ("radolan_data", "btree", ["geom_id", "measured_at"]),
+        ("radolan_data", "gist", ["measured_at"]),
+    ]
@@ -0,0 +1,43 @@
+import geopandas as gpd
+import pandas as pd
+
+from treedata.trees.parallel_transform import create_transform_executor, transform_new_tree_data_in_parallel
+from treedata.trees.process_data import read_config, transform_new_tree_data
+
+attribute_list = ['id', 'geometry', 'artbot', 'standortnr', 'stammdurch', 'stammumfg']
+attribute_dtypes = {'id': 'string[pyarrow]', 'artbot': 'category', 'standortnr': 'string[pyarrow]',
+                    'stammdurch': 'Int32', 'stammumfg': 'float64'}
+
+
+def test_transform_in_parallel_matches_serial_transform():
+    trees = gpd.GeoDataFrame({
+        'objectid': [1, 2, 3, 2, 4, 5, 6],
+        'ga_lang_wiss': ["Acer platanoides", "Quercus cerris", "Tilia cordata", "Quercus cerris",
+                         None, "Acer platanoides", "Quercus cerris"],
+        'baumnummer': ["G1", "G2", "G3", "G2", "G4", "G5", "G6"],
+        'st_durchm': [13.0, 20.0, None, 20.0, 30.0, 41.0, 7.0],
+    }, geometry=gpd.points_from_xy([12.3, 12.31, 12.32, 12.31, 12.33, 12.34, 12.35], [51.3] * 7), crs=4326)
+    city_shape = gpd.GeoDataFrame(geometry=[trees.unary_union.envelope.buffer(0.1)], crs=4326)
+    schema_mapping_dict, schema_calculated_dict = read_config()
+    expected = transform_new_tree_data(trees, attribute_list, schema_mapping_dict, schema_calculated_dict,
+                                       city_shape, attribute_dtypes)
+    with create_transform_executor(3, city_shape, attribute_list, attribute_dtypes) as executor:
+        result = transform_new_tree_data_in_parallel(executor, 3, trees, attribute_dtypes)
+    pd.testing.assert_frame_equal(result, expected, check_categorical=False)
+
+
+def test_transform_in_parallel_with_empty_input():
+    trees = gpd.GeoDataFrame({
+        'objectid': pd.Series([], dtype='int64'),
+        'ga_lang_wiss': pd.Series([], dtype=object),
+        'baumnummer': pd.Series([], dtype=object),
+        'st_durchm': pd.Series([], dtype='float64'),
+    }, geometry=gpd.GeoSeries([], crs=4326))
+    city_shape = gpd.GeoDataFrame(geometry=gpd.points_from_xy([12.3], [51.3]).buffer(0.1), crs=4326)
+    schema_mapping_dict, schema_calculated_dict = read_config()
+    expected = transform_new_tree_data(trees, attribute_list, schema_mapping_dict, schema_calculated_dict,
+                                       city_shape, attribute_dtypes)
+    with create_transform_executor(2, city_shape, attribute_list, attribute_dtypes) as executor:
+        result = transform_new_tree_data_in_parallel(executor, 2, trees, attribute_dtypes)
+    assert len(result) == 0
+    assert list(result.columns) == list(expected.columns)
@@ -0,0 +1,30 @@
+import datetime
+
+import pandas as pd
+
+from treedata.trees.process_data import calc_funs, row_calc_funs
+
+
+def test_calc_funs_match_row_calc_funs():
+    trees = pd.DataFrame({
+        'ga_lang_wiss': ["Acer platanoides", "Quercus cerris", None, "Unknownus x"],
+        'st_durchm': ["13", 20.0, None, "n/a"],
+        'fme_tstamp': ["2023-12-23", "23.12.2023", None, "2023-07-08"],
+    })
+    cases = [
+        ("lookup_genus_german", "ga_lang_wiss", "species"),
+        ("calc_trunc_circumference", "st_durchm", "diameter"),
+        ("calc_update_date", "fme_tstamp", "update_data_str"),
+    ]
+    for calc_fun, column, input_name in cases:
+        expected = [row_calc_funs[calc_fun]({input_name: value}) for value in trees[column]]
+        result = calc_funs[calc_fun]({input_name: trees[column]})
+        assert [None if pd.isna(value) else value for value in result] == \
+               [None if pd.isna(value) else value for value in expected]
+
+
+def test_calc_plant_year():
+    ages = pd.Series(["keine Angabe", "12", "-12", "1990", None])
+    current_year = datetime.datetime.now().year
+    plant_years = calc_funs["calc_plant_year"]({"age": ages})
+    assert list(plant_years.fillna(-1)) == [-1, current_year - 12, current_year - 12, 1990, -1]
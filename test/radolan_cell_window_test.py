@@ -0,0 +1,112 @@
+import datetime
+import os
+import re
+
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine, text
+
+from treedata.radolan.radolan_cell_window import get_window_start, get_measured_dates, get_day_index, \
+    get_shifted_days, shift_windows, add_missing_windows, set_window_day
+
+# throwaway database to run the window statements against, the tables are created temporarily
+test_database_url = os.getenv("TEST_DATABASE_URL")
+
+
+# applies the shifted days expression to a window like PostgreSQL, with 1-based inclusive slices
+def apply_shifted_days(days, expression):
+    fill = re.fullmatch(r"array_fill\(0, ARRAY\[(\d+)\]\)::int2\[\]", expression)
+    if fill:
+        return [0] * int(fill.group(1))
+    start, end, zeros = map(int, re.fullmatch(
+        r"days\[(\d+):(\d+)\] \|\| array_fill\(0, ARRAY\[(\d+)\]\)::int2\[\]", expression).groups())
+    return days[start - 1:end] + [0] * zeros
+
+
+def test_get_window_start():
+    now = datetime.datetime(2023, 7, 28, 15, 47, 30)
+    # 30 days ending today
+    assert get_window_start(30, now) == datetime.date(2023, 6, 29)
+
+
+def test_get_measured_dates():
+    radolan_data = pd.DataFrame({"measured_at": ["2023-07-27", "2023-07-26", "2023-07-27"]})
+    assert get_measured_dates(radolan_data) == [datetime.date(2023, 7, 26), datetime.date(2023, 7, 27)]
+
+
+def test_get_day_index():
+    window_start = get_window_start(30, datetime.datetime(2023, 7, 28))
+    assert get_day_index(window_start, window_start) == 1
+    assert get_day_index(window_start, datetime.date(2023, 7, 28)) == 30
+
+
+def test_get_shifted_days():
+    days = list(range(1, 31))
+    assert apply_shifted_days(days, get_shifted_days(1, 30)) == list(range(2, 31)) + [0]
+    assert apply_shifted_days(days, get_shifted_days(29, 30)) == [30] + [0] * 29
+    assert apply_shifted_days(days, get_shifted_days(30, 30)) == [0] * 30
+    assert apply_shifted_days(days, get_shifted_days(45, 30)) == [0] * 30
+    for offset in range(1, 40):
+        shifted = apply_shifted_days(days, get_shifted_days(offset, 30))
+        assert len(shifted) == 30
+        # the day at index i of the new window was at index i + offset of the old one
+        assert all(value == (index + offset + 1 if index + offset < 30 else 0)
+                   for index, value in enumerate(shifted))
+
+
+class RecordingConnection:
+    def __init__(self, window_starts):
+        self.window_starts = window_starts
+        self.statements = []
+
+    def execute(self, statement, parameters=None):
+        self.statements.append((" ".join(str(statement).split()), parameters))
+        rows = [(window_start,) for window_start in self.window_starts]
+        return type('Result', (), {'rowcount': 2, 'fetchall': lambda result: rows})()
+
+
+def test_shift_windows_per_window_start():
+    window_start = datetime.date(2023, 7, 10)
+    conn = RecordingConnection([datetime.date(2023, 7, 9), datetime.date(2023, 6, 1)])
+    assert shift_windows(conn, window_start, 30) == 4
+    updates = conn.statements[1:]
+    assert f"days = {get_shifted_days(1, 30)}," in updates[0][0]
+    assert updates[0][1] == {"window_start": window_start, "previous_start": datetime.date(2023, 7, 9)}
+    assert f"days = {get_shifted_days(39, 30)}," in updates[1][0]
+
+
+@pytest.mark.skipif(test_database_url is None, reason="TEST_DATABASE_URL not set")
+def test_window_statements_against_database():
+    engine = create_engine(test_database_url)
+    window_start = datetime.date(2023, 7, 1)
+    with engine.connect() as conn:
+        try:
+            conn.execute(text('CREATE TEMP TABLE radolan_geometry (id int4)'))
+            conn.execute(text('CREATE TEMP TABLE radolan_data (geom_id int2, measured_at timestamp, value int4)'))
+            conn.execute(text('''
+                CREATE TEMP TABLE radolan_cell_window (geom_id int4 PRIMARY KEY, window_start date, days int2[])
+            '''))
+            conn.execute(text('INSERT INTO radolan_geometry VALUES (1), (2)'))
+            conn.execute(text('''
+                INSERT INTO radolan_data VALUES
+                (1, '2023-07-02 00:50', 3), (1, '2023-07-02 12:50', 7), (2, '2023-07-03 00:50', 4)
+            '''))
+            assert sorted(add_missing_windows(conn, window_start, 3)) == [1, 2]
+            for offset in range(3):
+                set_window_day(conn, window_start, window_start + datetime.timedelta(days=offset))
+
+            def get_days():
+                return {geom_id: (start, list(days)) for geom_id, start, days in conn.execute(text(
+                    'SELECT geom_id, window_start, days FROM radolan_cell_window')).fetchall()}
+
+            # the maximum of the measurements of a day
+            assert get_days() == {1: (window_start, [0, 7, 0]), 2: (window_start, [0, 0, 4])}
+
+            next_start = window_start + datetime.timedelta(days=2)
+            assert shift_windows(conn, next_start, 3) == 2
+            assert get_days() == {1: (next_start, [0, 0, 0]), 2: (next_start, [4, 0, 0])}
+            assert shift_windows(conn, next_start, 3) == 0
+            assert shift_windows(conn, next_start + datetime.timedelta(days=5), 3) == 2
+            assert get_days()[2][1] == [0, 0, 0]
+        finally:
+            conn.rollback()
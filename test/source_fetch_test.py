@@ -0,0 +1,120 @@
+import os
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import pytest
+
+from treedata.utils.source_fetch import fetch_source, is_up_to_date, mark_up_to_date, write_meta, get_meta_path
+
+content = bytes(range(256)) * 1024
+
+
+# serves content with an ETag, answers conditional requests and ranges, can cut off the first transfer
+class SourceHandler(BaseHTTPRequestHandler):
+    etag = '"v1"'
+    cut_off = False
+    requests = []
+
+    def do_GET(self):
+        SourceHandler.requests.append(dict(self.headers))
+        if self.headers.get('If-None-Match') == SourceHandler.etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        start = 0
+        if self.headers.get('Range') and self.headers.get('If-Range') == SourceHandler.etag:
+            start = int(self.headers['Range'][len('bytes='):-1])
+            if start >= len(content):
+                self.send_response(416)
+                self.send_header('Content-Range', f"bytes */{len(content)}")
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', f"bytes {start}-{len(content) - 1}/{len(content)}")
+        else:
+            self.send_response(200)
+        self.send_header('ETag', SourceHandler.etag)
+        self.send_header('Content-Length', str(len(content) - start))
+        self.end_headers()
+        if SourceHandler.cut_off:
+            SourceHandler.cut_off = False
+            self.wfile.write(content[start:start + 150000])
+            self.wfile.flush()
+            self.connection.close()
+            return
+        self.wfile.write(content[start:])
+
+    def log_message(self, *args):
+        pass
+
+
+def test_fetch_source(tmp_path):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), SourceHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/trees.zip"
+    file_path = f"{tmp_path}/trees.zip"
+    try:
+        # the first transfer breaks off, what was received is kept
+        SourceHandler.cut_off = True
+        with pytest.raises(Exception):
+            fetch_source(url, file_path)
+        # resumed where the first transfer broke off
+        assert fetch_source(url, file_path)
+        assert SourceHandler.requests[-1]['Range'] != "bytes=0-"
+        with open(file_path, 'rb') as f:
+            assert f.read() == content
+
+        assert not fetch_source(url, file_path)
+        assert SourceHandler.requests[-1]['If-None-Match'] == '"v1"'
+
+        with pytest.raises(Exception):
+            fetch_source(url, f"{tmp_path}/other.zip", expected_sha256="0" * 64)
+    finally:
+        server.shutdown()
+
+
+def test_fetch_source_restarts_rejected_resume(tmp_path):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), SourceHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/trees.zip"
+    file_path = f"{tmp_path}/trees.zip"
+    try:
+        # a complete partial file, e.g. left by a run that failed before moving it in place
+        with open(f"{file_path}.part", 'wb') as f:
+            f.write(content)
+        write_meta(get_meta_path(f"{file_path}.part"), {"url": url, "params": None, "etag": SourceHandler.etag})
+        SourceHandler.requests = []
+        assert fetch_source(url, file_path)
+        # the resume is answered with 416, the whole file is downloaded again without Range
+        assert SourceHandler.requests[0]['Range'] == f"bytes={len(content)}-"
+        assert 'Range' not in SourceHandler.requests[1]
+        with open(file_path, 'rb') as f:
+            assert f.read() == content
+        assert not os.path.exists(f"{file_path}.part")
+        assert not os.path.exists(get_meta_path(f"{file_path}.part"))
+    finally:
+        server.shutdown()
+
+
+def test_is_up_to_date(tmp_path):
+    source_path = tmp_path / "trees.zip"
+    output_path = tmp_path / "trees.parquet"
+    source_path.write_bytes(b"v1")
+    output_path.write_bytes(b"converted")
+    assert not is_up_to_date([str(source_path)], str(output_path))
+    mark_up_to_date([str(source_path)], str(output_path))
+    assert is_up_to_date([str(source_path)], str(output_path))
+    source_path.write_bytes(b"v2")
+    assert not is_up_to_date([str(source_path)], str(output_path))
+
+
+def test_is_up_to_date_with_key(tmp_path):
+    source_path = tmp_path / "trees.zip"
+    output_path = tmp_path / "trees.parquet"
+    source_path.write_bytes(b"v1")
+    output_path.write_bytes(b"converted")
+    mark_up_to_date([str(source_path)], str(output_path), "2023")
+    assert is_up_to_date([str(source_path)], str(output_path), "2023")
+    # e.g. the year the output was calculated with changed
+    assert not is_up_to_date([str(source_path)], str(output_path), "2024")
+    assert not is_up_to_date([str(source_path)], str(output_path))
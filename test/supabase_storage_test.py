@@ -0,0 +1,42 @@
+import pytest
+
+from treedata.utils import supabase_storage
+
+
+class Response:
+    def __init__(self, status_code, json=None):
+        self.status_code = status_code
+        self.content = b''
+        self._json = json
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise Exception(self.status_code)
+
+    def json(self):
+        return self._json
+
+
+def test_upload_files_to_supabase_storage_reports_failures(tmp_path, monkeypatch):
+    for name in ["a.csv", "b.csv"]:
+        (tmp_path / name).write_text("id\n")
+    monkeypatch.setattr(supabase_storage.requests, 'get', lambda url: Response(404))
+    monkeypatch.setattr(supabase_storage.requests, 'post',
+                        lambda url, **kwargs: Response(500 if url.endswith("b.csv") else 200))
+    files = {f"{tmp_path}/a.csv": "a.csv", f"{tmp_path}/b.csv": "b.csv"}
+    assert not supabase_storage.upload_files_to_supabase_storage("https://example.org", "bucket", "key", files)
+    assert supabase_storage.upload_files_to_supabase_storage("https://example.org", "bucket", "key",
+                                                             {f"{tmp_path}/a.csv": "a.csv"})
+
+
+def test_download_json_from_supabase_storage(monkeypatch):
+    monkeypatch.setattr(supabase_storage.requests, 'get', lambda url: Response(200, {"sequence": 7}))
+    assert supabase_storage.download_json_from_supabase_storage(
+        "https://example.org", "bucket", "trees-delta.json") == {"sequence": 7}
+    monkeypatch.setattr(supabase_storage.requests, 'get', lambda url: Response(400))
+    assert supabase_storage.download_json_from_supabase_storage(
+        "https://example.org", "bucket", "trees-delta.json") is None
+    # an unreachable storage must not restart the sequence
+    monkeypatch.setattr(supabase_storage.requests, 'get', lambda url: Response(503))
+    with pytest.raises(Exception):
+        supabase_storage.download_json_from_supabase_storage("https://example.org", "bucket", "trees-delta.json")
@@ -0,0 +1,120 @@
+import os
+import re
+import uuid
+
+import pytest
+from sqlalchemy import create_engine, text
+
+from treedata.trees import sync_trees as sync
+
+# throwaway database with PostGIS to sync against, the tables are created under unique names and dropped again
+test_database_url = os.getenv("TEST_DATABASE_URL")
+
+
+def test_content_hashes_cover_the_same_columns():
+    original = sync.original_content_hash()
+    tmp = sync.tmp_content_hash()
+    assert original.startswith("md5(ROW(") and tmp.startswith("md5(ROW(")
+    assert re.findall(r'A\."(\w+)"', original) == [column for column, _ in sync.synced_columns]
+    assert re.findall(r'B\."(\w+)"', tmp) == [
+        'aend_dat' if column == 'zuletztakt' else column for column, _ in sync.synced_columns
+    ]
+
+
+def insert_staging_tree(conn, table_name, id, standortnr, strname="Hauptstr.", lng=12.37, lat=51.34):
+    conn.execute(text(f'''
+        INSERT INTO public."{table_name}"
+        (id, strname, standortnr, kronedurch, aend_dat, pflanzjahr, stammumfg, lat, lng, geom)
+        VALUES (:id, :strname, :standortnr, 5, '2023-12-23', 1990, 120.5, :lat, :lng,
+                ST_SetSRID(ST_MakePoint(:lng, :lat), 4326))
+    '''), {"id": id, "standortnr": standortnr, "strname": strname, "lat": lat, "lng": lng})
+
+
+def get_trees(conn, table_name):
+    rows = conn.execute(text(f'''
+        SELECT id, strname, radolan_sum, radolan_days FROM public."{table_name}" ORDER BY id
+    ''')).fetchall()
+    return {id: (strname, radolan_sum, radolan_days) for id, strname, radolan_sum, radolan_days in rows}
+
+
+@pytest.mark.skipif(test_database_url is None, reason="TEST_DATABASE_URL not set")
+def test_sync_trees_against_database(monkeypatch):
+    # the tables of the migrations are not touched, both tables are created by the test
+    monkeypatch.setattr(sync, 'create_trees_table', lambda engine: None)
+    engine = create_engine(test_database_url)
+    suffix = uuid.uuid4().hex[:8]
+    trees_table = f"trees_sync_test_{suffix}"
+    tmp_table = f"trees_tmp_sync_test_{suffix}"
+    try:
+        with engine.connect() as conn:
+            conn.execute(text(f'''
+                CREATE TABLE public."{trees_table}" (
+                    id text PRIMARY KEY, lat text, lng text, artdtsch text, artbot text, gattungdeutsch text,
+                    gattung text, standortnr text, strname text, pflanzjahr text, stammumfg text, kronedurch text,
+                    baumhoehe text, bezirk text, geom geometry, zuletztakt timestamp, radolan_sum int4,
+                    radolan_days _int4
+                )
+            '''))
+            conn.execute(text(f'''
+                CREATE TABLE public."{tmp_table}" (
+                    id text, strname text, artbot text, artdtsch text, standortnr text, baumhoehe int4,
+                    stammdurch int4, kronedurch int4, aend_dat timestamp, gattung text, gattungdeutsch text,
+                    pflanzjahr int4, stammumfg float8, lat float8, lng float8, bezirk text, geom geometry(Point, 4326)
+                )
+            '''))
+            for id in ["1", "2", "3", "4"]:
+                insert_staging_tree(conn, tmp_table, id, f"S{id}")
+            # trees from OpenStreetMap are not part of the staging table
+            conn.execute(text(f'''
+                INSERT INTO public."{trees_table}" (id, standortnr, strname) VALUES ('5', 'osm_5', 'Parkweg')
+            '''))
+            conn.commit()
+
+        counts = sync.sync_trees(engine, trees_table, tmp_table)
+        assert counts == {"deleted": 0, "inserted": 4, "updated": 0}
+        # the casts of the staging columns hash like the stored text, so unchanged trees are not written
+        assert sync.sync_trees(engine, trees_table, tmp_table) == {"deleted": 0, "inserted": 0, "updated": 0}
+
+        with engine.connect() as conn:
+            conn.execute(text(f'''
+                UPDATE public."{trees_table}" SET radolan_sum = 10, radolan_days = ARRAY[4, 6]
+            '''))
+            conn.execute(text(f'''
+                DELETE FROM public."{tmp_table}" WHERE id = '4'
+            '''))
+            conn.execute(text(f'''
+                UPDATE public."{tmp_table}" SET strname = 'Nebenstr.' WHERE id = '2'
+            '''))
+            conn.execute(text(f'''
+                UPDATE public."{tmp_table}" SET lng = 12.38, geom = ST_SetSRID(ST_MakePoint(12.38, 51.34), 4326)
+                WHERE id = '3'
+            '''))
+            # the staging table may hold a tree twice, it is inserted once
+            insert_staging_tree(conn, tmp_table, "6", "S6")
+            insert_staging_tree(conn, tmp_table, "6", "S6")
+            conn.commit()
+
+        counts = sync.sync_trees(engine, trees_table, tmp_table)
+        assert counts == {"deleted": 1, "inserted": 1, "updated": 2}
+        with engine.connect() as conn:
+            assert get_trees(conn, trees_table) == {
+                "1": ("Hauptstr.", 10, [4, 6]),
+                "2": ("Nebenstr.", 10, [4, 6]),
+                # moved, so its radolan days are left to the backfill
+                "3": ("Hauptstr.", None, None),
+                "5": ("Parkweg", 10, [4, 6]),
+                "6": ("Hauptstr.", None, None),
+            }
+
+        # delta sync, the removed trees are given by id, trees from OpenStreetMap are still kept
+        with engine.connect() as conn:
+            conn.execute(text(f'TRUNCATE public."{tmp_table}"'))
+            conn.commit()
+        counts = sync.sync_trees(engine, trees_table, tmp_table, removed_ids=["1", "5"])
+        assert counts == {"deleted": 1, "inserted": 0, "updated": 0}
+        with engine.connect() as conn:
+            assert sorted(get_trees(conn, trees_table)) == ["2", "3", "5", "6"]
+    finally:
+        with engine.connect() as conn:
+            conn.execute(text(f'DROP TABLE IF EXISTS public."{trees_table}", public."{tmp_table}"'))
+            conn.commit()
@@ -0,0 +1,49 @@
+import geopandas as gpd
+import pandas as pd
+
+from treedata.trees.tree_snapshot import get_source_fingerprints, diff_with_snapshot, fingerprint_column, \
+    get_transform_key, read_snapshot, write_snapshot
+
+
+def test_diff_with_snapshot():
+    old_trees = gpd.GeoDataFrame({
+        'objectid': [1, 2, 3, 4],
+        'st_durchm': [10.0, 20.0, 30.0, 40.0],
+    }, geometry=gpd.points_from_xy([12.1, 12.2, 12.3, 12.4], [51.3] * 4), crs=4326)
+    snapshot = gpd.GeoDataFrame({
+        'id': pd.array(["1", "2", "3", "4"], dtype='string[pyarrow]'),
+        'stammdurch': [10, 20, 30, 40],
+        fingerprint_column: get_source_fingerprints(old_trees),
+    }, geometry=old_trees.geometry, crs=4326)
+
+    # 1 unchanged, 2 moved, 3 removed, 4 with a new diameter, 5 added, 6 duplicate of 1
+    new_trees = gpd.GeoDataFrame({
+        'objectid': [1, 2, 4, 5, 1],
+        'st_durchm': [10.0, 20.0, 41.0, 50.0, 11.0],
+    }, geometry=gpd.points_from_xy([12.1, 12.25, 12.4, 12.5, 12.1], [51.3] * 5), crs=4326, index=[10, 11, 12, 13, 14])
+    diff = diff_with_snapshot(new_trees, get_source_fingerprints(new_trees), snapshot)
+
+    assert list(diff['to_transform']['objectid']) == [2, 4, 5]
+    assert diff['added_ids'] == ["5"]
+    assert diff['removed_ids'] == ["3"]
+    assert list(diff['reused_trees'].index) == [10]
+    assert list(diff['reused_trees']['stammdurch']) == [10]
+    assert fingerprint_column not in diff['reused_trees']
+
+
+def test_snapshot_is_stale_after_configuration_change(tmp_path):
+    config_path = f"{tmp_path}/conf.yml"
+    with open(config_path, 'w') as f:
+        f.write("stammdurch: st_durchm\n")
+    transform_key = get_transform_key([config_path], year=2024)
+    assert get_transform_key([config_path], year=2025) != transform_key
+
+    source_trees = gpd.GeoDataFrame({'objectid': [1]}, geometry=gpd.points_from_xy([12.1], [51.3]), crs=4326)
+    transformed_trees = gpd.GeoDataFrame({'id': ["1"]}, geometry=source_trees.geometry, crs=4326)
+    file_path = f"{tmp_path}/trees-snapshot.parquet"
+    write_snapshot(file_path, transformed_trees, get_source_fingerprints(source_trees), transform_key)
+    assert list(read_snapshot(file_path, transform_key)['id']) == ["1"]
+
+    with open(config_path, 'w') as f:
+        f.write("stammdurch: stammdurch\n")
+    assert read_snapshot(file_path, get_transform_key([config_path], year=2024)) is None
@@ -0,0 +1,59 @@
+import argparse
+import os
+
+import geopandas as gpd
+import pandas as pd
+
+from treedata import trees_process
+
+
+def run_in_batches(tmp_path, monkeypatch, trees, batch_size):
+    calls = []
+    monkeypatch.setattr(trees_process, 'ROOT_DIR', str(tmp_path))
+    monkeypatch.setattr(trees_process, 'get_db_engine', lambda: 'engine')
+    monkeypatch.setattr(trees_process, 'prepare_staging_table',
+                        lambda engine, table_name: calls.append(('prepare', table_name)))
+    monkeypatch.setattr(trees_process, 'copy_to_staging_table',
+                        lambda engine, data, table_name: calls.append(('copy', list(data['id']))))
+    monkeypatch.setattr(trees_process, 'build_staging_indexes',
+                        lambda engine, table_name: calls.append(('index', table_name)))
+    monkeypatch.setattr(trees_process, 'sync_trees', lambda **kwargs: calls.append(('sync', kwargs['tmp_tree_table'])))
+
+    os.makedirs(f"{tmp_path}/resources/trees")
+    trees.to_parquet(f"{tmp_path}/resources/trees/trees-transformed.parquet")
+    parser = argparse.ArgumentParser()
+    trees_process.configure_trees_process_args(parser)
+    args = parser.parse_args([
+        '--skip-transform', '--skip-store-as-geojson', '--batch-size', str(batch_size)
+    ])
+    trees_process.handle_trees_process_in_batches(args, None, {}, {})
+    return calls
+
+
+def test_trees_process_in_batches(tmp_path, monkeypatch):
+    trees = gpd.GeoDataFrame({
+        'id': ["1", "2", "3"],
+        'aend_dat': ["2023-12-23", None, "2024-01-02"],
+    }, geometry=gpd.points_from_xy([12.3, 12.31, 12.32], [51.3] * 3), crs=4326)
+    calls = run_in_batches(tmp_path, monkeypatch, trees, 2)
+    assert calls == [
+        ('prepare', 'trees_tmp'),
+        ('copy', ["1", "2"]),
+        ('copy', ["3"]),
+        ('index', 'trees_tmp'),
+        ('sync', 'trees_tmp')
+    ]
+
+
+def test_trees_process_in_batches_clears_staging_table_for_empty_source(tmp_path, monkeypatch):
+    trees = gpd.GeoDataFrame({
+        'id': pd.Series([], dtype=str),
+        'aend_dat': pd.Series([], dtype=str),
+    }, geometry=gpd.GeoSeries([], crs=4326))
+    calls = run_in_batches(tmp_path, monkeypatch, trees, 2)
+    # the trees of the previous run must not be synced again
+    assert calls == [
+        ('prepare', 'trees_tmp'),
+        ('index', 'trees_tmp'),
+        ('sync', 'trees_tmp')
+    ]
@@ -0,0 +1,8 @@
+from treedata.trees.unique_ids import UniqueIds
+
+
+def test_unique_ids_across_batches():
+    unique_ids = UniqueIds()
+    assert list(unique_ids.add([3, 1, 3, 2])) == [True, True, False, True]
+    assert list(unique_ids.add([4, 2, 5, 4])) == [True, False, True, False]
+    assert len(unique_ids) == 5
@@ -1,25 +1,16 @@
-import datetime
+from treedata.radolan.update_tree_radolan_days import get_changed_cells, get_cell_vector_hash
 
-from treedata.radolan.update_tree_radolan_days import get_sorted_cleaned_grid
-import os
-import pandas as pd
 
-ROOT_DIR = os.path.abspath(os.curdir)
-
-
-def test_get_sorted_cleaned_grid():
-    path = f'{ROOT_DIR}/resources_test/radolan/weather_data_grid_cells.csv'
-    columns = ["id", "st_asgeojson", "measured_at", "value"]
-    df = pd.read_csv(path, sep=";", names=columns)
-    grid = []
-    for _, row in df.iterrows():
-        grid.append([row[0], row[1],
-                     [datetime.datetime.strptime(x, '%Y-%m-%d %H:%M:%S') for x in row[2].split(",")],
-                     [int(x) for x in row[3].split(",")]])
-    now = datetime.datetime(2023, 7, 28, 15, 47, 30)
-    timelimit_days = 30
-    cleaned = get_sorted_cleaned_grid(grid, timelimit_days, now)
-    assert len(cleaned) > 0
-    # values of row 8 in csv
-    assert cleaned[7][27] == 3
-    assert cleaned[7][28] == 6
+def test_get_changed_cells():
+    zero_hash = get_cell_vector_hash([0, 0, 0])
+    values = [
+        [[0, 2, 1], 3, '{}', 1],
+        [[0, 0, 4], 4, '{}', 2],
+        [[0, 0, 0], 0, '{}', 3],
+    ]
+    applied_hashes = {1: get_cell_vector_hash([0, 2, 1]), 2: get_cell_vector_hash([0, 4, 0]), 4: "a", 5: zero_hash}
+    changed_cells, zero_geom_ids, cell_hashes = get_changed_cells(values, applied_hashes, 3)
+    # cell 1 is unchanged, cell 4 dropped out of the window and cell 5 was all zero before already
+    assert changed_cells == [(2, [0, 0, 4], 4)]
+    assert zero_geom_ids == [3, 4]
+    assert cell_hashes == {2: get_cell_vector_hash([0, 0, 4]), 3: zero_hash, 4: zero_hash}
@@ -0,0 +1,121 @@
+import datetime
+import json
+import threading
+
+import pytest
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+
+from treedata.utils.wfs_harvester import harvest_wfs_pages, convert_pages_to_geojson, choose_output_format, \
+    get_service_url, get_page_paths, get_response_fingerprint, response_metadata_size
+
+feature_count = 25
+
+capabilities = b'''<?xml version="1.0" encoding="UTF-8"?>
+<wfs:WFS_Capabilities xmlns:wfs="http://www.opengis.net/wfs/2.0" xmlns:ows="http://www.opengis.net/ows/1.1">
+  <ows:OperationsMetadata>
+    <ows:Operation name="GetFeature">
+      <ows:Parameter name="outputFormat">
+        <ows:AllowedValues>
+          <ows:Value>application/gml+xml; version=3.2</ows:Value>
+          <ows:Value>application/json</ows:Value>
+        </ows:AllowedValues>
+      </ows:Parameter>
+    </ows:Operation>
+    <ows:Constraint name="ImplementsResultPaging">
+      <ows:NoValues/>
+      <ows:DefaultValue>TRUE</ows:DefaultValue>
+    </ows:Constraint>
+  </ows:OperationsMetadata>
+</wfs:WFS_Capabilities>'''
+
+
+# minimal WFS 2.0 stand-in serving a layer of feature_count points as paged GeoJSON
+class WfsHandler(BaseHTTPRequestHandler):
+    requests = []
+
+    def do_GET(self):
+        params = {key.lower(): values[0] for key, values in parse_qs(urlsplit(self.path).query).items()}
+        WfsHandler.requests.append(params)
+        if params['request'] == 'GetCapabilities':
+            body = capabilities
+        elif params.get('resulttype') == 'hits':
+            body = (f'<wfs:FeatureCollection xmlns:wfs="http://www.opengis.net/wfs/2.0" '
+                    f'numberMatched="{feature_count}" numberReturned="0"/>').encode()
+        else:
+            start = int(params.get('startindex', 0))
+            end = min(start + int(params.get('count', feature_count)), feature_count)
+            body = json.dumps({"type": "FeatureCollection", "features": [{
+                "type": "Feature",
+                "properties": {"objectid": index, "letzte_bewaesserung": "2023-07-08"},
+                "geometry": {"type": "Point", "coordinates": [12.3 + index / 1000, 51.3]}
+            } for index in range(start, end)], "timeStamp": datetime.datetime.now().isoformat()}).encode()
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def test_harvest_wfs_pages(tmp_path):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), WfsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        wfs_url = f"http://127.0.0.1:{server.server_port}/wfs?REQUEST=GetCapabilities&SERVICE=WFS"
+        assert harvest_wfs_pages(wfs_url, 'OpenData:Baeume', f"{tmp_path}/pages", page_size=10, workers=3)
+        # same content again, without validators and with another timeStamp recognized by its fingerprint
+        assert not harvest_wfs_pages(wfs_url, 'OpenData:Baeume', f"{tmp_path}/pages", page_size=10, workers=3)
+    finally:
+        server.shutdown()
+    assert get_page_paths(f"{tmp_path}/pages") == [
+        f"{tmp_path}/pages/page-00000.json", f"{tmp_path}/pages/page-00001.json", f"{tmp_path}/pages/page-00002.json"
+    ]
+    page_requests = [params for params in WfsHandler.requests if 'startindex' in params]
+    assert sorted(int(params['startindex']) for params in page_requests) == [0, 0, 10, 10, 20, 20]
+    assert all(params['outputformat'] == 'application/json' for params in page_requests)
+    assert all(params['sortby'] == 'objectid' for params in page_requests)
+
+    assert convert_pages_to_geojson(f"{tmp_path}/pages", 'iso-8859-1', f"{tmp_path}/trees") == feature_count
+    with open(f"{tmp_path}/trees.geojson") as f:
+        features = json.load(f)["features"]
+    assert [feature["properties"]["objectid"] for feature in features] == list(range(feature_count))
+    assert [feature["id"] for feature in features] == [str(index) for index in range(feature_count)]
+    assert features[0]["properties"]["letzte_bewaesserung"] == "2023-07-08"
+
+
+def test_harvest_wfs_pages_needs_sort_key(tmp_path):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), WfsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        wfs_url = f"http://127.0.0.1:{server.server_port}/wfs"
+        with pytest.raises(Exception, match="sort key"):
+            harvest_wfs_pages(wfs_url, 'OpenData:Baeume', f"{tmp_path}/pages", page_size=10, sort_by=None)
+        # a single page has a stable order anyway
+        assert harvest_wfs_pages(wfs_url, 'OpenData:Baeume', f"{tmp_path}/pages", page_size=feature_count,
+                                 sort_by=None)
+    finally:
+        server.shutdown()
+
+
+def test_choose_output_format():
+    assert choose_output_format(["text/xml; subtype=gml/3.2", "GEOJSON"]) == "GEOJSON"
+    assert choose_output_format(["text/xml; subtype=gml/3.2"]) is None
+    assert choose_output_format(["application/json"], "text/xml") == "text/xml"
+    assert get_service_url("https://example.org/wfs?REQUEST=GetCapabilities&SERVICE=WFS&key=1") == \
+           "https://example.org/wfs?key=1"
+
+
+def test_get_response_fingerprint(tmp_path):
+    def fingerprint(content):
+        with open(f"{tmp_path}/response.xml", 'wb') as f:
+            f.write(content)
+        return get_response_fingerprint(f"{tmp_path}/response.xml")
+
+    features = b'<wfs:member>tree</wfs:member>' * (response_metadata_size // 10)
+    first = b'<wfs:FeatureCollection timeStamp="2024-01-01T10:00:00" numberMatched="1">' + features
+    second = b'<wfs:FeatureCollection timeStamp="2024-01-02T11:30:00" numberMatched="1">' + features
+    assert fingerprint(first) == fingerprint(second)
+    assert fingerprint(first) != fingerprint(first.replace(b'numberMatched="1"', b'numberMatched="2"'))
+    assert fingerprint(b'{"features": [], "timeStamp": "a"}') == fingerprint(b'{"features": [], "timeStamp": "b"}')
@@ -0,0 +1,92 @@
+import datetime
+import os
+
+import numpy as np
+import pytest
+from pyproj import CRS
+
+from treedata.radolan import write_radolan_cog as cog
+from treedata.radolan.polygonize_weather_data import radolan_proj
+
+
+def read_header(file_path):
+    with open(file_path) as f:
+        return dict(line.split(maxsplit=1) for line in f.read().splitlines())
+
+
+def test_write_ehdr_raster(tmp_path):
+    file_path = f"{tmp_path}/weather-raw"
+    bands = np.arange(2 * 3 * 4, dtype='<i2').reshape((2, 3, 4))
+    cog.write_ehdr_raster(file_path, bands, (1000.0, -4000.0))
+
+    header = read_header(f"{file_path}.hdr")
+    assert header["BYTEORDER"] == "I"
+    assert header["LAYOUT"] == "BSQ"
+    assert (header["NBANDS"], header["NROWS"], header["NCOLS"]) == ("2", "3", "4")
+    assert (header["NBITS"], header["PIXELTYPE"]) == ("16", "SIGNEDINT")
+    # EHdr places the upper left map coordinates on the center of the upper left cell
+    assert float(header["ULXMAP"]) == 1500.0
+    assert float(header["ULYMAP"]) == -4500.0
+    assert float(header["XDIM"]) == float(header["YDIM"]) == cog.radolan_cell_size
+    assert int(header["NODATA"]) == cog.nodata_value
+
+    # little endian band sequential, one full band after the other
+    raw = np.fromfile(f"{file_path}.bsq", dtype='<i2')
+    assert raw.tolist() == bands.ravel().tolist()
+    assert os.path.getsize(f"{file_path}.bsq") == bands.size * 2
+
+    with open(f"{file_path}.prj") as f:
+        assert CRS.from_wkt(f.read()).equals(CRS.from_proj4(radolan_proj))
+
+
+def test_get_cell_raster_positions_without_cells():
+    with pytest.raises(Exception, match="grid geometries are empty"):
+        cog.get_cell_raster_positions({})
+
+
+def test_get_rainfall_bands():
+    cell_ids = [3, 7, 9]
+    rows = np.array([0, 0, 1])
+    cols = np.array([0, 1, 1])
+    grid = [(7, None, None, None), (3, None, None, None)]
+    clean = [[4, 5], [1, 2]]
+    bands = cog.get_rainfall_bands(grid, clean, cell_ids, rows, cols)
+    assert bands.dtype == np.dtype('<i2')
+    assert bands.shape == (2, 2, 2)
+    # cell 9 has no rain, the lower left corner is not part of the grid
+    assert bands[0].tolist() == [[1, 4], [cog.nodata_value, 0]]
+    assert bands[1].tolist() == [[2, 5], [cog.nodata_value, 0]]
+
+
+def test_write_radolan_cog(tmp_path, monkeypatch):
+    calls = []
+
+    def call(cmdline):
+        calls.append(cmdline)
+        raw_file_path = cmdline[cmdline.index('gdal_translate') + 1]
+        assert os.path.isfile(raw_file_path)
+        assert os.path.isfile(raw_file_path.replace('.bsq', '.prj'))
+        return 0
+
+    monkeypatch.setattr(cog.subprocess, 'call', call)
+    grid_geometries = {
+        1: '{"type":"Polygon","coordinates":[[[12.3,51.3],[12.31,51.3],[12.31,51.31],[12.3,51.31],[12.3,51.3]]]}',
+    }
+    file_name = cog.write_radolan_cog(
+        path=f"{tmp_path}/",
+        start_date=datetime.datetime(2023, 7, 1),
+        end_date=datetime.datetime(2023, 7, 2),
+        grid=[(1, None, None, None)],
+        clean=[[3, 4]],
+        grid_geometries=grid_geometries
+    )
+    assert file_name == "weather.tif"
+    assert len(calls) == 1
+    cmdline = calls[0]
+    assert cmdline[cmdline.index("-of") + 1] == "COG"
+    assert cmdline[cmdline.index("-a_nodata") + 1] == str(cog.nodata_value)
+    assert "START=2023-07-01T00:00:00" in cmdline
+    # creation options understood by the GDAL versions installed by conda
+    assert not any(option.startswith("INTERLEAVE=") for option in cmdline)
+    # the raw raster is only an intermediate
+    assert not any(name.startswith("weather-raw") for name in os.listdir(tmp_path))
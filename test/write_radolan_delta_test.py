@@ -0,0 +1,66 @@
+import csv
+import json
+
+import pyarrow as pa
+
+from treedata.radolan.write_radolan_csvs import trees_export_schema
+from treedata.radolan.write_radolan_delta import write_trees_delta, publish_trees_delta, read_export_snapshot, \
+    get_export_sequence, with_export_sequence
+
+
+def get_trees(rows):
+    return pa.Table.from_pylist([
+        {"id": id, "lng": 12.37, "lat": 51.34, "radolan_sum": radolan_sum, "radolan_sum_total": total, "age": 10.0}
+        for id, radolan_sum, total in rows
+    ], schema=trees_export_schema)
+
+
+def read_manifest(path, file_name="trees-delta.json"):
+    with open(f"{path}{file_name}") as f:
+        return json.load(f)
+
+
+def test_write_trees_delta(tmp_path):
+    path = f"{tmp_path}/"
+    assert get_export_sequence(path) == 1
+    files = write_trees_delta(get_trees([("1", 10, 30), ("2", 0, 0), ("3", 5, 5)]), path)
+    assert sorted(files.values()) == [
+        "trees-delta-000001.csv", "trees-delta-000001.csv.gz", "trees-delta-000001.json", "trees-delta.json"
+    ]
+    publish_trees_delta(path)
+    assert get_export_sequence(path) == 2
+
+    files = write_trees_delta(with_export_sequence(get_trees([("1", 10, 30), ("2", 4, 4), ("4", None, 0)]), 2), path)
+    assert "trees-delta-000002.csv" in files.values()
+    with open(f"{path}trees-delta-000002.csv", newline='') as f:
+        assert list(csv.reader(f)) == [['id', 'radolan_sum', 'total'], ['2', '4', '4'], ['4', '', '0']]
+    manifest = {
+        "sequence": 2, "previous_sequence": 1, "file": "trees-delta-000002.csv", "changed": 2, "removed": ["3"]
+    }
+    assert read_manifest(path) == manifest
+    # kept per sequence, so that clients which missed a run can still replay its removals
+    assert read_manifest(path, "trees-delta-000002.json") == manifest
+    # not published, e.g. as the upload failed, so the next run builds its delta against the first export again,
+    # but does not use the sequence number of the failed run again
+    assert read_export_snapshot(f"{path}trees-export-snapshot.parquet")[1] == 1
+    assert get_export_sequence(path) == 3
+    write_trees_delta(get_trees([("1", 10, 30), ("2", 4, 4), ("4", None, 0)]), path)
+    assert read_manifest(path)["sequence"] == 3
+    assert read_manifest(path)["previous_sequence"] == 1
+    publish_trees_delta(path)
+
+    # an unchanged run still continues the sequence with an empty delta
+    write_trees_delta(get_trees([("1", 10, 30), ("2", 4, 4), ("4", None, 0)]), path)
+    assert read_manifest(path) == {
+        "sequence": 4, "previous_sequence": 3, "file": "trees-delta-000004.csv", "changed": 0, "removed": []
+    }
+
+
+def test_get_export_sequence_continues_the_published_sequence(tmp_path):
+    path = f"{tmp_path}/"
+    # the cached snapshot is lost, the sequence must not restart at 1 as clients are already at 7
+    assert get_export_sequence(path, 7) == 8
+    write_trees_delta(with_export_sequence(get_trees([("1", 10, 30)]), 8), path)
+    # without a snapshot the delta contains all trees and applies to no published sequence
+    assert read_manifest(path)["previous_sequence"] == 0
+    assert get_export_sequence(path, 7) == 9
@@ -0,0 +1,71 @@
+import json
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
+
+from treedata.radolan.spatial_keys import hilbert_index, get_hilbert_indexes
+from treedata.radolan.write_radolan_csvs import trees_export_schema
+from treedata.radolan.write_radolan_delta import with_export_sequence
+from treedata.radolan.write_radolan_geoarrow import write_geoarrow_content
+
+
+def test_hilbert_index():
+    assert hilbert_index([0, 0, 1, 1], [0, 1, 1, 0], order=1).tolist() == [0, 1, 2, 3]
+    x, y = np.meshgrid(range(16), range(16))
+    indexes = hilbert_index(x.ravel(), y.ravel(), order=4)
+    assert sorted(indexes.tolist()) == list(range(256))
+    # each cell along the curve is a neighbour of the one before
+    order = np.argsort(indexes)
+    steps = np.abs(np.diff(x.ravel()[order])) + np.abs(np.diff(y.ravel()[order]))
+    assert np.all(steps == 1)
+
+
+def test_write_geoarrow_content(tmp_path):
+    rng = np.random.default_rng(3)
+    count = 1000
+    lng = rng.uniform(12.25, 12.5, count)
+    lat = rng.uniform(51.25, 51.45, count)
+    trees = pa.Table.from_pylist([{
+        "id": f"tree-{index}", "lng": lng[index], "lat": lat[index], "radolan_sum": index % 50,
+        "radolan_sum_total": index % 50, "age": None if index % 10 == 0 else 5.0
+    } for index in range(count)], schema=trees_export_schema)
+    files = write_geoarrow_content(trees, f"{tmp_path}/", "trees", row_group_size=100)
+    assert sorted(files.values()) == ["trees.feather", "trees.parquet"]
+
+    parquet_file = pq.ParquetFile(f"{tmp_path}/trees.parquet")
+    geo = json.loads(parquet_file.schema_arrow.metadata[b'geo'])
+    assert geo['columns']['geometry']['encoding'] == 'point'
+    assert geo['columns']['geometry']['bbox'] == [lng.min(), lat.min(), lng.max(), lat.max()]
+    assert parquet_file.metadata.num_row_groups == 10
+    table = parquet_file.read()
+    x = table['geometry'].combine_chunks().field('x').to_numpy()
+    y = table['geometry'].combine_chunks().field('y').to_numpy()
+    assert np.all(np.diff(get_hilbert_indexes(x, y)) >= 0)
+    assert sorted(table['id'].to_pylist()) == sorted(trees['id'].to_pylist())
+    ages = dict(zip(table['id'].to_pylist(), table['age'].to_pylist()))
+    assert ages['tree-0'] == 10 and ages['tree-1'] == 5
+    # row groups cover compact areas, much smaller than the whole extent
+    group_widths = []
+    for group in range(parquet_file.metadata.num_row_groups):
+        statistics = {parquet_file.metadata.row_group(group).column(column).path_in_schema:
+                      parquet_file.metadata.row_group(group).column(column).statistics
+                      for column in range(parquet_file.metadata.num_columns)}
+        group_widths.append(statistics['geometry.x'].max - statistics['geometry.x'].min)
+    assert np.mean(group_widths) < 0.5 * (lng.max() - lng.min())
+
+    feather_table = feather.read_table(f"{tmp_path}/trees.feather")
+    assert feather_table.schema.field('geometry').metadata[b'ARROW:extension:name'] == b'geoarrow.point'
+    assert str(feather_table.schema.field('age').type).startswith('dictionary')
+    assert feather_table['id'].to_pylist() == table['id'].to_pylist()
+
+
+def test_write_geoarrow_content_with_sequence(tmp_path):
+    trees = pa.Table.from_pylist([
+        {"id": "1", "lng": 12.37, "lat": 51.34, "radolan_sum": 10, "radolan_sum_total": 30, "age": 25.0}
+    ], schema=trees_export_schema)
+    write_geoarrow_content(with_export_sequence(trees, 5), f"{tmp_path}/", "trees")
+    assert pq.read_schema(f"{tmp_path}/trees.parquet").metadata[b'sequence'] == b'5'
+    assert b'geo' in pq.read_schema(f"{tmp_path}/trees.parquet").metadata
+    assert feather.read_table(f"{tmp_path}/trees.feather").schema.metadata[b'sequence'] == b'5'
@@ -0,0 +1,74 @@
+import gzip
+import math
+import sqlite3
+
+import mapbox_vector_tile
+import numpy as np
+import pandas as pd
+
+from treedata.radolan.write_radolan_mvts import write_radolan_mvts, get_world_coordinates, quantize
+
+
+def write_trees_csv(path, count):
+    rng = np.random.default_rng(7)
+    pd.DataFrame({
+        'id': [f"tree-{index}" for index in range(count)],
+        'lng': rng.uniform(12.25, 12.5, count),
+        'lat': rng.uniform(51.25, 51.45, count),
+        'radolan_sum': rng.integers(0, 500, count),
+        'age': rng.integers(1, 100, count)
+    }).to_csv(f"{path}/trees.csv", index=False)
+
+
+def test_quantize():
+    lng, lat = 12.3731, 51.3397
+    world_x, world_y = get_world_coordinates(np.array([lng, 12.4]), np.array([lat, 51.3]))
+    tile_x, tile_y, pixel_x, pixel_y = quantize(world_x, world_y, 14)
+    # slippy map tile numbering
+    n = 2 ** 14
+    assert tile_x[0] == int((lng + 180) / 360 * n)
+    assert tile_y[0] == int((1 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2 * n)
+    assert 0 <= pixel_x[0] < 4096 and 0 <= pixel_y[0] < 4096
+
+
+def read_tiles(file_path):
+    with sqlite3.connect(file_path) as connection:
+        metadata = dict(connection.execute('SELECT name, value FROM metadata').fetchall())
+        tiles = {(zoom, column, row): data for zoom, column, row, data in connection.execute(
+            'SELECT zoom_level, tile_column, tile_row, tile_data FROM tiles')}
+    return metadata, tiles
+
+
+def test_write_radolan_mvts(tmp_path):
+    write_trees_csv(tmp_path, 2000)
+    files = write_radolan_mvts(f"{tmp_path}/", min_zoom=10, max_zoom=14, cluster_max_zoom=12)
+    assert list(files.values()) == ["trees.mbtiles"]
+    file_path = list(files)[0]
+    metadata, tiles = read_tiles(file_path)
+    assert metadata['format'] == 'pbf'
+    assert (metadata['minzoom'], metadata['maxzoom']) == ('10', '14')
+
+    trees = pd.read_csv(f"{tmp_path}/trees.csv")
+    world_x, world_y = get_world_coordinates(trees['lng'].to_numpy(), trees['lat'].to_numpy())
+    for zoom in range(10, 15):
+        features = []
+        for (tile_zoom, tile_column, tile_row), data in tiles.items():
+            if tile_zoom == zoom:
+                layer = mapbox_vector_tile.decode(gzip.decompress(data), default_options={"y_coord_down": True})
+                tile_y = 2 ** zoom - 1 - tile_row
+                features += [(tile_column, tile_y, feature) for feature in layer['trees']['features']]
+        if zoom <= 12:
+            # clusters cover all trees with fewer features
+            assert sum(feature['properties']['count'] for _, _, feature in features) == 2000
+            assert len(features) < 2000
+        else:
+            positions = zip(*quantize(world_x, world_y, zoom))
+            expected = {f"tree-{index}": position for index, position in enumerate(positions)}
+            assert {feature['properties']['id']: (tile_x, tile_y, *feature['geometry']['coordinates'])
+                    for tile_x, tile_y, feature in features} == expected
+            assert all(feature['properties']['age'] == trees['age'][int(feature['properties']['id'][5:])]
+                       for _, _, feature in features)
+
+    # same archive when encoded by worker processes
+    write_radolan_mvts(f"{tmp_path}/", min_zoom=10, max_zoom=14, cluster_max_zoom=12, workers=2)
+    assert read_tiles(file_path)[1].keys() == tiles.keys()
@@ -0,0 +1,37 @@
+import datetime
+import json
+import os
+
+from treedata.radolan.write_radolan_values import write_radolan_values, read_values_binary
+
+
+def test_write_radolan_values(tmp_path):
+    path = f"{tmp_path}/"
+    grid_geometries = {
+        7: '{"type":"Point","coordinates":[12.1,51.1]}',
+        3: '{"type":"Point","coordinates":[12.2,51.2]}'
+    }
+    grid = [(3, grid_geometries[3], None, None), (7, grid_geometries[7], None, None)]
+    clean = [[0, 2, 5], [1, 0, 0]]
+    grid_file_name = write_radolan_values(
+        path=path,
+        start_date=datetime.datetime(2023, 7, 1),
+        end_date=datetime.datetime(2023, 7, 3),
+        grid=grid,
+        clean=clean,
+        grid_version="2-3-7",
+        grid_geometries=grid_geometries
+    )
+    assert grid_file_name == "weather_grid-2-3-7.geojson"
+    assert os.path.isfile(f"{path}{grid_file_name}")
+
+    with open(f"{path}weather_values.json") as f:
+        manifest = json.load(f)
+    assert manifest["grid"] == grid_file_name
+    assert manifest["ids"] == [3, 7]
+    assert manifest["sums"] == [7, 1]
+
+    ids, sums, daily = read_values_binary(f"{path}weather_values.bin")
+    assert ids.tolist() == [3, 7]
+    assert sums.tolist() == [7, 1]
+    assert daily.tolist() == clean
@@ -1,11 +1,9 @@
 import argparse
+import importlib
 import logging
 import os
+import sys
 import time
-from trees_wfs import configure_trees_args
-from trees_shape import configure_trees_args as configure_trees_shape_args
-from trees_process import configure_trees_process_args
-from weather import configure_weather_args
 from dotenv import load_dotenv
 
 
@@ -17,26 +15,38 @@ logging.basicConfig(format=FORMAT)
 logger.setLevel(logging.DEBUG)
 logging.getLogger("fiona.ogrext").setLevel(logging.WARNING)
 
-start = time.time()
-load_dotenv(f'{ROOT_DIR}/resources/.env')
+# action: (module, function configuring its arguments, help), a module is only imported when its action is run,
+# so that an action does not pay for the imports of all the others
+subcommands = {
+    'trees': ('trees_wfs', 'configure_trees_args', "Download and process tree data"),
+    'trees-shp': ('trees_shape', 'configure_trees_args', "Download and process tree data from shapefile"),
+    'trees_process': ('trees_process', 'configure_trees_process_args', "Transform and upload tree data"),
+    'weather': ('weather', 'configure_weather_args', "Download and process DWD radolan data"),
+    'schema': ('schema', 'configure_schema_args', "Migrate and check database schema"),
+}
 
-parser = argparse.ArgumentParser(description='Processing city shape, tree data and weather data')
-subparsers = parser.add_subparsers(help='actions', dest='action')
 
-trees_parser = subparsers.add_parser('trees', help="Download and process tree data")
-configure_trees_args(trees_parser)
+def get_action(argv):
+    # the main parser has no options taking a value, so the first positional argument is the action
+    return next((arg for arg in argv if not arg.startswith('-')), None)
 
-trees_shape_parser = subparsers.add_parser('trees-shp', help="Download and process tree data from shapefile")
-configure_trees_shape_args(trees_shape_parser)
 
-trees_process_parser = subparsers.add_parser('trees_process', help="Transform and upload tree data")
-configure_trees_process_args(trees_process_parser)
+# guarded, as worker processes which are not forked import this module again
+if __name__ == '__main__':
+    start = time.time()
+    load_dotenv(f'{ROOT_DIR}/resources/.env')
 
-weather_parser = subparsers.add_parser('weather', help="Download and process DWD radolan data")
-configure_weather_args(weather_parser)
+    parser = argparse.ArgumentParser(description='Processing city shape, tree data and weather data')
+    subparsers = parser.add_subparsers(help='actions', dest='action')
 
-res = parser.parse_args()
-res.func(res)
+    action = get_action(sys.argv[1:])
+    for name, (module_name, configure_name, help_text) in subcommands.items():
+        subparser = subparsers.add_parser(name, help=help_text)
+        if name == action:
+            getattr(importlib.import_module(module_name), configure_name)(subparser)
 
-end = time.time() - start
-logger.info("It took {} seconds to run the script".format(end))
\ No newline at end of file
+    res = parser.parse_args()
+    res.func(res)
+
+    end = time.time() - start
+    logger.info("It took {} seconds to run the script".format(end))
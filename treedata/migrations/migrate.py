@@ -0,0 +1,112 @@
+import logging
+
+from sqlalchemy import text
+
+from .versions import migrations, required_indexes
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+# arbitrary key, serializes concurrent pipeline runs migrating the same database
+MIGRATION_LOCK_KEY = 4711
+
+
+def get_applied_versions(conn):
+    conn.execute(text('''
+        CREATE TABLE IF NOT EXISTS "public"."schema_migrations" (
+            "version" int4 NOT NULL,
+            "description" text,
+            "applied_at" timestamp NOT NULL DEFAULT NOW(),
+            PRIMARY KEY ("version")
+        )
+    '''))
+    result = conn.execute(text('SELECT version FROM "public"."schema_migrations"'))
+    return {row[0] for row in result.fetchall()}
+
+
+def apply_migrations(engine, target_version=None):
+    applied_count = 0
+    with engine.connect() as conn:
+        conn.execute(text(f'SELECT pg_advisory_xact_lock({MIGRATION_LOCK_KEY})'))
+        applied_versions = get_applied_versions(conn)
+        for migration in sorted(migrations, key=lambda m: m['version']):
+            version = migration['version']
+            if version in applied_versions:
+                continue
+            if target_version is not None and version > target_version:
+                break
+            logger.info(f"Applying schema migration {version}: {migration['description']}")
+            for statement in migration['statements']:
+                conn.execute(text(statement))
+            conn.execute(
+                text('INSERT INTO "public"."schema_migrations" (version, description) VALUES (:version, :description)'),
+                {"version": version, "description": migration['description']}
+            )
+            applied_count += 1
+        conn.commit()
+    if applied_count > 0:
+        logger.info(f"Applied {applied_count} schema migrations")
+    return applied_count
+
+
+def analyze_tables(engine, table_names):
+    # refresh planner statistics after bulk loads, otherwise the following
+    # joins are planned against the row estimates of the previous run
+    with engine.connect() as conn:
+        for table_name in table_names:
+            conn.execute(text(f'ANALYZE "public"."{table_name}"'))
+        conn.commit()
+    logger.info(f"Analyzed tables {', '.join(table_names)}")
+
+
+def get_existing_indexes(engine):
+    with engine.connect() as conn:
+        result = conn.execute(text('''
+            SELECT
+                t.relname AS table_name,
+                am.amname AS index_method,
+                ARRAY_AGG(a.attname ORDER BY k.ord) AS columns
+            FROM pg_index i
+            JOIN pg_class t ON t.oid = i.indrelid
+            JOIN pg_class ic ON ic.oid = i.indexrelid
+            JOIN pg_am am ON am.oid = ic.relam
+            CROSS JOIN LATERAL UNNEST(i.indkey) WITH ORDINALITY AS k(attnum, ord)
+            JOIN pg_attribute a ON a.attrelid = t.oid AND a.attnum = k.attnum
+            WHERE t.relnamespace = 'public'::regnamespace
+            GROUP BY ic.relname, t.relname, am.amname
+        '''))
+        return [(row[0], row[1], list(row[2])) for row in result.fetchall()]
+
+
+def get_existing_tables(engine):
+    with engine.connect() as conn:
+        result = conn.execute(text('''
+            SELECT tablename FROM pg_tables WHERE schemaname = 'public'
+        '''))
+        return {row[0] for row in result.fetchall()}
+
+
+def find_missing_indexes(existing_indexes, existing_tables, indexes=None):
+    # an index covers a requirement if it uses the same method and starts with the required columns
+    missing = []
+    for table_name, index_method, columns in indexes or required_indexes:
+        if table_name not in existing_tables:
+            continue
+        covered = any(
+            existing_table == table_name and existing_method == index_method
+            and existing_columns[:len(columns)] == columns
+            for existing_table, existing_method, existing_columns in existing_indexes
+        )
+        if not covered:
+            missing.append((table_name, index_method, columns))
+    return missing
+
+
+def check_indexes(engine):
+    existing_tables = get_existing_tables(engine)
+    missing = find_missing_indexes(get_existing_indexes(engine), existing_tables)
+    for table_name, index_method, columns in missing:
+        logger.warning(f"❌ Missing {index_method} index on {table_name} ({', '.join(columns)})")
+    if len(missing) == 0:
+        logger.info("✅ All indexes required by the pipeline exist")
+    return missing
@@ -0,0 +1,157 @@
+# versioned schema migrations for the tables owned by this pipeline,
+# each version is applied once and recorded in public.schema_migrations
+
+migrations = [
+    {
+        "version": 1,
+        "description": "baseline trees and radolan tables",
+        "statements": [
+            'CREATE SEQUENCE IF NOT EXISTS radolan_geometry_id_seq',
+            '''
+            CREATE TABLE IF NOT EXISTS "public"."radolan_geometry" (
+                "id" int4 NOT NULL DEFAULT nextval('radolan_geometry_id_seq'::regclass),
+                "geometry" geometry,
+                "centroid" geometry,
+                PRIMARY KEY ("id")
+            )
+            ''',
+            'CREATE SEQUENCE IF NOT EXISTS radolan_data_id_seq',
+            '''
+            CREATE TABLE IF NOT EXISTS "public"."radolan_data" (
+                "id" int4 NOT NULL DEFAULT nextval('radolan_data_id_seq'::regclass),
+                "measured_at" timestamp,
+                "value" int2,
+                "geom_id" int2,
+                PRIMARY KEY ("id")
+            )
+            ''',
+            '''
+            CREATE TABLE IF NOT EXISTS "public"."trees" (
+                "id" text NOT NULL,
+                "lat" text,
+                "lng" text,
+                "artdtsch" text,
+                "artbot" text,
+                "gattungdeutsch" text,
+                "gattung" text,
+                "standortnr" text,
+                "strname" text,
+                "pflanzjahr" text,
+                "stammdurch" text,
+                "kronedurch" text,
+                "baumhoehe" text,
+                "bezirk" text,
+                "geom" geometry,
+                "zuletztakt" timestamp,
+                "adopted" text,
+                "watered" text,
+                "radolan_sum" int4,
+                "radolan_days" _int4,
+                PRIMARY KEY ("id")
+            )
+            ''',
+        ]
+    },
+    {
+        "version": 2,
+        "description": "indexes for spatial joins, tree sync and radolan aggregation",
+        "statements": [
+            'CREATE INDEX IF NOT EXISTS trees_geom_idx ON "public"."trees" USING GIST ("geom")',
+            'CREATE INDEX IF NOT EXISTS trees_standortnr_idx ON "public"."trees" ("standortnr")',
+            'CREATE INDEX IF NOT EXISTS radolan_geometry_geometry_idx '
+            'ON "public"."radolan_geometry" USING GIST ("geometry")',
+            'CREATE INDEX IF NOT EXISTS radolan_geometry_centroid_idx '
+            'ON "public"."radolan_geometry" USING GIST ("centroid")',
+            'CREATE INDEX IF NOT EXISTS radolan_data_geom_id_measured_at_idx '
+            'ON "public"."radolan_data" ("geom_id", "measured_at")',
+            'CREATE INDEX IF NOT EXISTS radolan_data_measured_at_idx ON "public"."radolan_data" ("measured_at")',
+            # trees_watered is owned by the API, so only index it when it is there
+            '''
+            DO $$
+            BEGIN
+                IF to_regclass('public.trees_watered') IS NOT NULL THEN
+                    CREATE INDEX IF NOT EXISTS trees_watered_tree_id_timestamp_idx
+                    ON "public"."trees_watered" ("tree_id", "timestamp");
+                END IF;
+            END
+            $$
+            ''',
+        ]
+    },
+    {
+        "version": 3,
+        "description": "unlogged trees staging table with a fixed schema for COPY loads",
+        "statements": [
+            # trees_tmp was recreated by to_postgis on every run before, its columns followed the data frame
+            'DROP TABLE IF EXISTS "public"."trees_tmp"',
+            '''
+            CREATE UNLOGGED TABLE "public"."trees_tmp" (
+                "id" text,
+                "strname" text,
+                "artbot" text,
+                "artdtsch" text,
+                "standortnr" text,
+                "baumhoehe" int4,
+                "stammdurch" int4,
+                "kronedurch" int4,
+                "aend_dat" timestamp,
+                "gattung" text,
+                "gattungdeutsch" text,
+                "pflanzjahr" int4,
+                "stammumfg" float8,
+                "lat" float8,
+                "lng" float8,
+                "bezirk" text,
+                "geom" geometry(Point, 4326)
+            )
+            ''',
+        ]
+    },
+    {
+        "version": 4,
+        "description": "trunk circumference column synced from the staging table",
+        "statements": [
+            'ALTER TABLE "public"."trees" ADD COLUMN IF NOT EXISTS "stammumfg" text',
+        ]
+    },
+    {
+        "version": 5,
+        "description": "hash of the radolan days vector last applied to the trees of each cell",
+        "statements": [
+            '''
+            CREATE TABLE IF NOT EXISTS "public"."radolan_cell_state" (
+                "geom_id" int4 NOT NULL,
+                "vector_hash" text NOT NULL,
+                "applied_at" timestamp NOT NULL DEFAULT NOW(),
+                PRIMARY KEY ("geom_id")
+            )
+            ''',
+        ]
+    },
+    {
+        "version": 6,
+        "description": "rolling window of the daily rain per radolan cell",
+        "statements": [
+            '''
+            CREATE TABLE IF NOT EXISTS "public"."radolan_cell_window" (
+                "geom_id" int4 NOT NULL,
+                "window_start" date NOT NULL,
+                "days" int2[] NOT NULL,
+                PRIMARY KEY ("geom_id")
+            )
+            ''',
+        ]
+    },
+]
+
+# indexes the hot queries of the pipeline rely on: (table, index method, leading columns)
+required_indexes = [
+    ("trees", "gist", ["geom"]),
+    ("trees", "btree", ["id"]),
+    ("trees", "btree", ["standortnr"]),
+    ("trees_watered", "btree", ["tree_id", "timestamp"]),
+    ("radolan_geometry", "gist", ["geometry"]),
+    ("radolan_geometry", "gist", ["centroid"]),
+    ("radolan_data", "btree", ["geom_id", "measured_at"]),
+    ("radolan_data", "btree", ["measured_at"]),
+]
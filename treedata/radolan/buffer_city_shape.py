@@ -1,19 +1,77 @@
 # building a buffer shape for filtering the weather data
+import json
+import logging
 import os
+
 import geopandas
+import shapely
 from shapely.ops import unary_union
 
+from utils.source_fetch import file_sha256
+
 ROOT_DIR = os.path.abspath(os.curdir)
+CITY_SHAPE_PATH = f"{ROOT_DIR}/resources/city_shape"
+buffer_crs = "epsg:3857"
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+def get_cache_path(city_shape_path=CITY_SHAPE_PATH):
+    return f"{city_shape_path}/cache"
+
+
+# identifies the content of a file together with the parameters applied to it
+def get_cache_key(file_path, *params):
+    sha256 = file_sha256(file_path)
+    sha256.update(json.dumps([str(param) for param in params]).encode())
+    return sha256.hexdigest()[:32]
 
 
-def create_buffered_city_shape(input_file_name, output_file_name, buffer_radius, simplify_tolerance):
-    city_shape = geopandas.read_file(f"{ROOT_DIR}/resources/city_shape/{input_file_name}.geojson")
-    city_shape = city_shape.to_crs("epsg:3857")
+def buffer_city_shape(city_shape, buffer_radius, simplify_tolerance):
+    city_shape = city_shape.to_crs(buffer_crs)
     polygon = unary_union(city_shape['geometry'])
     geo_series = geopandas.GeoSeries(data=[polygon])
     if buffer_radius is not None:
         geo_series = geo_series.buffer(distance=int(buffer_radius))
     if simplify_tolerance is not None:
         geo_series = geo_series.simplify(int(simplify_tolerance))
-    city_shape_buffer = geopandas.GeoDataFrame(geometry=geo_series, crs="epsg:3857")
-    city_shape_buffer.to_file(f"{ROOT_DIR}/resources/city_shape/{output_file_name}.shp")
+    return geo_series[0]
+
+
+# buffered city shape in EPSG:3857 and its cache key, only computed if the city shape or parameters changed
+def get_buffered_city_shape(input_file_path, buffer_radius, simplify_tolerance, cache_path):
+    key = get_cache_key(input_file_path, buffer_radius, simplify_tolerance)
+    cache_file = f"{cache_path}/buffered-{key}.wkb"
+    if os.path.isfile(cache_file):
+        with open(cache_file, 'rb') as f:
+            logger.info(f"Using cached buffered city shape {cache_file}")
+            return key, shapely.from_wkb(f.read()), False
+    geometry = buffer_city_shape(geopandas.read_file(input_file_path), buffer_radius, simplify_tolerance)
+    os.makedirs(cache_path, exist_ok=True)
+    with open(f"{cache_file}.tmp", 'wb') as f:
+        f.write(shapely.to_wkb(geometry))
+    os.replace(f"{cache_file}.tmp", cache_file)
+    return key, geometry, True
+
+
+# returns the cache key and geometry of the buffered city shape, the shapefile is only rewritten if it changed
+def create_buffered_city_shape(input_file_name, output_file_name, buffer_radius, simplify_tolerance,
+                               city_shape_path=CITY_SHAPE_PATH):
+    key, geometry, computed = get_buffered_city_shape(
+        f"{city_shape_path}/{input_file_name}.geojson", buffer_radius, simplify_tolerance,
+        get_cache_path(city_shape_path)
+    )
+    output_file = f"{city_shape_path}/{output_file_name}.shp"
+    if computed or not os.path.isfile(output_file):
+        city_shape_buffer = geopandas.GeoDataFrame(geometry=[geometry], crs=buffer_crs)
+        city_shape_buffer.to_file(output_file)
+    return key, geometry
+
+
+# buffered city shape written by an earlier run, used when creating it is skipped
+def read_buffered_city_shape(output_file_name, city_shape_path=CITY_SHAPE_PATH):
+    output_file = f"{city_shape_path}/{output_file_name}.shp"
+    city_shape_buffer = geopandas.read_file(output_file).to_crs(buffer_crs)
+    return get_cache_key(output_file), unary_union(city_shape_buffer['geometry'])
+
@@ -1,30 +1,10 @@
-from sqlalchemy import text
 import logging
 
+from migrations.migrate import apply_migrations
+
 logger = logging.getLogger(__name__)
 
 
 def create_radolan_schema(engine):
-    with engine.connect() as conn:
-        conn.begin()
-        conn.execute(text('CREATE SEQUENCE IF NOT EXISTS radolan_geometry_id_seq'))
-        conn.execute(text('''
-            CREATE TABLE IF NOT EXISTS "public"."radolan_geometry" (
-                "id" int4 NOT NULL DEFAULT nextval('radolan_geometry_id_seq'::regclass),
-                "geometry" geometry,
-                "centroid" geometry,
-                PRIMARY KEY ("id")
-            );
-        '''))
-        conn.execute(text('CREATE SEQUENCE IF NOT EXISTS radolan_data_id_seq'))
-        conn.execute(text('''
-            CREATE TABLE IF NOT EXISTS "public"."radolan_data" (
-                "id" int4 NOT NULL DEFAULT nextval('radolan_data_id_seq'::regclass),
-                "measured_at" timestamp,
-                "value" int2,
-                "geom_id" int2,
-                PRIMARY KEY ("id")
-            );
-        '''))
-        conn.commit()
-
+    # radolan_geometry and radolan_data including their indexes are owned by the schema migrations
+    apply_migrations(engine)
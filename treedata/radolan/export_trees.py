@@ -0,0 +1,44 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .write_radolan_csvs import get_trees_for_export
+from .write_radolan_delta import with_export_sequence
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+def run_writer(name, writer, trees):
+    start = time.perf_counter()
+    files = writer(trees)
+    elapsed = time.perf_counter() - start
+    logger.info(f"Export {name} wrote {len(files)} files in {elapsed:.2f} seconds")
+    return files, elapsed
+
+
+# runs all writers concurrently on the same trees, each writer is a function of the trees table returning
+# a dict of file path to file name, returns these dicts and the seconds taken per writer name
+def run_writers(trees, writers):
+    if len(writers) == 0:
+        return {}, {}
+    with ThreadPoolExecutor(max_workers=len(writers)) as executor:
+        futures = {name: executor.submit(run_writer, name, writer, trees) for name, writer in writers.items()}
+        results = {name: future.result() for name, future in futures.items()}
+    return {name: files for name, (files, _) in results.items()}, \
+        {name: elapsed for name, (_, elapsed) in results.items()}
+
+
+# reads the trees with their radolan sums once and hands them to every enabled writer,
+# together with the sequence number of the export, if given, in their schema metadata
+def export_trees(engine, time_limit_days, writers, sequence=None):
+    start = time.perf_counter()
+    trees = get_trees_for_export(engine, time_limit_days)
+    if sequence is not None:
+        trees = with_export_sequence(trees, sequence)
+    read_time = time.perf_counter() - start
+    logger.info(f"Read {trees.num_rows} trees for export in {read_time:.2f} seconds")
+    files, timings = run_writers(trees, writers)
+    logger.info("Export timings: " + ", ".join(
+        [f"read {read_time:.2f} s"] + [f"{name} {elapsed:.2f} s" for name, elapsed in timings.items()]))
+    return files, timings
@@ -0,0 +1,61 @@
+import json
+import logging
+import os
+
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+# the radolan grid is only rewritten by update_radolan_geometry, which deletes and re-inserts
+# all cells with fresh serial ids, so count and id range identify a grid version
+def get_grid_version(engine):
+    with engine.connect() as conn:
+        count, min_id, max_id = conn.execute(text('''
+            SELECT count(*), min(id), max(id) FROM public.radolan_geometry
+        ''')).fetchone()
+    return f"{count}-{min_id}-{max_id}"
+
+
+def read_grid_geometry_cache(cache_path):
+    if not os.path.isfile(cache_path):
+        return None
+    try:
+        with open(cache_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Ignoring unreadable grid geometry cache {cache_path}: {e}")
+        return None
+
+
+def write_grid_geometry_cache(cache_path, version, geometries):
+    tmp_path = f"{cache_path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({
+            "version": version,
+            "geometries": {str(cell_id): geometry for cell_id, geometry in geometries.items()}
+        }, f)
+    os.replace(tmp_path, cache_path)
+
+
+def query_grid_geometries(engine):
+    with engine.connect() as conn:
+        result = conn.execute(text('''
+            SELECT id, ST_AsGeoJSON(geometry) FROM public.radolan_geometry ORDER BY id
+        '''))
+        return {row[0]: row[1] for row in result.fetchall()}
+
+
+# returns the grid version and a dict of cell id to GeoJSON geometry string,
+# the geometries are only queried when the cached grid version is outdated
+def get_grid_geometries(engine, cache_path):
+    version = get_grid_version(engine)
+    cache = read_grid_geometry_cache(cache_path)
+    if cache is not None and cache.get('version') == version:
+        logger.info(f"Using cached grid geometries of version {version}")
+        return version, {int(cell_id): geometry for cell_id, geometry in cache['geometries'].items()}
+    logger.info(f"Refreshing grid geometry cache for version {version}")
+    geometries = query_grid_geometries(engine)
+    write_grid_geometry_cache(cache_path, version, geometries)
+    return version, geometries
@@ -1,12 +1,27 @@
+import hashlib
+import json
 import logging
+import math
 import os
 import platform
 import subprocess
 from datetime import datetime
 
+import numpy as np
+import shapely
+from pyproj import CRS, Transformer
+
+from .buffer_city_shape import buffer_crs, get_cache_path
+
 ROOT_DIR = os.path.abspath(os.curdir)
 path = f"{ROOT_DIR}/resources/radolan/"
-buffer_file_folder = f"{ROOT_DIR}/resources/city_shape"
+# polar stereographic projection of the RADOLAN grid
+radolan_proj = '+proj=stere +lon_0=10.0 +lat_0=90.0 +lat_ts=60.0 +a=6370040 +b=6370040 +units=m'
+asc_header_keys = ['ncols', 'nrows', 'xllcorner', 'yllcorner', 'cellsize', 'NODATA_value']
+nodata_default = -1
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
 
 
 def command_line_start():
@@ -16,20 +31,99 @@ def command_line_start():
         return []
 
 
-def polygonize_asc_file(buffer_file_name, input_file, output_file, file_name):
-    buffer_file = f"{buffer_file_folder}/{buffer_file_name}.shp"
-
+# header of an ESRI ASCII grid as dict with lower case keys, cell centers are converted to corners
+def read_asc_header(file_path):
+    header = {}
+    with open(file_path, 'r') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) != 2 or not parts[0][0].isalpha():
+                break
+            header[parts[0].lower()] = float(parts[1])
+    for axis in ['x', 'y']:
+        if f"{axis}llcenter" in header:
+            header[f"{axis}llcorner"] = header.pop(f"{axis}llcenter") - header['cellsize'] / 2
+    return header
+
+
+def write_asc_grid(file_path, header, data):
+    values = [int(data.shape[1]), int(data.shape[0]), header['xllcorner'], header['yllcorner'], header['cellsize'],
+              header.get('nodata_value', nodata_default)]
+    lines = [f"{key} {value:.10g}" for key, value in zip(asc_header_keys, values)]
+    np.savetxt(file_path, data, header="\n".join(lines), comments='', fmt='%.10g')
+
+
+# the grids carry no CRS themselves, GDAL picks it up from the .prj next to the file
+def write_radolan_prj(file_path):
+    with open(f"{os.path.splitext(file_path)[0]}.prj", 'w') as f:
+        f.write(CRS.from_proj4(radolan_proj).to_wkt(version='WKT1_ESRI'))
+
+
+def get_grid_key(header):
+    return hashlib.sha256(json.dumps(header, sort_keys=True).encode()).hexdigest()[:16]
+
+
+# cells of the grid whose center lies within the geometry, the geometry is given in the buffer CRS,
+# returns the mask of the window of the grid covering the geometry together with the window offset
+def rasterize_grid_mask(geometry, header):
+    transformer = Transformer.from_crs(buffer_crs, radolan_proj, always_xy=True)
+    geometry = shapely.transform(geometry, lambda coords: np.column_stack(
+        transformer.transform(coords[:, 0], coords[:, 1])))
+    cell_size = header['cellsize']
+    x_min = header['xllcorner']
+    y_max = header['yllcorner'] + header['nrows'] * cell_size
+    bounds_x_min, bounds_y_min, bounds_x_max, bounds_y_max = geometry.bounds
+    col_start = max(math.floor((bounds_x_min - x_min) / cell_size), 0)
+    col_end = min(math.ceil((bounds_x_max - x_min) / cell_size), int(header['ncols']))
+    row_start = max(math.floor((y_max - bounds_y_max) / cell_size), 0)
+    row_end = min(math.ceil((y_max - bounds_y_min) / cell_size), int(header['nrows']))
+    if col_start >= col_end or row_start >= row_end:
+        raise Exception("Buffered city shape does not overlap the RADOLAN grid")
+    x = x_min + (np.arange(col_start, col_end) + 0.5) * cell_size
+    y = y_max - (np.arange(row_start, row_end) + 0.5) * cell_size
+    grid_x, grid_y = np.meshgrid(x, y)
+    shapely.prepare(geometry)
+    return shapely.contains_xy(geometry, grid_x, grid_y), row_start, col_start
+
+
+# mask of the buffered city shape on the grid, cached under the keys of the buffered shape and the grid
+def get_grid_mask(city_shape_buffer, header, cache_path=None):
+    buffer_key, geometry = city_shape_buffer
+    cache_path = cache_path or get_cache_path()
+    cache_file = f"{cache_path}/mask-{buffer_key}-{get_grid_key(header)}.npz"
+    if os.path.isfile(cache_file):
+        with np.load(cache_file) as cached:
+            return cached['mask'], int(cached['row_offset']), int(cached['col_offset'])
+    mask, row_offset, col_offset = rasterize_grid_mask(geometry, header)
+    os.makedirs(cache_path, exist_ok=True)
+    with open(f"{cache_file}.tmp", 'wb') as f:
+        np.savez(f, mask=mask, row_offset=row_offset, col_offset=col_offset)
+    os.replace(f"{cache_file}.tmp", cache_file)
+    logger.info(f"Rasterized buffered city shape to {int(mask.sum())} grid cells")
+    return mask, row_offset, col_offset
+
+
+# cuts the grid to the window of the buffered city shape, the cells outside of it become nodata,
+# like gdalwarp -cutline did, but without reading the shape and warping the whole grid for every file
+def mask_asc_file(city_shape_buffer, input_file, output_file, cache_path=None):
+    header = read_asc_header(input_file)
+    mask, row_offset, col_offset = get_grid_mask(city_shape_buffer, header, cache_path)
+    # only the rows of the window are parsed
+    data = np.loadtxt(input_file, skiprows=len(header) + row_offset, max_rows=mask.shape[0], ndmin=2)
+    data = data[:, col_offset:col_offset + mask.shape[1]]
+    data[~mask] = header.get('nodata_value', nodata_default)
+    write_asc_grid(output_file, {
+        **header,
+        'xllcorner': header['xllcorner'] + col_offset * header['cellsize'],
+        'yllcorner': header['yllcorner'] + (header['nrows'] - row_offset - mask.shape[0]) * header['cellsize']
+    }, data)
+    # as gdalwarp -t_srs did, so that the polygonized shapes are in the RADOLAN projection
+    write_radolan_prj(output_file)
+
+
+def polygonize_asc_file(city_shape_buffer, input_file, output_file, file_name):
     # filter data
-    cmdline = command_line_start() + [
-        'gdalwarp', input_file, output_file,
-        "-s_srs", '+proj=stere +lon_0=10.0 +lat_0=90.0 +lat_ts=60.0 +a=6370040 +b=6370040 +units=m',
-        "-t_srs", '+proj=stere +lon_0=10.0 +lat_0=90.0 +lat_ts=60.0 +a=6370040 +b=6370040 +units=m',
-        "-r", "near", "-of", "GTiff", "-cutline", buffer_file
-    ]
-    logging.info("executing",  ' '.join(cmdline))
-    returncode_gdalwarp = subprocess.call(cmdline)
-    if returncode_gdalwarp != 0:
-        raise Exception(f"gdalwarp failed for {buffer_file}")
+    mask_asc_file(city_shape_buffer, input_file, output_file)
 
     # polygonize data
     shape_file = path + f"{file_name}.shp"
@@ -47,7 +141,7 @@ def polygonize_asc_file(buffer_file_name, input_file, output_file, file_name):
 
 
 
-def polygonize_weather_data(buffer_file_name):
+def polygonize_weather_data(city_shape_buffer):
     # collecting all the files that need importing in one list
     filelist = []
     for (dirpath, dirnames, filenames) in os.walk(path):
@@ -69,12 +163,12 @@ def polygonize_weather_data(buffer_file_name):
             last_received = date_time_obj
         logging.info("Processing: {} / {}".format(len(filelist), counter + 1))
 
-        output_file = path + f"{file_name}.tif"
+        output_file = path + f"{file_name}-masked.asc"
 
         # for some reason the python gdal bindings are ****.
         # after hours of trying to get this to work in pure python,
         # this has proven to be more reliable and efficient. sorry.
 
-        polygonize_asc_file(buffer_file_name, input_file, output_file, file_name)
+        polygonize_asc_file(city_shape_buffer, input_file, output_file, file_name)
 
     return filelist, last_received
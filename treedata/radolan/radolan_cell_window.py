@@ -0,0 +1,123 @@
+import logging
+from datetime import datetime, timedelta
+
+import pandas
+from sqlalchemy import text
+
+from migrations.migrate import apply_migrations
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+# radolan_cell_window holds per grid cell the rain of the last time_limit_days days as fixed-length int2[],
+# starting at window_start and ending today, so that the days are no longer aggregated from radolan_data
+# on every run
+def get_window_start(time_limit_days, now=None):
+    now = now or datetime.now()
+    return now.date() - timedelta(days=time_limit_days - 1)
+
+
+def get_measured_dates(radolan_data):
+    return sorted(set(pandas.to_datetime(radolan_data['measured_at']).dt.date))
+
+
+# 1-based position of the day in the days array of a window starting at window_start
+def get_day_index(window_start, day):
+    return (day - window_start).days + 1
+
+
+# days of a window moved forward by offset days, the days before the new start are dropped and the new days are 0
+def get_shifted_days(offset, time_limit_days):
+    if offset >= time_limit_days:
+        return f"array_fill(0, ARRAY[{time_limit_days}])::int2[]"
+    return f"days[{offset + 1}:{time_limit_days}] || array_fill(0, ARRAY[{offset}])::int2[]"
+
+
+# moves the windows of all cells to window_start, usually all windows start at the same day,
+# so that there is one update per run
+def shift_windows(conn, window_start, time_limit_days):
+    result = conn.execute(text(
+        'SELECT DISTINCT window_start FROM radolan_cell_window WHERE window_start < CAST(:window_start AS date)'
+    ), {"window_start": window_start})
+    shifted = 0
+    for (previous_start,) in result.fetchall():
+        result = conn.execute(text(f'''
+            UPDATE radolan_cell_window SET
+                days = {get_shifted_days((window_start - previous_start).days, time_limit_days)},
+                window_start = CAST(:window_start AS date)
+            WHERE window_start = CAST(:previous_start AS date)
+        '''), {"window_start": window_start, "previous_start": previous_start})
+        shifted += result.rowcount
+    return shifted
+
+
+# cells of the grid without window get an empty one, windows of cells no longer in the grid or
+# of another length are dropped, returns the ids of the new cells
+def add_missing_windows(conn, window_start, time_limit_days):
+    conn.execute(text(f'''
+        DELETE FROM radolan_cell_window
+        WHERE cardinality(days) <> {time_limit_days}
+        OR NOT EXISTS (SELECT 1 FROM radolan_geometry WHERE radolan_geometry.id = radolan_cell_window.geom_id)
+    '''))
+    result = conn.execute(text(f'''
+        INSERT INTO radolan_cell_window (geom_id, window_start, days)
+        SELECT radolan_geometry.id, CAST(:window_start AS date), array_fill(0, ARRAY[{time_limit_days}])::int2[]
+        FROM radolan_geometry
+        WHERE NOT EXISTS (SELECT 1 FROM radolan_cell_window WHERE radolan_cell_window.geom_id = radolan_geometry.id)
+        RETURNING geom_id
+    '''), {"window_start": window_start})
+    return [row[0] for row in result.fetchall()]
+
+
+# sets the day of the windows to the rain measured for the cell at that day, 0 if there is none
+def set_window_day(conn, window_start, day, geom_ids=None):
+    params = {"day": day}
+    cell_filter = ""
+    if geom_ids is not None:
+        params["geom_ids"] = geom_ids
+        cell_filter = "WHERE radolan_cell_window.geom_id = ANY(:geom_ids)"
+    conn.execute(text(f'''
+        UPDATE radolan_cell_window SET days[{get_day_index(window_start, day)}] = COALESCE((
+            SELECT MAX(radolan_data.value) FROM radolan_data
+            WHERE radolan_data.geom_id = radolan_cell_window.geom_id
+            AND radolan_data.measured_at >= CAST(:day AS date)
+            AND radolan_data.measured_at < CAST(:day AS date) + INTERVAL '1 day'
+        ), 0)
+        {cell_filter}
+    '''), params)
+
+
+# advances the windows to today and takes over the rain of the measured dates from radolan_data,
+# new cells are filled for the whole window, without measured dates only the window is advanced
+def advance_radolan_cell_window(engine, time_limit_days, measured_dates=(), now=None):
+    window_start = get_window_start(time_limit_days, now)
+    window_days = [window_start + timedelta(days=offset) for offset in range(time_limit_days)]
+    apply_migrations(engine)
+    with engine.connect() as conn:
+        shifted = shift_windows(conn, window_start, time_limit_days)
+        new_geom_ids = add_missing_windows(conn, window_start, time_limit_days)
+        if len(new_geom_ids) > 0:
+            for day in window_days:
+                set_window_day(conn, window_start, day, new_geom_ids)
+        measured_days = [day for day in measured_dates if window_start <= day <= window_days[-1]]
+        for day in measured_days:
+            set_window_day(conn, window_start, day)
+        conn.commit()
+    logger.info(f"Advanced {shifted} radolan cell windows to {window_start}, filled {len(new_geom_ids)} new cells "
+                f"and {len(measured_days)} measured days")
+
+
+# the cells of the grid with their windows, as grid of (geom_id, geometry) and cleaned grid of their days
+def get_window_cells(engine, time_limit_days, grid_geometries, now=None):
+    advance_radolan_cell_window(engine, time_limit_days, now=now)
+    with engine.connect() as conn:
+        result = conn.execute(text('SELECT geom_id, days FROM radolan_cell_window ORDER BY geom_id'))
+        rows = result.fetchall()
+    grid = []
+    clean = []
+    for geom_id, days in rows:
+        if geom_id in grid_geometries:
+            grid.append((geom_id, grid_geometries[geom_id]))
+            clean.append(list(days))
+    return grid, clean
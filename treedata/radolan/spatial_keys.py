@@ -0,0 +1,64 @@
+import numpy as np
+
+hilbert_order_default = 16
+
+
+# position along the Hilbert curve of order through a 2^order x 2^order grid for integer cell coordinates
+def hilbert_index(x, y, order=hilbert_order_default):
+    x = np.asarray(x, dtype=np.int64).copy()
+    y = np.asarray(y, dtype=np.int64).copy()
+    n = 1 << order
+    index = np.zeros(x.shape, dtype=np.int64)
+    s = n >> 1
+    while s > 0:
+        rx = (x & s) > 0
+        ry = (y & s) > 0
+        index += s * s * ((3 * rx) ^ ry)
+        # rotate the quadrant, so that the curve of the next level continues where this one ended
+        flip = ~ry & rx
+        x = np.where(flip, n - 1 - x, x)
+        y = np.where(flip, n - 1 - y, y)
+        x, y = np.where(~ry, y, x), np.where(~ry, x, y)
+        s >>= 1
+    return index
+
+
+# scales the coordinates to the grid over their bounds, neighbouring points get close indexes
+def get_hilbert_indexes(lng, lat, order=hilbert_order_default):
+    lng = np.asarray(lng, dtype=float)
+    lat = np.asarray(lat, dtype=float)
+    if len(lng) == 0:
+        return np.zeros(0, dtype=np.int64)
+    cells = (1 << order) - 1
+    x_min, x_max = np.nanmin(lng), np.nanmax(lng)
+    y_min, y_max = np.nanmin(lat), np.nanmax(lat)
+    x = np.rint((np.nan_to_num(lng, nan=x_min) - x_min) / max(x_max - x_min, 1e-12) * cells)
+    y = np.rint((np.nan_to_num(lat, nan=y_min) - y_min) / max(y_max - y_min, 1e-12) * cells)
+    return hilbert_index(x, y, order)
+
+
+def get_hilbert_order(lng, lat, order=hilbert_order_default):
+    return np.argsort(get_hilbert_indexes(lng, lat, order), kind='stable')
+
+
+# slippy map tile of each position at the zoom level
+def get_tile_coordinates(lng, lat, zoom):
+    n = 1 << zoom
+    lat = np.clip(np.asarray(lat, dtype=float), -85.05112878, 85.05112878)
+    x = np.floor((np.asarray(lng, dtype=float) + 180) / 360 * n)
+    y = np.floor((1 - np.arcsinh(np.tan(np.radians(lat))) / np.pi) / 2 * n)
+    return np.clip(x, 0, n - 1).astype(np.int64), np.clip(y, 0, n - 1).astype(np.int64)
+
+
+def tile_to_quadkey(x, y, zoom):
+    return "".join(str(((x >> level) & 1) + 2 * ((y >> level) & 1)) for level in range(zoom - 1, -1, -1))
+
+
+def tile_y_to_lat(y, zoom):
+    return float(np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * y / (1 << zoom))))))
+
+
+# bounds of a slippy map tile as [west, south, east, north]
+def get_tile_bbox(x, y, zoom):
+    n = 1 << zoom
+    return [x / n * 360 - 180, tile_y_to_lat(y + 1, zoom), (x + 1) / n * 360 - 180, tile_y_to_lat(y, zoom)]
@@ -1,3 +1,4 @@
+import hashlib
 import json
 from datetime import datetime
 from datetime import timedelta
@@ -6,53 +7,18 @@ import psycopg2
 import psycopg2.extras
 from sqlalchemy import text
 
+from migrations.migrate import apply_migrations
+
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
+# cells per bulk update statement
+cell_update_page_size = 500
 
-# get all grid cells, get data for last 30 days for each grid cell,
-# generate a list for each grid cell
-# as we don't store "0" events, those need to be generated,
-# afterwards trees are updated and a geojson is being created
-
-def get_weather_data_grid_cells(engine, time_limit_days):
-    with engine.connect() as conn:
-        result = conn.execute(text(f'''
-            SELECT 
-                radolan_geometry.id, 
-                ST_AsGeoJSON(radolan_geometry.geometry), 
-                ARRAY_AGG(radolan_data.measured_at) AS measured_at, 
-                ARRAY_AGG(radolan_data.value) AS value 
-            FROM radolan_geometry 
-            JOIN radolan_data ON radolan_geometry.id = radolan_data.geom_id 
-            WHERE radolan_data.measured_at > NOW() - INTERVAL '{time_limit_days} days' 
-            GROUP BY radolan_geometry.id, radolan_geometry.geometry
-        '''))
-        return result.fetchall()
-
-
-def get_sorted_cleaned_grid(grid, time_limit_days, now=datetime.now()):
-    clean = []
-    for cell in grid:
-        end_date = now
-        end_date = end_date.replace(hour=0, minute=0, second=0, microsecond=0)
-        start_date = now + timedelta(days=-time_limit_days+1)
-        start_date = start_date.replace(hour=0, minute=0, second=0, microsecond=0)
-        clean_data = []
-        while start_date <= end_date:
-            found = False
-            for dateindex, date in enumerate(cell[2]):
-                if start_date == date:
-                    found = True
-                    clean_data.append(cell[3][dateindex])
-                    break
-                    # TODO: Add the algorithm that calculates the actually absorbed amount of water (upper & lower threshold)
-            if not found:
-                clean_data.append(0)
-            start_date += timedelta(days=1)
-        clean.append(clean_data)
-    return clean
 
+# the days of each grid cell are kept in radolan_cell_window, see radolan_cell_window.py,
+# including the "0" days, as we don't store "0" events in radolan_data,
+# from them the trees are updated and a geojson is being created
 
 def get_sorted_cleaned_grid_cells(cleaned_grid, grid):
     cells = []
@@ -60,7 +26,8 @@ def get_sorted_cleaned_grid_cells(cleaned_grid, grid):
         cells.append([
             cleaned_grid[cellindex],
             sum(cleaned_grid[cellindex]),
-            cell[1]
+            cell[1],
+            cell[0]
         ])
     return cells
 
@@ -83,35 +50,107 @@ def update_statistics_db(filelist, engine, time_limit_days, last_received):
             conn.commit()
 
 
-def update_tree_radolan_days_for_query(engine, values, query, info):
-    logging.info(info)
-    try:
-        with engine.connect() as conn:
-            for index, value in enumerate(values):
-                try:
-                    resolved_query = query.format(f"ARRAY{value[0]}", value[1], value[2])
-                    result = conn.execute(text(resolved_query))
-                    conn.commit()
-                    logger.info(f"Updated {index}. radolan square: {result.rowcount} trees affected")
-                except (Exception, psycopg2.DatabaseError) as error:
-                    logger.error(f"Error: {error}")
-    except:
-        logging.error("❌Could not update radolan days")
-
-
-def update_tree_radolan_days(engine, values):
-    first_query = '''
-        UPDATE trees SET radolan_days = {}, radolan_sum = {} 
-        WHERE ST_CoveredBy(geom, ST_SetSRID(ST_GeomFromGeoJSON('{}'), 4326))
-    '''
-    first_info = "updating trees 🌳"
-    update_tree_radolan_days_for_query(engine, values, first_query, first_info)
-    second_query = '''
-        UPDATE trees SET radolan_days = {}, radolan_sum = {} 
-        WHERE trees.radolan_sum IS NULL 
-        AND ST_CoveredBy(geom, 
-            ST_Buffer(ST_SetSRID(ST_GeomFromGeoJSON('{}'), 4326), 0.00005)
-        )
-    '''
-    second_info = "updating sad trees 🌳"
-    update_tree_radolan_days_for_query(engine, values, second_query, second_info)
+# per cell the hash of its radolan days vector as last applied to the trees
+def get_applied_cell_hashes(conn):
+    result = conn.execute(text('SELECT geom_id, vector_hash FROM "public"."radolan_cell_state"'))
+    return {geom_id: vector_hash for geom_id, vector_hash in result.fetchall()}
+
+
+def get_cell_vector_hash(radolan_days):
+    return hashlib.sha256(",".join(str(int(value)) for value in radolan_days).encode()).hexdigest()[:32]
+
+
+# splits the cells whose vector changed since it was applied into cells with rain and cells that are
+# all zero now, cells that dropped out of the time window have no rain left and are all zero as well,
+# returns these and the hashes to store for them
+def get_changed_cells(values, applied_hashes, time_limit_days):
+    zero_hash = get_cell_vector_hash([0] * time_limit_days)
+    changed_cells = []
+    zero_geom_ids = []
+    cell_hashes = {}
+    for radolan_days, radolan_sum, _, geom_id in values:
+        vector_hash = get_cell_vector_hash(radolan_days)
+        if applied_hashes.get(geom_id) == vector_hash:
+            continue
+        cell_hashes[geom_id] = vector_hash
+        if radolan_sum == 0:
+            zero_geom_ids.append(geom_id)
+        else:
+            changed_cells.append((geom_id, list(radolan_days), radolan_sum))
+    current_geom_ids = {value[3] for value in values}
+    for geom_id, vector_hash in applied_hashes.items():
+        if geom_id not in current_geom_ids and vector_hash != zero_hash:
+            zero_geom_ids.append(geom_id)
+            cell_hashes[geom_id] = zero_hash
+    return changed_cells, zero_geom_ids, cell_hashes
+
+
+# the cells go into the VALUES list of the query in pages of cell_update_page_size, returns the updated trees
+def update_trees_of_cells(cursor, query, cells):
+    updated = 0
+    for start in range(0, len(cells), cell_update_page_size):
+        psycopg2.extras.execute_values(cursor, query, cells[start:start + cell_update_page_size],
+                                       template='(%s, %s::int4[], %s)', page_size=cell_update_page_size)
+        updated += cursor.rowcount
+    return updated
+
+
+# only trees in cells whose vector changed are written, all zero cells in one statement,
+# trees without radolan days yet, e.g. new ones, are filled from all cells,
+# first the ones within a cell, then the sad trees at the border of a cell
+def update_tree_radolan_days(engine, values, time_limit_days):
+    apply_migrations(engine)
+    logger.info("updating trees 🌳")
+    with engine.begin() as conn:
+        applied_hashes = get_applied_cell_hashes(conn)
+        changed_cells, zero_geom_ids, cell_hashes = get_changed_cells(values, applied_hashes, time_limit_days)
+        logger.info(f"{len(changed_cells)} cells with rain and {len(zero_geom_ids)} cells without rain changed, "
+                    f"{len(values) - len(changed_cells) - len(zero_geom_ids)} cells unchanged")
+        cursor = conn.connection.cursor()
+        if len(changed_cells) > 0:
+            updated = update_trees_of_cells(cursor, """
+                UPDATE trees SET radolan_days = cells.radolan_days, radolan_sum = cells.radolan_sum
+                FROM (VALUES %s) AS cells (geom_id, radolan_days, radolan_sum)
+                JOIN radolan_geometry ON radolan_geometry.id = cells.geom_id
+                WHERE ST_CoveredBy(trees.geom, radolan_geometry.geometry)
+                AND trees.radolan_days IS DISTINCT FROM cells.radolan_days
+            """, changed_cells)
+            logger.info(f"Updated {updated} trees of {len(changed_cells)} cells with rain")
+        if len(zero_geom_ids) > 0:
+            cursor.execute("""
+                UPDATE trees SET radolan_days = array_fill(0, ARRAY[%s]), radolan_sum = 0
+                FROM radolan_geometry
+                WHERE radolan_geometry.id = ANY(%s)
+                AND ST_CoveredBy(trees.geom, radolan_geometry.geometry)
+                AND trees.radolan_sum IS DISTINCT FROM 0
+            """, (time_limit_days, zero_geom_ids))
+            logger.info(f"Updated {cursor.rowcount} trees of {len(zero_geom_ids)} cells without rain")
+        all_cells = [(geom_id, list(radolan_days), radolan_sum) for radolan_days, radolan_sum, _, geom_id in values]
+        if len(all_cells) > 0:
+            updated = update_trees_of_cells(cursor, """
+                UPDATE trees SET radolan_days = cells.radolan_days, radolan_sum = cells.radolan_sum
+                FROM (VALUES %s) AS cells (geom_id, radolan_days, radolan_sum)
+                JOIN radolan_geometry ON radolan_geometry.id = cells.geom_id
+                WHERE trees.radolan_sum IS NULL
+                AND ST_CoveredBy(trees.geom, radolan_geometry.geometry)
+            """, all_cells)
+            logger.info(f"Updated {updated} trees without radolan days")
+            logger.info("updating sad trees 🌳")
+            updated = update_trees_of_cells(cursor, """
+                UPDATE trees SET radolan_days = cells.radolan_days, radolan_sum = cells.radolan_sum
+                FROM (VALUES %s) AS cells (geom_id, radolan_days, radolan_sum)
+                JOIN radolan_geometry ON radolan_geometry.id = cells.geom_id
+                WHERE trees.radolan_sum IS NULL
+                AND ST_CoveredBy(trees.geom, ST_Buffer(radolan_geometry.geometry, 0.00005))
+            """, all_cells)
+            logger.info(f"Updated {updated} sad trees")
+        if len(cell_hashes) > 0:
+            psycopg2.extras.execute_values(cursor, """
+                INSERT INTO "public"."radolan_cell_state" (geom_id, vector_hash) VALUES %s
+                ON CONFLICT (geom_id) DO UPDATE SET vector_hash = EXCLUDED.vector_hash, applied_at = NOW()
+            """, list(cell_hashes.items()), page_size=cell_update_page_size)
+        # the cells of a replaced grid are gone
+        cursor.execute("""
+            DELETE FROM "public"."radolan_cell_state"
+            WHERE NOT EXISTS (SELECT 1 FROM radolan_geometry WHERE radolan_geometry.id = radolan_cell_state.geom_id)
+        """)
@@ -6,6 +6,8 @@ import pandas
 import psycopg2
 import psycopg2.extras
 
+from migrations.migrate import analyze_tables
+
 logger = logging.getLogger(__name__)
 
 
@@ -44,6 +46,7 @@ def update_radolan_geometry(engine, radolan_grid_shape_path):
         with engine.connect() as conn:
             conn.execute(text("UPDATE public.radolan_geometry SET centroid = ST_Centroid(geometry)"))
             conn.commit()
+        analyze_tables(engine, ['radolan_geometry'])
 
 
 def upload_radolan_data(engine, radolan_data):
@@ -60,6 +63,7 @@ def upload_radolan_data(engine, radolan_data):
             GROUP BY radolan_geometry.id, radolan_temp.measured_at
         '''))
         conn.commit()
+    analyze_tables(engine, ['radolan_data'])
 
 
 def purge_data_older_than_time_limit_days(engine, time_limit_days):
@@ -0,0 +1,102 @@
+import logging
+import os
+import subprocess
+
+import numpy as np
+import shapely
+from pyproj import Transformer
+
+from .polygonize_weather_data import command_line_start, radolan_proj, write_radolan_prj
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+cog_file_name = "weather"
+radolan_cell_size = 1000
+nodata_value = -1
+
+
+# raster window covering the grid cells, i.e. the buffered city shape the grid was cut with,
+# rows and cols locate each cell by its centroid in the RADOLAN projection
+def get_cell_raster_positions(grid_geometries):
+    if len(grid_geometries) == 0:
+        raise Exception("Error: grid geometries are empty, no cells to place in the raster")
+    cell_ids = sorted(grid_geometries)
+    geometries = shapely.from_geojson([grid_geometries[cell_id] for cell_id in cell_ids])
+    centroids = shapely.get_coordinates(shapely.centroid(geometries))
+    transformer = Transformer.from_crs(crs_from=4326, crs_to=radolan_proj, always_xy=True)
+    x, y = transformer.transform(centroids[:, 0], centroids[:, 1])
+    x_min = np.min(x)
+    y_max = np.max(y)
+    cols = np.rint((x - x_min) / radolan_cell_size).astype(int)
+    rows = np.rint((y_max - y) / radolan_cell_size).astype(int)
+    # upper left corner of the upper left cell, averaged to even out the rounding of the stored geometries
+    origin = (
+        np.mean(x - cols * radolan_cell_size) - radolan_cell_size / 2,
+        np.mean(y + rows * radolan_cell_size) + radolan_cell_size / 2
+    )
+    return cell_ids, rows, cols, origin
+
+
+# cells x days matrix as bands x rows x cols, cells of the grid without rain are 0, outside the grid nodata
+def get_rainfall_bands(grid, clean, cell_ids, rows, cols):
+    days = len(clean[0]) if len(clean) > 0 else 0
+    bands = np.full((days, rows.max() + 1, cols.max() + 1), nodata_value, dtype='<i2')
+    bands[:, rows, cols] = 0
+    cell_index = {cell_id: index for index, cell_id in enumerate(cell_ids)}
+    for cellindex, cell in enumerate(grid):
+        index = cell_index.get(cell[0])
+        if index is not None:
+            bands[:, rows[index], cols[index]] = clean[cellindex]
+    return bands
+
+
+# raw band sequential raster with an ESRI .hdr, which GDAL reads as one multi-band dataset
+def write_ehdr_raster(file_path, bands, origin):
+    band_count, row_count, col_count = bands.shape
+    bands.tofile(f"{file_path}.bsq")
+    with open(f"{file_path}.hdr", 'w') as f:
+        f.write("\n".join([
+            "BYTEORDER I",
+            "LAYOUT BSQ",
+            f"NROWS {row_count}",
+            f"NCOLS {col_count}",
+            f"NBANDS {band_count}",
+            "NBITS 16",
+            "PIXELTYPE SIGNEDINT",
+            f"ULXMAP {origin[0] + radolan_cell_size / 2}",
+            f"ULYMAP {origin[1] - radolan_cell_size / 2}",
+            f"XDIM {radolan_cell_size}",
+            f"YDIM {radolan_cell_size}",
+            f"NODATA {nodata_value}",
+        ]) + "\n")
+    write_radolan_prj(file_path)
+
+
+def write_radolan_cog(path, start_date, end_date, grid, clean, grid_geometries):
+    cell_ids, rows, cols, origin = get_cell_raster_positions(grid_geometries)
+    bands = get_rainfall_bands(grid, clean, cell_ids, rows, cols)
+    raw_file_path = f"{path}{cog_file_name}-raw"
+    write_ehdr_raster(raw_file_path, bands, origin)
+
+    file_path = f"{path}{cog_file_name}.tif"
+    # one band per day, oldest day first
+    cmdline = command_line_start() + [
+        'gdal_translate', f"{raw_file_path}.bsq", file_path,
+        "-of", "COG",
+        "-a_nodata", str(nodata_value),
+        "-mo", f"START={start_date.isoformat()}",
+        "-mo", f"END={end_date.isoformat()}",
+        "-co", "COMPRESS=DEFLATE",
+        "-co", "PREDICTOR=2",
+        "-co", "BLOCKSIZE=256",
+        "-co", "OVERVIEWS=NONE"
+    ]
+    logging.info(f"executing {' '.join(cmdline)}")
+    returncode = subprocess.call(cmdline)
+    if returncode != 0:
+        raise Exception(f"gdal_translate failed for {file_path}")
+    for extension in ["bsq", "hdr", "prj"]:
+        os.remove(f"{raw_file_path}.{extension}")
+    logger.info(f"Wrote {bands.shape[0]} days of {bands.shape[2]}x{bands.shape[1]} cells to {file_path}")
+    return f"{cog_file_name}.tif"
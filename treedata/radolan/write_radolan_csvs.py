@@ -1,29 +1,56 @@
-import math
 import csv
+import json
 
+import numpy as np
+import pandas
+import pyarrow as pa
 from sqlalchemy import text
 
-
-def get_trees_with_radolan_data_total(engine, time_limit_days):
+from utils.gzip_file import gzip_files
+from .spatial_keys import get_tile_coordinates, tile_to_quadkey, get_tile_bbox
+from .write_radolan_delta import get_trees_sequence
+
+csv_column_names = ['id', 'lng', 'lat', 'radolan_sum', 'age']
+# default age, so that trees without age are still displayed
+age_default = 10
+# zoom level of the map tiles the CSV partitions are cut by, tiles of about 6 x 6 km in Leipzig
+partition_zoom_default = 12
+export_file_name = "trees-export.json"
+
+trees_export_schema = pa.schema([
+    ('id', pa.string()),
+    ('lng', pa.float64()),
+    ('lat', pa.float64()),
+    ('radolan_sum', pa.int64()),
+    ('radolan_sum_total', pa.int64()),
+    ('age', pa.float64())
+])
+export_batch_size = 50000
+
+
+# all trees within the radolan grid with their radolan sum, the sum including the watering of the last
+# time_limit_days and their age, in one scan of the trees table, read in batches into an Arrow table
+def get_trees_for_export(engine, time_limit_days, batch_size=export_batch_size):
+    batches = []
     with engine.connect() as conn:
-        cursor = conn.execute(text(f'''
+        result = conn.execution_options(stream_results=True).execute(text('''
         SELECT 
           trees.id, 
           trees.lng, 
           trees.lat, 
-          (
-            trees.radolan_sum + (
-              SELECT COALESCE(SUM (CAST (w.amount AS integer)) * 10, 0) 
-              FROM trees_watered w 
-              WHERE timestamp >= NOW() - interval '{time_limit_days} day' 
-              AND w.tree_id = trees.id
-            )
-          ) as radolan_sum, 
+          trees.radolan_sum, 
+          trees.radolan_sum + COALESCE(watered.amount, 0) AS radolan_sum_total, 
           CASE 
             WHEN trees.pflanzjahr > 1000 THEN date_part('year', CURRENT_DATE) - trees.pflanzjahr 
             ELSE NULL 
           END AS age 
         FROM trees 
+        LEFT JOIN (
+          SELECT w.tree_id, SUM (CAST (w.amount AS integer)) * 10 AS amount 
+          FROM trees_watered w 
+          WHERE w.timestamp >= NOW() - interval '1 day' * :time_limit_days 
+          GROUP BY w.tree_id
+        ) watered ON watered.tree_id = trees.id 
         WHERE ST_CONTAINS(
           ST_SetSRID(
             (SELECT ST_EXTENT(geometry) FROM radolan_geometry), 
@@ -31,44 +58,19 @@ def get_trees_with_radolan_data_total(engine, time_limit_days):
           ), 
           trees.geom
         )
-      '''))
-    return cursor.fetchall()
+      '''), {"time_limit_days": int(time_limit_days)})
+        for partition in result.partitions(batch_size):
+            columns = list(zip(*partition))
+            batches.append(pa.RecordBatch.from_arrays(
+                [pa.array(column, type=field.type) for column, field in zip(columns, trees_export_schema)],
+                schema=trees_export_schema
+            ))
+    return pa.Table.from_batches(batches, schema=trees_export_schema)
 
 
-def get_trees_with_radolan_data(engine):
-    with engine.connect() as conn:
-        cursor = conn.execute(text(f'''
-      SELECT 
-        trees.id, 
-        trees.lng, 
-        trees.lat, 
-        trees.radolan_sum, 
-        CASE 
-          WHEN trees.pflanzjahr > 1000 THEN date_part('year', CURRENT_DATE) - trees.pflanzjahr 
-          ELSE NULL 
-        END AS age 
-      FROM trees 
-      WHERE ST_CONTAINS(
-        ST_SetSRID(
-          (SELECT ST_EXTENT(geometry) FROM radolan_geometry), 
-          4326
-        ), 
-        trees.geom
-      )
-    '''))
-    return cursor.fetchall()
-
-
-def write_trees_csv_total(engine, time_limit_days, path):
-    trees = get_trees_with_radolan_data_total(engine, time_limit_days)
-    file_name = "trees-total"
-    return write_csv_content(trees, path, file_name)
-
-
-def write_trees_csv(engine, path):
-    trees = get_trees_with_radolan_data(engine)
-    file_name = "trees"
-    return write_csv_content(trees, path, file_name)
+# rows as written to the CSV files, with the given column as radolan_sum
+def get_tree_rows(trees, radolan_sum_column):
+    return list(zip(*[trees[column].to_pylist() for column in ['id', 'lng', 'lat', radolan_sum_column, 'age']]))
 
 
 def get_tree_csv_row_values(tree):
@@ -80,43 +82,80 @@ def get_tree_csv_row_values(tree):
     if age is not None:
         age = int(age)
     else:
-        # default age 10, so that trees without age are still displayed
-        age = 10
+        age = age_default
     return [id, lng, lat, radolan_sum, age]
 
 
+def write_csv_file(rows, file_path):
+    with open(file_path, mode='w') as csv_file:
+        csv_writer = csv.writer(csv_file, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+        csv_writer.writerow(csv_column_names)
+        csv_writer.writerows(get_tree_csv_row_values(tree) for tree in rows)
+
+
 def write_csv_content(trees, path, file_name):
-    filepath_to_filename = {}
-    column_names = ['id', 'lng', 'lat', 'radolan_sum', 'age']
-    trees_per_file_limit = math.ceil(len(trees) / 4)
-    trees_sublists = []
-    if len(trees) > 0:
-        for index in range(0, len(trees), trees_per_file_limit):
-            trees_sublists.append(trees[index:index + trees_per_file_limit])
-    else:
+    if len(trees) == 0:
         raise Exception(f"Error: trees is empty for {path}{file_name}.csv")
+    write_csv_file(trees, f"{path}{file_name}.csv")
+    return {f"{path}{file_name}.csv": f"{file_name}.csv"}
 
-    file_path = f"{path}{file_name}.csv"
-    filepath_to_filename[file_path] = f"{file_name}.csv"
-    with open(file_path, mode='w') as csv_file:
-        csv_writer = csv.writer(csv_file, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
-        csv_writer.writerow(column_names)
-        for sublist_index, trees_sublist in enumerate(trees_sublists):
-            percentile_file_name = f"{file_name}-p{sublist_index + 1}.csv"
-            percentile_file_path = f"{path}{percentile_file_name}"
-            filepath_to_filename[percentile_file_path] = percentile_file_name
-            with open(percentile_file_path, mode='w') as percentile_csv_file:
-                percentile_csv_writer = csv.writer(percentile_csv_file, delimiter=',', quotechar='"',
-                                                   quoting=csv.QUOTE_MINIMAL)
-                percentile_csv_writer.writerow(column_names)
-                for index, tree in enumerate(trees_sublist):
-                    row = get_tree_csv_row_values(tree)
-                    percentile_csv_writer.writerow(row)
-                    csv_writer.writerow(row)
-    return filepath_to_filename
+
+# trees grouped by the quadkey of the map tile at partition_zoom they lie in, one CSV per tile,
+# the index lists for each file its quadkey, tile bounds, bbox of its trees and number of rows,
+# so that clients only fetch the partitions intersecting their view
+def write_csv_partitions(trees, rows, path, file_name, partition_zoom=partition_zoom_default):
+    if len(rows) == 0:
+        raise Exception(f"Error: trees is empty for {path}{file_name}.csv")
+    lng = trees['lng'].to_numpy(zero_copy_only=False)
+    lat = trees['lat'].to_numpy(zero_copy_only=False)
+    located = ~np.isnan(lng) & ~np.isnan(lat)
+    tile_x, tile_y = get_tile_coordinates(np.where(located, lng, 0), np.where(located, lat, 0), partition_zoom)
+    tiles = pandas.DataFrame({'x': tile_x, 'y': tile_y, 'lng': lng, 'lat': lat})[located]
+    filepath_to_filename = {}
+    partitions = []
+    for (x, y), tile in tiles.groupby(['x', 'y'], sort=True):
+        quadkey = tile_to_quadkey(x, y, partition_zoom)
+        partition_file_name = f"{file_name}-{quadkey}.csv"
+        write_csv_file([rows[index] for index in tile.index], f"{path}{partition_file_name}")
+        filepath_to_filename[f"{path}{partition_file_name}"] = partition_file_name
+        partitions.append({
+            "file": partition_file_name,
+            "quadkey": quadkey,
+            "tile_bbox": get_tile_bbox(x, y, partition_zoom),
+            "bbox": [tile['lng'].min(), tile['lat'].min(), tile['lng'].max(), tile['lat'].max()],
+            "rows": len(tile)
+        })
+    index_file_name = f"{file_name}-partitions.json"
+    with open(f"{path}{index_file_name}", 'w') as f:
+        json.dump({"zoom": partition_zoom, "sequence": get_trees_sequence(trees), "partitions": partitions}, f)
+    return filepath_to_filename, {f"{path}{index_file_name}": index_file_name}
+
+
+# trees.csv with the radolan sum and trees-total.csv including the watering, each with its gzipped variant,
+# CSV has no place for metadata, so trees-export.json names the export sequence number of the files
+def write_trees_csvs(trees, path):
+    files = write_csv_content(get_tree_rows(trees, 'radolan_sum_total'), path, "trees-total") | \
+        write_csv_content(get_tree_rows(trees, 'radolan_sum'), path, "trees")
+    files |= gzip_files(files)
+    sequence = get_trees_sequence(trees)
+    if sequence is not None:
+        with open(f"{path}{export_file_name}", 'w') as f:
+            json.dump({"sequence": sequence, "files": sorted(files.values())}, f)
+        files[f"{path}{export_file_name}"] = export_file_name
+    return files
+
+
+def write_trees_csv_partitions(trees, path, partition_zoom=partition_zoom_default):
+    files = {}
+    index_files = {}
+    for file_name, radolan_sum_column in [("trees-total", 'radolan_sum_total'), ("trees", 'radolan_sum')]:
+        partition_files, index_file = write_csv_partitions(
+            trees, get_tree_rows(trees, radolan_sum_column), path, file_name, partition_zoom)
+        files |= partition_files
+        index_files |= index_file
+    return files | gzip_files(files) | index_files
 
 
 def write_radolan_csvs(engine, time_limit_days, path):
-    total_files_dict = write_trees_csv_total(engine, time_limit_days, path)
-    files_dict = write_trees_csv(engine, path)
-    return total_files_dict | files_dict
+    trees = get_trees_for_export(engine, time_limit_days)
+    return write_trees_csvs(trees, path) | write_trees_csv_partitions(trees, path)
@@ -0,0 +1,119 @@
+import json
+import logging
+import os
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from utils.gzip_file import gzip_files
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+delta_file_name = "trees-delta"
+snapshot_file_name = "trees-export-snapshot.parquet"
+delta_columns = ['id', 'radolan_sum', 'radolan_sum_total']
+sequence_metadata_key = b'sequence'
+
+
+def get_snapshot_path(path):
+    return f"{path}{snapshot_file_name}"
+
+
+def get_pending_snapshot_path(path):
+    return f"{path}{snapshot_file_name}.pending"
+
+
+# sequence number of the published snapshot, or of the pending one of a run whose upload failed
+def read_snapshot_sequence(file_path):
+    if not os.path.isfile(file_path):
+        return 0
+    return int(pq.read_schema(file_path).metadata[sequence_metadata_key])
+
+
+# radolan sums of the trees as published by the last run, together with the sequence number of that run
+def read_export_snapshot(file_path):
+    if not os.path.isfile(file_path):
+        return None, 0
+    snapshot = pq.read_table(file_path)
+    return snapshot.to_pandas(), int(snapshot.schema.metadata[sequence_metadata_key])
+
+
+def write_export_snapshot(trees, file_path, sequence):
+    snapshot = pa.Table.from_pandas(trees, preserve_index=False)
+    snapshot = snapshot.replace_schema_metadata({sequence_metadata_key: str(sequence).encode()})
+    pq.write_table(snapshot, f"{file_path}.tmp", compression="zstd")
+    os.replace(f"{file_path}.tmp", file_path)
+
+
+# sequence number of this run's exports, numbers of runs that were not published are not used again,
+# so that a client never sees two different states under the same number, the sequence of the uploaded
+# trees-delta.json is the floor, as the local snapshots only survive in the cache of the pipeline
+def get_export_sequence(path, published_sequence=0):
+    return max(read_snapshot_sequence(get_snapshot_path(path)),
+               read_snapshot_sequence(get_pending_snapshot_path(path)),
+               published_sequence) + 1
+
+
+# the trees with the sequence number of the export in their schema metadata, which the writers
+# store with the full exports, so that clients know which delta to continue with
+def with_export_sequence(trees, sequence):
+    return trees.replace_schema_metadata({**(trees.schema.metadata or {}),
+                                          sequence_metadata_key: str(sequence).encode()})
+
+
+def get_trees_sequence(trees):
+    metadata = trees.schema.metadata or {}
+    return int(metadata[sequence_metadata_key]) if sequence_metadata_key in metadata else None
+
+
+# trees that were added or whose radolan sums changed since the snapshot and the ids of the removed trees
+def get_changed_trees(trees, snapshot):
+    if snapshot is None:
+        return trees, []
+    merged = trees.merge(snapshot, on='id', how='left', suffixes=('', '_published'), indicator=True)
+    changed = (merged['_merge'] == 'left_only').to_numpy()
+    for column in ['radolan_sum', 'radolan_sum_total']:
+        current = merged[column]
+        published = merged[f"{column}_published"]
+        changed |= ((current != published) & ~(current.isna() & published.isna())).to_numpy()
+    removed_ids = snapshot.loc[~snapshot['id'].isin(trees['id']), 'id'].tolist()
+    return trees[changed], removed_ids
+
+
+# writes the changes since the last published snapshot as trees-delta-<sequence>.csv with
+# id, radolan_sum and total, and trees-delta-<sequence>.json with the sequence it applies to and the
+# removed trees, trees-delta.json is a copy of the latest one, every run writes a delta, also an empty one,
+# clients at previous_sequence apply it, clients behind follow the previous_sequence of the manifests back
+# to their own sequence, others download the full exports carrying the sequence in their metadata,
+# the new snapshot is kept pending until publish_trees_delta is called after the upload
+def write_trees_delta(trees, path):
+    sequence = get_trees_sequence(trees) or get_export_sequence(path)
+    trees = trees.select(delta_columns).to_pandas().drop_duplicates('id')
+    snapshot, previous_sequence = read_export_snapshot(get_snapshot_path(path))
+    changed_trees, removed_ids = get_changed_trees(trees, snapshot)
+    file_name = f"{delta_file_name}-{sequence:06d}.csv"
+    changed_trees.rename(columns={'radolan_sum_total': 'total'}).to_csv(
+        f"{path}{file_name}", index=False, float_format='%.0f')
+    files = {f"{path}{file_name}": file_name}
+    files |= gzip_files(files)
+    manifest = {
+        "sequence": sequence,
+        "previous_sequence": previous_sequence,
+        "file": file_name,
+        "changed": len(changed_trees),
+        "removed": removed_ids
+    }
+    for manifest_file_name in [f"{delta_file_name}-{sequence:06d}.json", f"{delta_file_name}.json"]:
+        with open(f"{path}{manifest_file_name}", 'w') as f:
+            json.dump(manifest, f)
+        files[f"{path}{manifest_file_name}"] = manifest_file_name
+    write_export_snapshot(trees, get_pending_snapshot_path(path), sequence)
+    logger.info(f"Delta {sequence} with {len(changed_trees)} changed and {len(removed_ids)} removed trees "
+                f"written to {path}{file_name}")
+    return files
+
+
+def publish_trees_delta(path):
+    if os.path.isfile(get_pending_snapshot_path(path)):
+        os.replace(get_pending_snapshot_path(path), get_snapshot_path(path))
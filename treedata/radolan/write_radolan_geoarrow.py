@@ -1,36 +1,108 @@
-import pandas as pd
-import geopandas as gpd
+import json
+import logging
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
 import pyarrow.feather as feather
-from lonboard._geoarrow.geopandas_interop import geopandas_to_geoarrow
 import pyarrow.parquet as pq
 
+from .spatial_keys import get_hilbert_order
+from .write_radolan_csvs import get_trees_for_export, age_default
+from .write_radolan_delta import get_trees_sequence, sequence_metadata_key
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+# rows per row group, with the rows in Hilbert order each group covers a compact part of the city
+row_group_size_default = 16384
+# attributes with few distinct values, stored dictionary encoded
+dictionary_columns = ['radolan_sum', 'age']
+
+
+# the exported trees with their radolan sum and age in Hilbert order of their position,
+# trees without plant year get the default age of the CSV export
+def get_trees_table(trees):
+    lng = trees['lng'].to_numpy(zero_copy_only=False)
+    lat = trees['lat'].to_numpy(zero_copy_only=False)
+    table = pa.table({
+        'id': trees['id'],
+        'lng': lng,
+        'lat': lat,
+        'radolan_sum': pc.cast(trees['radolan_sum'], pa.int32()),
+        'age': pc.cast(pc.fill_null(trees['age'], float(age_default)), pa.int32())
+    })
+    return table.take(get_hilbert_order(lng, lat))
+
+
+# the export sequence number as schema metadata of the written files
+def get_sequence_metadata(trees):
+    sequence = get_trees_sequence(trees)
+    return {} if sequence is None else {sequence_metadata_key: str(sequence).encode()}
+
+
+def get_bbox(table):
+    if table.num_rows == 0:
+        return []
+    return [pc.min(table['lng']).as_py(), pc.min(table['lat']).as_py(),
+            pc.max(table['lng']).as_py(), pc.max(table['lat']).as_py()]
+
 
-def write_geoarrow_content(path, file_name):
-    dtype_dic = {
-        'id': str,
-        'lng': float,
-        'lat': float,
-        'radolan_sum': int,
-        'age': int
+# GeoArrow interleaved points as written by lonboard before, with the low cardinality columns as dictionaries
+def write_feather(table, file_path, metadata=None):
+    coordinates = np.column_stack([table['lng'].to_numpy(), table['lat'].to_numpy()]).ravel()
+    geometry = pa.FixedSizeListArray.from_arrays(pa.array(coordinates, type=pa.float64()), 2)
+    columns = {
+        'id': table['id'],
+        **{column: pc.dictionary_encode(table[column]) for column in dictionary_columns},
     }
-    df = pd.read_csv(f"{path}{file_name}.csv", dtype=dtype_dic)
-    gdf = gpd.GeoDataFrame(
-        df, geometry=gpd.points_from_xy(df.lng, df.lat)
-    )
-    gdf = gdf.drop(columns=["lng", "lat"])
-    table = geopandas_to_geoarrow(gdf, preserve_index=False)
+    schema = pa.schema([pa.field(name, column.type) for name, column in columns.items()] + [
+        pa.field('geometry', geometry.type, metadata={'ARROW:extension:name': 'geoarrow.point'})
+    ], metadata=metadata)
+    feather.write_feather(pa.table([*columns.values(), geometry], schema=schema), file_path,
+                          compression="uncompressed")
 
-    file_path = f"{path}{file_name}.feather"
-    feather.write_feather(
-        table, file_path, compression="uncompressed"
-    )
+
+# GeoParquet 1.1 with native point encoding, the min/max statistics of geometry.x and geometry.y
+# give the bbox of every row group, so that readers can skip the groups outside of their viewport
+def write_geoparquet(table, file_path, row_group_size=row_group_size_default, metadata=None):
+    geometry = pa.StructArray.from_arrays([table['lng'].combine_chunks(), table['lat'].combine_chunks()],
+                                          names=['x', 'y'])
+    geo_metadata = {
+        "version": "1.1.0",
+        "primary_column": "geometry",
+        "columns": {"geometry": {"encoding": "point", "geometry_types": ["Point"], "bbox": get_bbox(table)}}
+    }
+    parquet_table = pa.table({
+        'id': table['id'],
+        **{column: table[column] for column in dictionary_columns},
+        'geometry': geometry
+    }).replace_schema_metadata({**(metadata or {}), b'geo': json.dumps(geo_metadata).encode()})
     pq.write_table(
-        table,
-        f"{path}{file_name}.parquet",
+        parquet_table,
+        file_path,
+        row_group_size=row_group_size,
+        use_dictionary=dictionary_columns,
+        write_statistics=True,
         compression="zstd"
     )
 
 
-def write_radolan_geoarrow(path):
-    file_name = "trees"
-    write_geoarrow_content(path, file_name)
+def write_geoarrow_content(trees, path, file_name, row_group_size=row_group_size_default):
+    table = get_trees_table(trees)
+    metadata = get_sequence_metadata(trees)
+    write_feather(table, f"{path}{file_name}.feather", metadata)
+    write_geoparquet(table, f"{path}{file_name}.parquet", row_group_size, metadata)
+    logger.info(f"Wrote {table.num_rows} trees to {path}{file_name}.feather and {path}{file_name}.parquet")
+    return {
+        f"{path}{file_name}.feather": f"{file_name}.feather",
+        f"{path}{file_name}.parquet": f"{file_name}.parquet"
+    }
+
+
+def write_trees_geoarrow(trees, path, row_group_size=row_group_size_default):
+    return write_geoarrow_content(trees, path, "trees", row_group_size)
+
+
+def write_radolan_geoarrow(engine, time_limit_days, path, row_group_size=row_group_size_default):
+    return write_trees_geoarrow(get_trees_for_export(engine, time_limit_days), path, row_group_size)
@@ -1,16 +1,14 @@
-import json
-from datetime import datetime
+from utils.geojson_writer import GeoJsonWriter, dumps
+from .write_radolan_values import write_radolan_values
 
 
+# the geometry is spliced in as pre-serialized GeoJSON fragment from the grid geometry cache
 def create_feature(prop_id, geometry, data):
-    return {
-        "type": "Feature",
-        "geometry": geometry,
-        "properties": {
-            "id": prop_id,
-            "data": data
-        }
-    }
+    properties = dumps({
+        "id": prop_id,
+        "data": data
+    })
+    return b'{"type": "Feature", "geometry": ' + geometry.encode('utf-8') + b', "properties": ' + properties + b'}'
 
 
 def transform_to_features(grid, clean, calc_fun):
@@ -19,7 +17,7 @@ def transform_to_features(grid, clean, calc_fun):
         data = calc_fun(clean[cellindex])
         features.append(create_feature(
             prop_id=cell[0],
-            geometry=json.loads(cell[1]),
+            geometry=cell[1],
             data=data
         ))
     return features
@@ -39,32 +37,15 @@ def transform_to_weather_light_geojson_features(grid, clean):
     return transform_to_features(grid, clean, calc_fun)
 
 
-def create_geo_json(start_date, end_date, features):
-    return {
-        "type": "FeatureCollection",
-        "properties": {
-            "start": start_date,
-            "end": end_date
-        },
-        "features": features
-    }
-
-
-def datetime_handler(value):
-    if isinstance(value, datetime):
-        return value.isoformat()
-    raise TypeError(f"Unknown type: {value}")
-
-
 def write_geojson(path, file_name, start_date, end_date, feature_list):
-    geojson = create_geo_json(
-        start_date=start_date,
-        end_date=end_date,
-        features=feature_list
-    )
     file_path = f"{path}{file_name}.geojson"
-    with open(file_path, 'w') as f:
-        f.write(json.dumps(geojson, default=datetime_handler))
+    properties = {
+        "start": start_date,
+        "end": end_date
+    }
+    with GeoJsonWriter(file_path, properties=properties) as writer:
+        for feature in feature_list:
+            writer.write_raw_feature(feature)
     return f"{file_name}.geojson"
 
 
@@ -77,7 +58,7 @@ objects_to_write = {
 }
 
 
-def write_radolan_geojsons(path, start_date, end_date, grid, clean):
+def write_radolan_geojsons(path, start_date, end_date, grid, clean, grid_version=None, grid_geometries=None):
     for file_name in objects_to_write:
         transform_fun = objects_to_write[file_name]
         features = transform_fun(grid=grid, clean=clean)
@@ -88,6 +69,17 @@ def write_radolan_geojsons(path, start_date, end_date, grid, clean):
             end_date=end_date,
             feature_list=features,
         )
+    # values-only artifact referring to the static grid geometry file
+    if grid_version is not None and grid_geometries is not None:
+        write_radolan_values(
+            path=path,
+            start_date=start_date,
+            end_date=end_date,
+            grid=grid,
+            clean=clean,
+            grid_version=grid_version,
+            grid_geometries=grid_geometries
+        )
 
 
 def get_radolan_files_for_upload(path):
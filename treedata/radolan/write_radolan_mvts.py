@@ -1,59 +1,259 @@
-import csv
-import mapbox_vector_tile
+import gzip
+import json
+import logging
+import multiprocessing
+import os
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+from mapbox_vector_tile.Mapbox import vector_tile_pb2
+import pyarrow as pa
+from pyarrow import csv as pa_csv
 from pyproj import Transformer
-from shapely.geometry import Point
 
-mvt_extent = 4096.0
+from .write_radolan_csvs import age_default
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+mvt_extent = 4096
 web_mercator_extent = 20037508.342789244
-scale_factor = mvt_extent / web_mercator_extent
 
 SRID_LNGLAT = 4326
 SRID_SPHERICAL_MERCATOR = 3857
-direct_transformer = Transformer.from_crs(crs_from=SRID_LNGLAT, crs_to=SRID_SPHERICAL_MERCATOR, always_xy=True)
-
-
-def write_mvt_content(trees, path, file_name):
-    file_path = f"{path}{file_name}.mvt"
-    features = to_features(trees)
-    tile_pbf = mapbox_vector_tile.encode(
-        {
-            "name": "trees",
-            "features": features
-        }, default_options={"quantize_bounds": (12.0, 51.0, 13.0, 52.0)})
-    with open(file_path, "wb") as binary_file:
-        binary_file.write(tile_pbf)
-
-
-def to_features(trees):
-    features = []
-    for tree in trees:
-        # id, lng, lat, radolan_sum, age
-        point = Point(tree[1],tree[2])
-        if tree[3].isdigit():
-            radolan_sum = int(tree[3])
-        else:
-            radolan_sum = None
-        if tree[4].isdigit():
-            age = int(tree[4])
+
+tiles_file_name = "trees"
+layer_name = "trees"
+min_zoom_default = 10
+max_zoom_default = 16
+# up to this zoom trees are clustered, above every tree is its own feature
+cluster_max_zoom_default = 13
+# size of the cluster cells in tile coordinates, 64 gives 64 x 64 cells per tile
+cluster_cell_size = 64
+tiles_per_task = 64
+
+
+# built on first use, creating a transformer costs more than the rest of the module import
+@lru_cache(maxsize=None)
+def get_direct_transformer():
+    return Transformer.from_crs(crs_from=SRID_LNGLAT, crs_to=SRID_SPHERICAL_MERCATOR, always_xy=True)
+
+
+# the exported trees with their radolan sum and age, trees without position are left out
+def get_trees_frame(trees):
+    trees = trees.select(['id', 'lng', 'lat', 'radolan_sum', 'age']).to_pandas()
+    trees['age'] = trees['age'].fillna(age_default)
+    return trees[trees['lng'].notna() & trees['lat'].notna()].reset_index(drop=True)
+
+
+# position of each tree as fraction of the web mercator world, x to the east and y to the south
+def get_world_coordinates(lng, lat):
+    x, y = get_direct_transformer().transform(lng, lat)
+    world_x = (np.asarray(x) + web_mercator_extent) / (2 * web_mercator_extent)
+    world_y = (web_mercator_extent - np.asarray(y)) / (2 * web_mercator_extent)
+    return np.clip(world_x, 0, 1 - 1e-12), np.clip(world_y, 0, 1 - 1e-12)
+
+
+# tile of each tree at the zoom level and its position within the tile quantized to the tile extent
+def quantize(world_x, world_y, zoom):
+    scaled_x = world_x * (1 << zoom)
+    scaled_y = world_y * (1 << zoom)
+    tile_x = np.floor(scaled_x).astype(np.int64)
+    tile_y = np.floor(scaled_y).astype(np.int64)
+    pixel_x = np.minimum(np.floor((scaled_x - tile_x) * mvt_extent), mvt_extent - 1).astype(np.int64)
+    pixel_y = np.minimum(np.floor((scaled_y - tile_y) * mvt_extent), mvt_extent - 1).astype(np.int64)
+    return tile_x, tile_y, pixel_x, pixel_y
+
+
+def get_tree_features(trees, tile_x, tile_y, pixel_x, pixel_y):
+    return pd.DataFrame({
+        'tile_x': tile_x, 'tile_y': tile_y, 'pixel_x': pixel_x, 'pixel_y': pixel_y,
+        'id': trees['id'], 'radolan_sum': trees['radolan_sum'], 'age': trees['age']
+    })
+
+
+# one feature per cluster cell at the mean position of its trees, with their count and mean values
+def get_cluster_features(trees, tile_x, tile_y, pixel_x, pixel_y):
+    features = pd.DataFrame({
+        'tile_x': tile_x, 'tile_y': tile_y,
+        'cell_x': pixel_x // cluster_cell_size, 'cell_y': pixel_y // cluster_cell_size,
+        'pixel_x': pixel_x, 'pixel_y': pixel_y,
+        'radolan_sum': trees['radolan_sum'], 'age': trees['age']
+    })
+    clusters = features.groupby(['tile_x', 'tile_y', 'cell_x', 'cell_y'], sort=False).agg(
+        pixel_x=('pixel_x', 'mean'), pixel_y=('pixel_y', 'mean'), count=('pixel_x', 'size'),
+        radolan_sum=('radolan_sum', 'mean'), age=('age', 'mean')
+    ).reset_index()
+    clusters['pixel_x'] = clusters['pixel_x'].round().astype(np.int64)
+    clusters['pixel_y'] = clusters['pixel_y'].round().astype(np.int64)
+    clusters['radolan_sum'] = clusters['radolan_sum'].round()
+    clusters['age'] = clusters['age'].round()
+    return clusters.drop(columns=['cell_x', 'cell_y'])
+
+
+def get_zoom_features(trees, world_x, world_y, zoom, cluster_max_zoom):
+    tile_x, tile_y, pixel_x, pixel_y = quantize(world_x, world_y, zoom)
+    if zoom <= cluster_max_zoom:
+        return get_cluster_features(trees, tile_x, tile_y, pixel_x, pixel_y)
+    return get_tree_features(trees, tile_x, tile_y, pixel_x, pixel_y)
+
+
+# per tile its coordinates, the pixel positions and the property columns, small enough to be sent to a worker
+def split_into_tiles(zoom, features):
+    property_columns = [column for column in ['id', 'count', 'radolan_sum', 'age'] if column in features]
+    for (tile_x, tile_y), tile in features.groupby(['tile_x', 'tile_y'], sort=True):
+        yield (zoom, int(tile_x), int(tile_y), tile['pixel_x'].to_numpy(), tile['pixel_y'].to_numpy(),
+               {column: tile[column].to_numpy() for column in property_columns})
+
+
+def zigzag(values):
+    return (values << 1) ^ (values >> 63)
+
+
+# the values of a property column as entries of the layer value table
+def add_layer_values(layer, uniques):
+    for value in uniques:
+        layer_value = layer.values.add()
+        if isinstance(value, str):
+            layer_value.string_value = value
+        elif value < 0:
+            layer_value.sint_value = int(value)
         else:
-            age = None
-        features.append({
-            "geometry": point.wkt,
-            "properties": {
-                "id": tree[0],
-                "radolan_sum": radolan_sum,
-                "age": age
-            }
-        })
-    print(features[0])
-    return features
-
-
-def write_radolan_mvts(path):
-    file_name = "trees"
-    file_path = f"{path}{file_name}.csv"
-    with open(file_path, newline='') as csvfile:
-        csv_reader = csv.reader(csvfile, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
-        next(csv_reader)
-        trees = [row for row in csv_reader]
-        write_mvt_content(trees, path, file_name)
+            layer_value.int_value = int(value)
+
+
+# point features are written straight into the protobuf message, the values of each property
+# are deduplicated column-wise, missing values are left out as vector tiles have no null
+def encode_tile(tile):
+    zoom, tile_x, tile_y, pixel_x, pixel_y, properties = tile
+    vector_tile = vector_tile_pb2.tile()
+    layer = vector_tile.layers.add()
+    layer.version = 2
+    layer.name = layer_name
+    layer.extent = mvt_extent
+    tag_columns = []
+    value_offset = 0
+    for key_index, (column, values) in enumerate(properties.items()):
+        codes, uniques = pd.factorize(values)
+        layer.keys.append(column)
+        add_layer_values(layer, uniques)
+        tag_columns.append((key_index, np.where(codes >= 0, codes + value_offset, -1)))
+        value_offset += len(uniques)
+    # a single MoveTo command per point with the zigzag encoded position
+    geometries = np.column_stack([np.full(len(pixel_x), 9), zigzag(pixel_x), zigzag(pixel_y)]).tolist()
+    tags = np.column_stack([value_indexes for _, value_indexes in tag_columns]).tolist()
+    key_indexes = [key_index for key_index, _ in tag_columns]
+    for geometry, value_indexes in zip(geometries, tags):
+        feature = layer.features.add()
+        feature.type = vector_tile_pb2.tile.Point
+        feature.geometry.extend(geometry)
+        for key_index, value_index in zip(key_indexes, value_indexes):
+            if value_index >= 0:
+                feature.tags.extend([key_index, value_index])
+    return zoom, tile_x, tile_y, gzip.compress(vector_tile.SerializeToString())
+
+
+def encode_tiles(tiles):
+    return [encode_tile(tile) for tile in tiles]
+
+
+def chunked(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if len(chunk) > 0:
+        yield chunk
+
+
+def create_mbtiles(file_path, metadata):
+    if os.path.isfile(file_path):
+        os.remove(file_path)
+    connection = sqlite3.connect(file_path)
+    connection.executescript('''
+        PRAGMA journal_mode = OFF;
+        PRAGMA synchronous = OFF;
+        CREATE TABLE metadata (name text, value text);
+        CREATE TABLE tiles (zoom_level integer, tile_column integer, tile_row integer, tile_data blob);
+    ''')
+    connection.executemany('INSERT INTO metadata (name, value) VALUES (?, ?)', metadata.items())
+    return connection
+
+
+def insert_tiles(connection, encoded_tiles):
+    # MBTiles numbers the rows from the south as in TMS
+    connection.executemany(
+        'INSERT INTO tiles (zoom_level, tile_column, tile_row, tile_data) VALUES (?, ?, ?, ?)',
+        [(zoom, tile_x, (1 << zoom) - 1 - tile_y, data) for zoom, tile_x, tile_y, data in encoded_tiles]
+    )
+
+
+def get_metadata(trees, min_zoom, max_zoom, cluster_max_zoom):
+    bounds = [trees['lng'].min(), trees['lat'].min(), trees['lng'].max(), trees['lat'].max()]
+    fields = {"id": "String", "radolan_sum": "Number", "age": "Number", "count": "Number"}
+    return {
+        "name": tiles_file_name,
+        "format": "pbf",
+        "type": "overlay",
+        "minzoom": str(min_zoom),
+        "maxzoom": str(max_zoom),
+        "bounds": ",".join(f"{value:.6f}" for value in bounds),
+        "center": f"{(bounds[0] + bounds[2]) / 2:.6f},{(bounds[1] + bounds[3]) / 2:.6f},{min_zoom}",
+        "json": json.dumps({"vector_layers": [{
+            "id": layer_name, "fields": fields, "minzoom": min_zoom, "maxzoom": max_zoom,
+            "description": f"trees, clustered up to zoom {cluster_max_zoom}"
+        }]})
+    }
+
+
+# the export writers run in threads, forking a process with other threads running
+# can leave the child with locks held that are never released
+def get_mp_context():
+    start_methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('forkserver' if 'forkserver' in start_methods else 'spawn')
+
+
+# writes the trees as z/x/y pyramid of gzipped vector tiles into trees.mbtiles,
+# the tiles are encoded by worker processes, each getting chunks of tiles_per_task tiles
+def write_trees_mvts(trees, path, min_zoom=min_zoom_default, max_zoom=max_zoom_default,
+                     cluster_max_zoom=cluster_max_zoom_default, workers=1):
+    trees = get_trees_frame(trees)
+    if len(trees) == 0:
+        raise Exception(f"Error: trees is empty for {path}{tiles_file_name}.mbtiles")
+    world_x, world_y = get_world_coordinates(trees['lng'].to_numpy(), trees['lat'].to_numpy())
+    file_path = f"{path}{tiles_file_name}.mbtiles"
+    tmp_path = f"{file_path}.tmp"
+    connection = create_mbtiles(tmp_path, get_metadata(trees, min_zoom, max_zoom, cluster_max_zoom))
+    executor = ProcessPoolExecutor(max_workers=workers, mp_context=get_mp_context()) if workers > 1 else None
+    tile_count = 0
+    try:
+        for zoom in range(min_zoom, max_zoom + 1):
+            features = get_zoom_features(trees, world_x, world_y, zoom, cluster_max_zoom)
+            tasks = chunked(split_into_tiles(zoom, features), tiles_per_task)
+            results = executor.map(encode_tiles, tasks) if executor is not None else map(encode_tiles, tasks)
+            for encoded_tiles in results:
+                insert_tiles(connection, encoded_tiles)
+                tile_count += len(encoded_tiles)
+            logger.info(f"Encoded {len(features)} features of zoom {zoom}")
+        connection.execute('CREATE UNIQUE INDEX tile_index ON tiles (zoom_level, tile_column, tile_row)')
+        connection.commit()
+    finally:
+        connection.close()
+        if executor is not None:
+            executor.shutdown()
+    os.replace(tmp_path, file_path)
+    logger.info(f"Wrote {tile_count} tiles of zoom {min_zoom} to {max_zoom} to {file_path}")
+    return {file_path: f"{tiles_file_name}.mbtiles"}
+
+
+# the pyramid of the trees written to trees.csv by the CSV export
+def write_radolan_mvts(path, min_zoom=min_zoom_default, max_zoom=max_zoom_default,
+                       cluster_max_zoom=cluster_max_zoom_default, workers=1):
+    trees = pa_csv.read_csv(f"{path}{tiles_file_name}.csv", convert_options=pa_csv.ConvertOptions(
+        column_types={'id': pa.string(), 'lng': pa.float64(), 'lat': pa.float64(), 'age': pa.float64()}))
+    return write_trees_mvts(trees, path, min_zoom, max_zoom, cluster_max_zoom, workers)
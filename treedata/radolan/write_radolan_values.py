@@ -0,0 +1,98 @@
+import json
+import os
+import struct
+
+import numpy as np
+
+from utils.geojson_writer import GeoJsonWriter, dumps
+
+values_file_name = "weather_values"
+grid_file_name_prefix = "weather_grid"
+
+# binary layout of weather_values.bin, all little-endian:
+# header: magic "RDLV", uint16 format version, uint16 number of days, uint32 number of cells
+# followed by int32 cell ids, int32 sums of all days per cell
+# and int16 daily values per cell, row-major (cell by cell, oldest day first)
+binary_magic = b"RDLV"
+binary_format_version = 1
+binary_header = struct.Struct("<4sHHI")
+
+
+def get_grid_file_name(grid_version):
+    return f"{grid_file_name_prefix}-{grid_version}.geojson"
+
+
+# the grid geometries only change with a new grid version, so the file is published once per version
+def write_grid_geojson(path, grid_version, grid_geometries):
+    file_name = get_grid_file_name(grid_version)
+    file_path = f"{path}{file_name}"
+    if not os.path.isfile(file_path):
+        with GeoJsonWriter(file_path, properties={"version": grid_version}) as writer:
+            for cell_id in sorted(grid_geometries):
+                writer.write_raw_feature(
+                    b'{"type": "Feature", "geometry": ' + grid_geometries[cell_id].encode('utf-8') +
+                    b', "properties": ' + dumps({"id": cell_id}) + b'}'
+                )
+    return file_name
+
+
+def get_values_arrays(grid, clean):
+    ids = np.array([cell[0] for cell in grid], dtype='<i4')
+    days = len(clean[0]) if len(clean) > 0 else 0
+    daily = np.array(clean, dtype='<i2').reshape(len(grid), days)
+    sums = daily.sum(axis=1, dtype='<i4')
+    return ids, sums, daily
+
+
+def write_values_binary(file_path, ids, sums, daily):
+    with open(file_path, 'wb') as f:
+        f.write(binary_header.pack(binary_magic, binary_format_version, daily.shape[1], len(ids)))
+        f.write(ids.astype('<i4').tobytes())
+        f.write(sums.astype('<i4').tobytes())
+        f.write(daily.astype('<i2').tobytes())
+
+
+def read_values_binary(file_path):
+    with open(file_path, 'rb') as f:
+        content = f.read()
+    magic, version, days, cell_count = binary_header.unpack_from(content)
+    if magic != binary_magic or version != binary_format_version:
+        raise Exception(f"{file_path} is no weather values file of version {binary_format_version}")
+    offset = binary_header.size
+    ids = np.frombuffer(content, dtype='<i4', count=cell_count, offset=offset)
+    offset += ids.nbytes
+    sums = np.frombuffer(content, dtype='<i4', count=cell_count, offset=offset)
+    offset += sums.nbytes
+    daily = np.frombuffer(content, dtype='<i2', count=cell_count * days, offset=offset).reshape(cell_count, days)
+    return ids, sums, daily
+
+
+def write_radolan_values(path, start_date, end_date, grid, clean, grid_version, grid_geometries):
+    grid_file_name = write_grid_geojson(path, grid_version, grid_geometries)
+    ids, sums, daily = get_values_arrays(grid, clean)
+    write_values_binary(f"{path}{values_file_name}.bin", ids, sums, daily)
+    manifest = {
+        "grid": grid_file_name,
+        "binary": f"{values_file_name}.bin",
+        "start": start_date.isoformat(),
+        "end": end_date.isoformat(),
+        "days": int(daily.shape[1]),
+        "ids": ids.tolist(),
+        "sums": sums.tolist(),
+        "data": daily.tolist()
+    }
+    with open(f"{path}{values_file_name}.json", 'w') as f:
+        json.dump(manifest, f, separators=(',', ':'))
+    return grid_file_name
+
+
+def get_radolan_values_files_for_upload(path):
+    file_path_to_file_name = {}
+    manifest_path = f"{path}{values_file_name}.json"
+    if not os.path.isfile(manifest_path):
+        return file_path_to_file_name, None
+    with open(manifest_path, 'r') as f:
+        grid_file_name = json.load(f)["grid"]
+    for file_name in [f"{values_file_name}.json", f"{values_file_name}.bin"]:
+        file_path_to_file_name[f"{path}{file_name}"] = file_name
+    return file_path_to_file_name, grid_file_name
@@ -0,0 +1,26 @@
+import argparse
+import logging
+
+from migrations.migrate import apply_migrations, check_indexes
+from utils.interact_with_database import get_db_engine
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+
+def configure_schema_args(parser=argparse.ArgumentParser(description='Manage database schema')):
+    parser.add_argument('command', choices=['migrate', 'check'],
+                        help='migrate: apply pending schema migrations, check: report missing indexes')
+    parser.add_argument('--target-version', dest='target_version', action='store', type=int,
+                        help='apply migrations only up to this version', default=None)
+    parser.set_defaults(which='schema', func=handle_schema)
+
+
+def handle_schema(args):
+    db_engine = get_db_engine()
+    if args.command == 'migrate':
+        apply_migrations(db_engine, target_version=args.target_version)
+    else:
+        missing = check_indexes(db_engine)
+        if len(missing) > 0:
+            raise Exception(f"{len(missing)} indexes required by the pipeline are missing")
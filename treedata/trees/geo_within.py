@@ -1,6 +1,14 @@
+import warnings
+
 import geopandas
+import pandas
 from shapely import Point
 
+# points further away from every polygon than this are outside the city and get no district,
+# in the units of the city shape CRS (degrees ~ 1 m or meters)
+border_distance_degrees = 0.00001
+border_distance_meters = 1.0
+
 
 def __get_district__(point, polygons):
     result = point.within(polygons)
@@ -19,3 +27,31 @@ def get_district(x, y, city_shape):
         ),
         city_shape
     )
+
+
+# district of each point via one spatial join against the polygons (STRtree backed),
+# a point within several polygons gets the first one in polygon order like get_district,
+# points within none (e.g. on a border) fall back to the nearest polygon, if it is close enough
+def get_districts(points, city_shape):
+    polygons = city_shape[['bez', city_shape.geometry.name]].reset_index(drop=True)
+    points_frame = geopandas.GeoDataFrame(geometry=geopandas.GeoSeries(points.values, crs=city_shape.crs))
+    points_frame = points_frame[~(points_frame.geometry.isna() | points_frame.geometry.is_empty)]
+
+    joined = geopandas.sjoin(points_frame, polygons, how='inner', predicate='within')
+    districts = joined.sort_values('index_right', kind='stable').groupby(level=0)['bez'].first()
+
+    missing = points_frame.loc[~points_frame.index.isin(districts.index)]
+    if len(missing) > 0:
+        with warnings.catch_warnings():
+            # distances in degrees are fine for finding the closest polygon of a point on its border
+            warnings.filterwarnings('ignore', message='Geometry is in a geographic CRS')
+            max_distance = border_distance_degrees \
+                if city_shape.crs is None or city_shape.crs.is_geographic else border_distance_meters
+            nearest = geopandas.sjoin_nearest(missing, polygons, how='inner', max_distance=max_distance)
+        nearest_districts = nearest.sort_values('index_right', kind='stable').groupby(level=0)['bez'].first()
+        districts = pandas.concat([districts, nearest_districts])
+
+    result = pandas.Series([None] * len(points), dtype=object)
+    result[districts.index] = districts.values
+    result.index = points.index
+    return result
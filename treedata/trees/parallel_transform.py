@@ -0,0 +1,61 @@
+import logging
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from .process_data import read_config, transform_new_tree_data, concat_transformed_trees
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+# city shape and config are handed over once per worker process instead of once per partition
+worker_context = {}
+
+
+def init_worker(city_shape, attribute_list, attribute_dtypes):
+    schema_mapping_dict, schema_calculated_dict = read_config()
+    worker_context.update(
+        city_shape=city_shape,
+        attribute_list=attribute_list,
+        attribute_dtypes=attribute_dtypes,
+        schema_mapping_dict=schema_mapping_dict,
+        schema_calculated_dict=schema_calculated_dict
+    )
+
+
+def transform_partition(new_trees):
+    return transform_new_tree_data(
+        new_trees=new_trees,
+        attribute_list=worker_context['attribute_list'],
+        schema_mapping_dict=worker_context['schema_mapping_dict'],
+        schema_calculated_dict=worker_context['schema_calculated_dict'],
+        city_shape=worker_context['city_shape'],
+        attribute_dtypes=worker_context['attribute_dtypes']
+    )
+
+
+def create_transform_executor(workers, city_shape, attribute_list, attribute_dtypes):
+    return ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=init_worker,
+        initargs=(city_shape, attribute_list, attribute_dtypes)
+    )
+
+
+# partitions the trees by row ranges, transforms them in the worker processes and
+# concatenates the results in partition order, so the output does not depend on scheduling
+def transform_new_tree_data_in_parallel(executor, workers, new_trees, attribute_dtypes):
+    # duplicates are dropped upfront, as they could end up in different partitions
+    duplicated = new_trees['objectid'].duplicated()
+    if duplicated.any():
+        logger.info(f"ℹ️ {int(duplicated.sum())} trees with a duplicated id were dropped.")
+        new_trees = new_trees[~duplicated]
+    partitions = [
+        new_trees.iloc[positions[0]:positions[-1] + 1]
+        for positions in np.array_split(np.arange(len(new_trees)), workers) if len(positions) > 0
+    ]
+    if len(partitions) == 0:
+        # empty input is still transformed by a worker, only the workers know the config
+        return executor.submit(transform_partition, new_trees).result()
+    transformed_partitions = list(executor.map(transform_partition, partitions))
+    return concat_transformed_trees(transformed_partitions, attribute_dtypes)
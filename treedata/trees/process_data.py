@@ -1,11 +1,16 @@
 import os
 import logging
+from functools import lru_cache
 from math import pi
 import yaml
 import datetime
 from dateutil import parser
 
-from .geo_within import get_district
+import geopandas
+import numpy as np
+import pandas
+
+from .geo_within import get_district, get_districts
 
 current_year = int(datetime.datetime.now().date().strftime("%Y"))
 
@@ -14,6 +19,8 @@ logger.setLevel(logging.DEBUG)
 
 ROOT_DIR = os.path.abspath(os.curdir)
 
+string_dtype = pandas.StringDtype('pyarrow')
+
 
 def read_config():
     with open(f"{ROOT_DIR}/resources/conf.yml", 'r') as stream:
@@ -29,6 +36,7 @@ def read_config():
     return schema_mapping_dict, schema_calculated_dict
 
 
+@lru_cache(maxsize=None)
 def read_genus_mapping():
     with open(f"{ROOT_DIR}/resources/genus.yml", 'r', encoding='utf-8') as stream:
         try:
@@ -40,9 +48,6 @@ def read_genus_mapping():
     return conf['genus']
 
 
-genus_mapping = read_genus_mapping()
-
-
 def lookup_genus(inputs):
     if 'species' in inputs:
         if not inputs['species'] is None:
@@ -56,6 +61,7 @@ def lookup_genus(inputs):
 def lookup_genus_german(inputs):
     if 'species' in inputs:
         genus = lookup_genus(inputs)
+        genus_mapping = read_genus_mapping()
         if genus in genus_mapping:
             return genus_mapping[genus]
         else:
@@ -128,7 +134,9 @@ def calc_update_date(inputs):
         return None
 
 
-calc_funs = {
+# row-wise variants, each called with a dict of the input values of one tree,
+# functions only registered here are applied row by row
+row_calc_funs = {
     "lookup_genus": lookup_genus,
     "lookup_genus_german": lookup_genus_german,
     "calc_plant_year": calc_plant_year,
@@ -138,67 +146,173 @@ calc_funs = {
 }
 
 
-def transform_new_tree_data(new_trees, attribute_list, schema_mapping_dict, schema_calculated_dict, city_shape):
-    transformed_trees = new_trees.rename(columns=schema_mapping_dict)
-    logger.info(f'Loaded {len(transformed_trees)} trees')
+# column-wise variants below are called with a dict of whole input columns (pandas Series)
+# plus the city shape and return a Series aligned to the input index
+
+def lookup_genus_vectorized(inputs):
+    if 'species' in inputs:
+        species = inputs['species'].astype('string')
+        return species.str.split(" ", n=1).str[0].astype(object).where(species.notna(), None)
+    else:
+        return None
+
+
+def lookup_genus_german_vectorized(inputs):
+    if 'species' in inputs:
+        genus = lookup_genus_vectorized(inputs)
+        genus_german = genus.map(read_genus_mapping())
+        unknown = genus[genus.notna() & genus_german.isna()].unique()
+        if len(unknown) > 0:
+            logger.info(f'{", ".join(map(str, unknown))} not in genus mapping')
+        return genus_german.astype(object).where(genus_german.notna(), None)
+    else:
+        return None
+
+
+def calc_plant_year_vectorized(inputs):
+    if 'age' in inputs:
+        age_str = inputs['age'].astype('string')
+        age = pandas.to_numeric(age_str, errors='coerce')
+        # non-integral values are not parsable as age, as in the row-wise variant
+        age = age.where(age == age.round())
+        # assuming spelling issue with leading dash
+        age = age.abs()
+        # assuming year instead of age given
+        plant_year = age.where(age >= 1000, current_year - age)
+        plant_year = plant_year.where(~age_str.str.contains("keine Angabe", regex=False).fillna(False))
+        return plant_year.astype('Int64')
+    else:
+        return None
+
+
+def calc_trunc_circumference_vectorized(inputs):
+    if 'diameter' in inputs:
+        diameter = pandas.to_numeric(inputs['diameter'], errors='coerce')
+        return (np.pi * diameter).round(2)
+    else:
+        return None
 
-    # transform gml_id here
-    transformed_trees['id'] = new_trees['objectid']
 
-    # drop not needed columns based on the columns of the old data
-    for column in transformed_trees.columns:
-        if column == "geometry":
+def lookup_district_vectorized(inputs):
+    if 'geometry' in inputs and 'city_shape' in inputs:
+        geometry = inputs['geometry']
+        city_shape = inputs['city_shape']
+        points = geopandas.GeoSeries(
+            geopandas.points_from_xy(geometry.x.round(5), geometry.y.round(5)),
+            index=geometry.index,
+            crs=city_shape.crs
+        )
+        # one spatial join for all trees instead of a point-in-polygon test per row
+        return get_districts(points, city_shape)
+    else:
+        return None
+
+
+def calc_update_date_vectorized(inputs):
+    if 'update_data_str' in inputs:
+        given_dates = inputs['update_data_str']
+        # export dates repeat a lot, so each distinct value is parsed only once
+        distinct_dates = pandas.Series(given_dates.dropna().unique())
+        parsed_dates = pandas.to_datetime(distinct_dates, errors='coerce', format='mixed')
+        dates = given_dates.map(dict(zip(distinct_dates, parsed_dates.dt.date)))
+        return dates.astype(object).where(dates.notna(), None)
+    else:
+        return None
+
+
+calc_funs = {
+    "lookup_genus": lookup_genus_vectorized,
+    "lookup_genus_german": lookup_genus_german_vectorized,
+    "calc_plant_year": calc_plant_year_vectorized,
+    "calc_trunc_circumference": calc_trunc_circumference_vectorized,
+    "lookup_district": lookup_district_vectorized,
+    "calc_update_date": calc_update_date_vectorized
+}
+
+
+def calculate_field(new_trees, key, input_fields, calc_fun, city_shape):
+    missing_fields = [input_field for input_field in input_fields if input_field not in new_trees.columns]
+    for input_field in missing_fields:
+        logger.info(f'Field {input_field} for calculation of {key} not among known columns')
+    if calc_fun in calc_funs:
+        inputs = {
+            input_fields[input_field]: new_trees[input_field]
+            for input_field in input_fields if input_field not in missing_fields
+        }
+        inputs['city_shape'] = city_shape
+        result = calc_funs[calc_fun](inputs)
+        if result is None:
+            return pandas.Series([None] * len(new_trees), index=new_trees.index, dtype=object)
+        return result
+
+    # fall back to row-wise calculation for functions without column-wise variant
+    def calculate_fun(row):
+        if len(missing_fields) > 0:
+            return None
+        inputs = {input_fields[input_field]: row[input_field] for input_field in input_fields}
+        if calc_fun == 'lookup_district':
+            inputs['city_shape'] = city_shape
+        return row_calc_funs[calc_fun](inputs)
+    return new_trees.apply(lambda row: calculate_fun(row), axis=1)
+
+
+# converts each column in a single pass to its target dtype, missing and empty values become NA
+def convert_attribute_dtypes(trees, attribute_dtypes):
+    for column, dtype in attribute_dtypes.items():
+        if column not in trees.columns:
             continue
+        values = trees[column]
+        if pandas.api.types.is_integer_dtype(dtype):
+            # decimal places are cut off, e.g. for heights given as float
+            values = np.trunc(pandas.to_numeric(values, errors='coerce')).astype(dtype)
+        elif pandas.api.types.is_float_dtype(dtype):
+            values = pandas.to_numeric(values, errors='coerce').astype(dtype)
+        elif pandas.api.types.is_datetime64_dtype(dtype):
+            values = pandas.to_datetime(values, errors='coerce')
         else:
-            if column not in attribute_list:
-                try:
-                    transformed_trees = transformed_trees.drop([column], axis=1)
-                except:
-                    logger.error(f'{column} not found')
+            values = values.astype(string_dtype).replace('', pandas.NA)
+            if isinstance(dtype, pandas.CategoricalDtype) or dtype == 'category':
+                values = values.astype('category')
+        trees[column] = values
+    return trees
+
+
+# categories differ between separately transformed parts, which makes concat fall back to object columns
+def concat_transformed_trees(transformed_parts, attribute_dtypes=None):
+    transformed_trees = pandas.concat(transformed_parts)
+    for column, dtype in (attribute_dtypes or {}).items():
+        if dtype == 'category' and column in transformed_trees:
+            transformed_trees[column] = transformed_trees[column].astype('category')
+    return transformed_trees
 
-    duplicates_count = len(transformed_trees) - len(transformed_trees.drop_duplicates(subset=['id']))
 
+def transform_new_tree_data(new_trees, attribute_list, schema_mapping_dict, schema_calculated_dict, city_shape,
+                            attribute_dtypes=None):
+    # only keep the columns of the old data, selected together with the rows
+    # so that dropped columns and duplicates are never copied
+    kept_columns = [
+        column for column in new_trees.columns
+        if column == "geometry" or schema_mapping_dict.get(column, column) in attribute_list
+    ]
     # drop duplicate features based on gml_id
-    transformed_trees = transformed_trees.drop_duplicates(subset=['id'])
-
-    # replace NA values with 'undefined' and transform data formats to string
-    for column in transformed_trees.columns:
-        if column != "geometry":
-            dtype = transformed_trees[column].dtype
-            if str(dtype).startswith('datetime64'):
-                transformed_trees[column] = transformed_trees[column].astype(str)
-            elif dtype != object or column == 'kronedurch':
-                # 'kronedurch' is from type object but is loaded to the db as double precision,
-                # this is why we have to make this hack here
-                transformed_trees[column] = transformed_trees[column].fillna('99999')
-                try:
-                    transformed_trees[column] = transformed_trees[column].astype(int).astype(str)
-                except:
-                    logger.error(f'{column} has type {transformed_trees[column].dtype}')
-    transformed_trees = transformed_trees.replace(['99999'], None)
-    transformed_trees = transformed_trees.replace('', None)
-
-    transformed_trees['lng'] = transformed_trees.geometry.x.round(5).astype(str)
-    transformed_trees['lat'] = transformed_trees.geometry.y.round(5).astype(str)
+    duplicated = new_trees['objectid'].duplicated()
+    duplicates_count = int(duplicated.sum())
+    transformed_trees = new_trees.loc[~duplicated, kept_columns].rename(columns=schema_mapping_dict)
+    logger.info(f'Loaded {len(new_trees)} trees')
+
+    # transform gml_id here
+    transformed_trees['id'] = new_trees['objectid']
+
+    transformed_trees['lng'] = transformed_trees.geometry.x.round(5)
+    transformed_trees['lat'] = transformed_trees.geometry.y.round(5)
 
     for key, value in schema_calculated_dict.items():
         if 'inputs' in value:
             input_fields = value['inputs']
             if 'function' in value:
                 calc_fun = value['function']
-                if calc_fun in calc_funs:
-                    def calculate_fun(row):
-                        inputs = {}
-                        for input_field in input_fields:
-                            if input_field in row:
-                                inputs[input_fields[input_field]] = row[input_field]
-                                if calc_fun == 'lookup_district':
-                                    inputs['city_shape'] = city_shape
-                                return calc_funs[calc_fun](inputs)
-                            else:
-                                logger.info(f'Field {input_field} for calculation of {key} not among known columns')
-                                return None
-                    transformed_trees[key] = new_trees.apply(lambda row: calculate_fun(row), axis=1)
+                if calc_fun in calc_funs or calc_fun in row_calc_funs:
+                    transformed_trees[key] = calculate_field(new_trees, key, input_fields, calc_fun, city_shape)
                 else:
                     logger.info(f'Function {calc_fun} for calculation of {key} not among known functions')
             else:
@@ -206,6 +320,9 @@ def transform_new_tree_data(new_trees, attribute_list, schema_mapping_dict, sche
         else:
             logger.info(f'No inputs definition in calculation of {key}')
 
+    if attribute_dtypes is not None:
+        transformed_trees = convert_attribute_dtypes(transformed_trees, attribute_dtypes)
+
     logger.info("ℹ️ " + str(duplicates_count) + " trees with a duplicated id were dropped.")
     return transformed_trees
 
@@ -1,116 +1,120 @@
 from sqlalchemy import text
 import logging
 
+from migrations.migrate import apply_migrations, analyze_tables
+
+# columns of the trees table kept in sync with the staging table and the staging expression they are set from,
+# the casts match the assignment casts into the text columns of trees, so that equal content hashes equally
+synced_columns = [
+    ("lat", 'B."lat"::text'),
+    ("lng", 'B."lng"::text'),
+    ("artdtsch", 'B."artdtsch"'),
+    ("artbot", 'B."artbot"'),
+    ("gattungdeutsch", 'B."gattungdeutsch"'),
+    ("gattung", 'B."gattung"'),
+    ("standortnr", 'B."standortnr"'),
+    ("strname", 'B."strname"'),
+    ("pflanzjahr", 'B."pflanzjahr"::text'),
+    ("stammumfg", 'B."stammumfg"::text'),
+    ("kronedurch", 'B."kronedurch"::text'),
+    ("baumhoehe", 'B."baumhoehe"::text'),
+    ("bezirk", 'B."bezirk"'),
+    ("geom", 'B."geom"'),
+    ("zuletztakt", 'B."aend_dat"'),
+]
+
 
 def create_trees_table(engine):
-    with engine.connect() as conn:
-        conn.execute(text('''
-            CREATE TABLE IF NOT EXISTS "public"."trees" (
-                "id" text NOT NULL,
-                "lat" text,
-                "lng" text,
-                "artdtsch" text,
-                "artbot" text,
-                "gattungdeutsch" text,
-                "gattung" text,
-                "standortnr" text,
-                "strname" text,
-                "pflanzjahr" text,
-                "stammdurch" text,
-                "kronedurch" text,
-                "baumhoehe" text,
-                "bezirk" text,
-                "geom" geometry,
-                "zuletztakt" timestamp,
-                "adopted" text,
-                "watered" text,
-                "radolan_sum" int4,
-                "radolan_days" _int4,
-                PRIMARY KEY ("id")
-            );        
-        '''))
-        conn.commit()
+    # the trees table including its indexes is owned by the schema migrations
+    apply_migrations(engine)
 
 
-def delete_removed_trees(engine, original_tree_table, tmp_tree_table):
-    with engine.connect() as conn:
-        result = conn.execute(text(f'''
-            DELETE FROM public."{original_tree_table}" WHERE standortnr IN (
-                SELECT A."standortnr" FROM public."{original_tree_table}" AS A
-                WHERE A."standortnr" NOT IN (
-                    SELECT B."standortnr" FROM public."{tmp_tree_table}" AS B
-                ) 
-                AND A."standortnr" not like 'osm_%'
-            )        
-        '''))
-        logging.info(f"Deleted {result.rowcount} trees.")
-        conn.commit()
+def content_hash(expressions):
+    return f"md5(ROW({', '.join(expressions)})::text)"
 
 
-def insert_added_trees(engine, original_tree_table, tmp_tree_table):
-    start_year = 1920
-    end_year = 2025
-    step = 5
-    ranges = [(year, year + step) for year in range(start_year, end_year, step)]
-    ranges.append((1500, 1920))
-    ranges.append((-1, -1))
-    tree_count = 0
-    for r in ranges:
-        with engine.connect() as conn:
-            # TODO id should be generated by database, but the current Supabase creates it as text NOT NULL only
-            if ranges[0] == -1:
-                year_range = "B.pflanzjahr::int IS NULL"
-            else:
-                year_range = f"B.pflanzjahr::int > {r[0]} AND B.pflanzjahr::int <= {r[1]}"
-            result = conn.execute(text(f'''
-                INSERT INTO public."{original_tree_table}" ("id")
-                SELECT id FROM public."{tmp_tree_table}" AS B
-                WHERE {year_range} 
-                AND B."id" IS NOT NULL AND B."id" NOT IN (
-                    SELECT "id" FROM public."{original_tree_table}" AS A
-                )        
-            '''))
-            tree_count += result.rowcount
-            conn.commit()
-    logging.info(f"Inserted {tree_count} trees.")
-
-
-def updated_trees(engine, original_tree_table, tmp_tree_table):
-    sql_update_str = f'''
-        WITH subquery AS (
-            SELECT B."id", B."lat", B."lng", B."artdtsch", B."artbot", B."gattungdeutsch", B."gattung", 
-                   B."standortnr", B."strname", B."pflanzjahr", B."stammumfg", 
-                   B."kronedurch", B."baumhoehe", B."bezirk", B."geom", B."aend_dat" 
-            FROM public."{tmp_tree_table}" AS B
+def original_content_hash():
+    return content_hash([f'A."{column}"' for column, _ in synced_columns])
+
+
+def tmp_content_hash():
+    return content_hash([expression for _, expression in synced_columns])
+
+
+def delete_removed_trees(conn, original_tree_table, tmp_tree_table):
+    result = conn.execute(text(f'''
+        DELETE FROM public."{original_tree_table}" AS A
+        WHERE A."standortnr" NOT LIKE 'osm_%'
+        AND NOT EXISTS (
+            SELECT 1 FROM public."{tmp_tree_table}" AS B WHERE B."standortnr" = A."standortnr"
         )
+    '''))
+    return result.rowcount
+
+
+# delta sync: the staging table only holds added and changed trees, removed trees are given by id
+def delete_trees_by_id(conn, original_tree_table, tree_ids):
+    result = conn.execute(text(f'''
+        DELETE FROM public."{original_tree_table}" AS A
+        WHERE A."id" = ANY(:tree_ids)
+        AND A."standortnr" NOT LIKE 'osm_%'
+    '''), {"tree_ids": list(tree_ids)})
+    return result.rowcount
+
+
+def insert_added_trees(conn, original_tree_table, tmp_tree_table):
+    # TODO id should be generated by database, but the current Supabase creates it as text NOT NULL only
+    columns = ", ".join(f'"{column}"' for column, _ in synced_columns)
+    expressions = ", ".join(expression for _, expression in synced_columns)
+    result = conn.execute(text(f'''
+        INSERT INTO public."{original_tree_table}" ("id", {columns})
+        SELECT DISTINCT ON (B."id") B."id", {expressions}
+        FROM public."{tmp_tree_table}" AS B
+        WHERE B."id" IS NOT NULL
+        AND NOT EXISTS (
+            SELECT 1 FROM public."{original_tree_table}" AS A WHERE A."id" = B."id"
+        )
+        ORDER BY B."id"
+    '''))
+    return result.rowcount
+
+
+# a moved tree may now lie in another radolan cell, without its radolan days it is picked up
+# by the backfill of update_tree_radolan_days, also if the vector of its new cell did not change
+moved_tree_resets = [
+    f'"{column}" = CASE WHEN A."geom" IS DISTINCT FROM B."geom" THEN NULL ELSE A."{column}" END'
+    for column in ["radolan_sum", "radolan_days"]
+]
+
+
+def update_changed_trees(conn, original_tree_table, tmp_tree_table):
+    # unchanged trees are not written at all, so they cause no dead tuples, WAL or trigger calls
+    assignments = ", ".join([f'"{column}" = {expression}' for column, expression in synced_columns] +
+                            moved_tree_resets)
+    result = conn.execute(text(f'''
         UPDATE public."{original_tree_table}" AS A
-        SET 
-        "lat" = B."lat", 
-        "lng" = B."lng", 
-        "artdtsch" = B."artdtsch", 
-        "artbot" = B."artbot", 
-        "gattungdeutsch" = B."gattungdeutsch", 
-        "gattung" = B."gattung", 
-        "standortnr" = B."standortnr", 
-        "strname" = B."strname", 
-        "pflanzjahr" = B."pflanzjahr"::int, 
-        "stammumfg" = B."stammumfg",            
-        "kronedurch" = B."kronedurch",
-        "baumhoehe" = B."baumhoehe", 
-        "bezirk" = B."bezirk",
-        "geom" = B."geom",
-        "zuletztakt" = B."aend_dat"
-        FROM subquery AS B
-        WHERE A."id" = B."id";
-    '''
-    with engine.connect() as conn:
-        result = conn.execute(text(sql_update_str))
-        logging.info(f'Updated {result.rowcount} trees')
-        conn.commit()
+        SET {assignments}
+        FROM public."{tmp_tree_table}" AS B
+        WHERE A."id" = B."id"
+        AND {original_content_hash()} IS DISTINCT FROM {tmp_content_hash()}
+    '''))
+    return result.rowcount
 
 
-def sync_trees(engine, original_tree_table, tmp_tree_table):
+def sync_trees(engine, original_tree_table, tmp_tree_table, removed_ids=None):
     create_trees_table(engine)
-    delete_removed_trees(engine, original_tree_table, tmp_tree_table)
-    insert_added_trees(engine, original_tree_table, tmp_tree_table)
-    updated_trees(engine, original_tree_table, tmp_tree_table)
+    analyze_tables(engine, [tmp_tree_table])
+    # all or nothing, a failed sync leaves the trees of the previous import in place
+    with engine.connect() as conn:
+        if removed_ids is None:
+            deleted_count = delete_removed_trees(conn, original_tree_table, tmp_tree_table)
+        else:
+            deleted_count = delete_trees_by_id(conn, original_tree_table, removed_ids)
+        inserted_count = insert_added_trees(conn, original_tree_table, tmp_tree_table)
+        updated_count = update_changed_trees(conn, original_tree_table, tmp_tree_table)
+        conn.commit()
+    logging.info(f"Deleted {deleted_count} trees.")
+    logging.info(f"Inserted {inserted_count} trees.")
+    logging.info(f'Updated {updated_count} trees')
+    analyze_tables(engine, [original_tree_table])
+    return {"deleted": deleted_count, "inserted": inserted_count, "updated": updated_count}
@@ -0,0 +1,97 @@
+import hashlib
+import logging
+import os
+
+import geopandas as gpd
+import numpy as np
+import pandas
+
+from utils.geojson_writer import GeoJsonWriter
+from utils.source_fetch import file_sha256, get_meta_path, read_meta, write_meta
+from .process_data import string_dtype, current_year
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+fingerprint_column = 'source_fingerprint'
+
+
+# hash of all source attributes including the point coordinates per tree, independent of the column order
+def get_source_fingerprints(trees):
+    attribute_columns = sorted(column for column in trees.columns if column != trees.geometry.name)
+    attributes = trees[attribute_columns].assign(x=trees.geometry.x, y=trees.geometry.y)
+    return pandas.util.hash_pandas_object(attributes, index=False)
+
+
+def get_tree_keys(trees):
+    # the transformed trees use the objectid as id
+    return trees['objectid'].astype(string_dtype)
+
+
+# everything besides the source rows the transformed trees depend on, i.e. the city shape,
+# the configuration files and the year the plant years are calculated with
+def get_transform_key(config_paths, year=current_year):
+    sha256 = hashlib.sha256(str(year).encode())
+    for config_path in config_paths:
+        file_sha256(config_path, sha256)
+    return sha256.hexdigest()
+
+
+# last transformed trees with the fingerprints of their source rows, keyed by id,
+# a snapshot transformed with another configuration is stale and not returned
+def read_snapshot(file_path, transform_key):
+    if not os.path.isfile(file_path):
+        return None
+    meta = read_meta(get_meta_path(file_path))
+    if meta is None or meta.get('transform_key') != transform_key:
+        logger.info(f"Configuration changed since {file_path} was written, ignoring it")
+        return None
+    snapshot = gpd.read_parquet(file_path)
+    logger.info(f"Loaded snapshot of {len(snapshot)} trees from {file_path}")
+    return snapshot
+
+
+def write_snapshot(file_path, transformed_trees, fingerprints, transform_key):
+    snapshot = transformed_trees.assign(**{fingerprint_column: fingerprints.loc[transformed_trees.index]})
+    tmp_path = f"{file_path}.tmp"
+    snapshot.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, file_path)
+    write_meta(get_meta_path(file_path), {"transform_key": transform_key})
+    logger.info(f"Wrote snapshot of {len(snapshot)} trees to {file_path}")
+
+
+# splits the new source trees into the rows that have to be transformed, because they were added or changed,
+# and the transformed rows of the snapshot that can be reused, indexed like the new source rows
+def diff_with_snapshot(new_trees, fingerprints, snapshot):
+    first = ~new_trees['objectid'].duplicated()
+    new_trees = new_trees[first]
+    fingerprints = fingerprints[first]
+    # plain object arrays, the hash table lookups are much slower on arrow backed strings
+    keys = get_tree_keys(new_trees).to_numpy(dtype=object)
+    snapshot_ids = snapshot['id'].to_numpy(dtype=object)
+    positions = pandas.Index(snapshot_ids).get_indexer(keys)
+    added = positions == -1
+    previous_fingerprints = snapshot[fingerprint_column].to_numpy()[np.where(added, 0, positions)]
+    changed = ~added & (previous_fingerprints != fingerprints.to_numpy())
+    unchanged = ~added & ~changed
+    reused_trees = snapshot.drop(columns=fingerprint_column).iloc[positions[unchanged]]
+    reused_trees.index = new_trees.index[unchanged]
+    removed_ids = snapshot_ids[pandas.Index(keys).get_indexer(snapshot_ids) == -1].tolist()
+    logger.info(f"{int(added.sum())} trees added, {int(changed.sum())} changed, {len(removed_ids)} removed "
+                f"since the last snapshot")
+    return {
+        "to_transform": new_trees[added | changed],
+        "added_ids": keys[added].tolist(),
+        "reused_trees": reused_trees,
+        "removed_ids": removed_ids
+    }
+
+
+# compact delta for the database sync and downstream consumers: the added and changed trees
+# as features with their kind of change, the ids of the removed trees in the collection properties
+def write_delta_geojson(file_path, transformed_changes, added_ids, removed_ids):
+    added = transformed_changes['id'].isin(added_ids).to_numpy()
+    properties = {"added": int(added.sum()), "changed": int((~added).sum()), "removed": removed_ids}
+    with GeoJsonWriter(file_path, properties=properties, date_format='%Y-%m-%d') as writer:
+        writer.write_frame(transformed_changes.assign(change=np.where(added, 'added', 'changed')))
+    return file_path
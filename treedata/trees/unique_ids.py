@@ -0,0 +1,24 @@
+import numpy as np
+
+
+# set of already seen tree ids kept as one sorted numpy array,
+# compact enough to detect duplicates across all batches of a large cadastre
+class UniqueIds:
+    def __init__(self):
+        self.ids = None
+
+    def __len__(self):
+        return 0 if self.ids is None else len(self.ids)
+
+    # marks the ids seen for the first time, i.e. neither in an earlier batch nor earlier in this one
+    def add(self, ids):
+        values = np.asarray(ids)
+        first_in_batch = np.zeros(len(values), dtype=bool)
+        first_in_batch[np.unique(values, return_index=True)[1]] = True
+        if self.ids is None:
+            new = first_in_batch
+            self.ids = np.unique(values)
+        else:
+            new = first_in_batch & ~np.isin(values, self.ids, assume_unique=False)
+            self.ids = np.union1d(self.ids, values[new])
+        return new
@@ -1,13 +1,22 @@
 import argparse
 import logging
 import os
+from contextlib import ExitStack
 
 import pandas
 
 from trees.sync_trees import sync_trees
-from utils.get_data_from_wfs import read_geojson, store_as_geojson
-from utils.interact_with_database import get_db_engine, add_to_db
-from trees.process_data import read_config, transform_new_tree_data
+from utils.get_data_from_wfs import read_geojson
+from utils.intermediate_files import read_intermediate, read_intermediate_batches, write_intermediate, \
+    intermediate_formats, intermediate_format_default, get_intermediate_file_path, IntermediateWriter
+from utils.source_fetch import is_up_to_date, mark_up_to_date
+from utils.interact_with_database import get_db_engine, add_to_db, prepare_staging_table, copy_to_staging_table, \
+    build_staging_indexes
+from trees.process_data import read_config, transform_new_tree_data, concat_transformed_trees
+from trees.parallel_transform import create_transform_executor, transform_new_tree_data_in_parallel
+from trees.unique_ids import UniqueIds
+from trees.tree_snapshot import get_source_fingerprints, get_transform_key, read_snapshot, write_snapshot, \
+    diff_with_snapshot, write_delta_geojson
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
@@ -34,6 +43,26 @@ attribute_list = [
     'bezirk'
 ]
 
+# target dtypes of the transformed trees, repeated names are stored as categories
+attribute_dtypes = {
+    'id': 'string[pyarrow]',
+    'strname': 'category',
+    'artbot': 'category',
+    'artdtsch': 'category',
+    'standortnr': 'string[pyarrow]',
+    'baumhoehe': 'Int32',
+    'stammdurch': 'Int32',
+    'kronedurch': 'Int32',
+    'aend_dat': 'datetime64[ns]',
+    'gattung': 'category',
+    'gattungdeutsch': 'category',
+    'pflanzjahr': 'Int32',
+    'stammumfg': 'float64',
+    'lat': 'float64',
+    'lng': 'float64',
+    'bezirk': 'category'
+}
+
 geojson_file_name_default = 'trees-transformed'
 database_table_name_default = 'trees_tmp'
 
@@ -56,49 +85,212 @@ def configure_trees_process_args(parser=argparse.ArgumentParser(description='Tra
                         help='skip step of storing transform Geo data frame to GeoJSON file', default=False)
     parser.add_argument('--skip-upload-to-db', dest='skip_upload_to_db', action='store_true',
                         help='skip storing Geo data frame to database', default=False)
+    parser.add_argument('--batch-size', dest='batch_size', action='store', type=int,
+                        help='stream the trees in batches of this many features instead of loading all at once',
+                        default=0)
+    parser.add_argument('--workers', dest='workers', action='store', type=int,
+                        help='number of processes to transform the trees with, partitioned by row ranges',
+                        default=1)
+    parser.add_argument('--incremental', dest='incremental', action='store_true',
+                        help='only transform trees added or changed since the last run and upload them as delta, '
+                             'compared against a snapshot written next to the transformed GeoJSON',
+                        default=False)
+    parser.add_argument('--intermediate-format', dest='intermediate_format', action='store',
+                        choices=intermediate_formats, default=intermediate_format_default,
+                        help='format of the trees file read and of the transformed trees file written, '
+                             'GeoJSON only when it is published as is')
+    parser.add_argument('--force', dest='force', action='store_true',
+                        help='process even if trees file and configuration did not change since the last full run',
+                        default=False)
     parser.set_defaults(which='trees_process', func=handle_trees_process)
 
 
+# bounded memory variant: each batch is transformed, appended to the transformed trees file and
+# loaded to the staging table before the next one is read, only the ids seen so far are kept
+def handle_trees_process_in_batches(args, city_shape, schema_mapping_dict, schema_calculated_dict, executor=None):
+    if not args.skip_transform:
+        source_file_name = args.trees_file_name
+    else:
+        source_file_name = args.geojson_file_name
+    db_engine = None
+    if not args.skip_upload_to_db:
+        logger.info("Adding new trees to database...")
+        db_engine = get_db_engine()
+        # emptied before the first batch, so that an empty source does not sync the trees of the previous run
+        prepare_staging_table(db_engine, args.database_table_name)
+    unique_ids = UniqueIds()
+    duplicates_count = 0
+    tree_count = 0
+    with ExitStack() as stack:
+        writer = None
+        # the file read from is not rewritten while streaming it
+        if not args.skip_store_as_geojson and not args.skip_transform:
+            writer = stack.enter_context(IntermediateWriter(
+                f"{ROOT_DIR}/resources/trees/{args.geojson_file_name}",
+                args.intermediate_format,
+                date_format='%Y-%m-%d'
+            ))
+        batches = read_intermediate_batches(f"{ROOT_DIR}/resources/trees/{source_file_name}",
+                                            args.intermediate_format, args.batch_size)
+        for batch_index, trees in enumerate(batches):
+            if not args.skip_transform:
+                new = unique_ids.add(trees['objectid'])
+                duplicates_count += int((~new).sum())
+                trees = transform_trees(trees[new], city_shape, schema_mapping_dict, schema_calculated_dict,
+                                        executor, args.workers)
+            if 'aend_dat' in trees:
+                trees['aend_dat'] = pandas.to_datetime(trees['aend_dat'], errors='coerce')
+            if writer is not None:
+                writer.write_frame(trees)
+            if db_engine is not None:
+                copy_to_staging_table(db_engine, trees, args.database_table_name)
+            tree_count += len(trees)
+            logger.info(f"Processed batch {batch_index + 1} with {len(trees)} trees")
+    logger.info(f"Processed {tree_count} trees, dropped {duplicates_count} trees with a duplicated id")
+
+    if db_engine is not None:
+        build_staging_indexes(db_engine, args.database_table_name)
+        sync_trees(
+            engine=db_engine,
+            original_tree_table='trees',
+            tmp_tree_table=args.database_table_name
+        )
+
+
+def transform_trees(new_trees, city_shape, schema_mapping_dict, schema_calculated_dict, executor=None, workers=1):
+    if executor is not None:
+        return transform_new_tree_data_in_parallel(executor, workers, new_trees, attribute_dtypes)
+    return transform_new_tree_data(
+        new_trees=new_trees,
+        attribute_list=attribute_list,
+        schema_mapping_dict=schema_mapping_dict,
+        schema_calculated_dict=schema_calculated_dict,
+        city_shape=city_shape,
+        attribute_dtypes=attribute_dtypes
+    )
+
+
+# everything the transformed trees depend on besides the trees
+def get_transform_config_paths(args):
+    return [
+        f"{ROOT_DIR}/resources/city_shape/{args.city_shape_file_name}.geojson",
+        f"{ROOT_DIR}/resources/conf.yml",
+        f"{ROOT_DIR}/resources/genus.yml"
+    ]
+
+
+def get_transform_source_paths(args):
+    return [
+        get_intermediate_file_path(f"{ROOT_DIR}/resources/trees/{args.trees_file_name}", args.intermediate_format)
+    ] + get_transform_config_paths(args)
+
+
 def handle_trees_process(args):
+    # only a run doing all steps is recorded and can be skipped, as it leaves file and database up to date
+    full_run = not (args.skip_transform or args.skip_store_as_geojson or args.skip_upload_to_db)
+    source_paths = get_transform_source_paths(args)
+    output_path = get_intermediate_file_path(f"{ROOT_DIR}/resources/trees/{args.geojson_file_name}",
+                                             args.intermediate_format)
+    # the plant years are calculated with the current year, so the output also expires with the year
+    transform_key = get_transform_key(get_transform_config_paths(args)) if full_run else None
+    if full_run and not args.force and is_up_to_date(source_paths, output_path, transform_key):
+        logger.info("✅ Trees and configuration unchanged since the last run, nothing to process")
+        return
+
     city_shape = read_geojson(f"{ROOT_DIR}/resources/city_shape/{args.city_shape_file_name}.geojson")
     schema_mapping_dict, schema_calculated_dict = read_config()
 
+    with ExitStack() as stack:
+        executor = None
+        if args.workers > 1 and not args.skip_transform:
+            logger.info(f"Transforming trees with {args.workers} worker processes")
+            executor = stack.enter_context(
+                create_transform_executor(args.workers, city_shape, attribute_list, attribute_dtypes))
+        handle_trees_process_with_executor(args, city_shape, schema_mapping_dict, schema_calculated_dict, executor)
+
+    if full_run:
+        mark_up_to_date(source_paths, output_path, transform_key)
+
+
+# transforms only the trees whose source attributes differ from the snapshot of the last run,
+# returns all transformed trees and the delta, which is None if there was no snapshot yet
+def transform_trees_incrementally(args, new_trees, city_shape, schema_mapping_dict, schema_calculated_dict, executor,
+                                  transform_key):
+    fingerprints = get_source_fingerprints(new_trees)
+    snapshot = read_snapshot(f"{ROOT_DIR}/resources/trees/{args.geojson_file_name}-snapshot.parquet", transform_key)
+    if snapshot is None:
+        logger.info("No snapshot found, transforming all trees")
+        transformed_trees = transform_trees(new_trees, city_shape, schema_mapping_dict, schema_calculated_dict,
+                                            executor, args.workers)
+        return transformed_trees, fingerprints, None
+    diff = diff_with_snapshot(new_trees, fingerprints, snapshot)
+    transformed_changes = transform_trees(diff['to_transform'], city_shape, schema_mapping_dict,
+                                          schema_calculated_dict, executor, args.workers)
+    write_delta_geojson(
+        f"{ROOT_DIR}/resources/trees/{args.geojson_file_name}-delta.geojson",
+        transformed_changes, diff['added_ids'], diff['removed_ids']
+    )
+    # source order, as if all trees had been transformed
+    transformed_trees = concat_transformed_trees([diff['reused_trees'], transformed_changes], attribute_dtypes)
+    delta = {"trees": transformed_changes, "removed_ids": diff['removed_ids']}
+    return transformed_trees.sort_index(), fingerprints, delta
+
+
+def handle_trees_process_with_executor(args, city_shape, schema_mapping_dict, schema_calculated_dict, executor):
+    if args.batch_size > 0:
+        if args.incremental:
+            raise Exception("--incremental can not be combined with --batch-size")
+        handle_trees_process_in_batches(args, city_shape, schema_mapping_dict, schema_calculated_dict, executor)
+        return
+
+    delta = None
+    fingerprints = None
+    transform_key = None
     if not args.skip_transform:
-        new_trees = read_geojson(f"{ROOT_DIR}/resources/trees/{args.trees_file_name}.geojson")
-        transformed_trees = transform_new_tree_data(
-            new_trees=new_trees,
-            attribute_list=attribute_list,
-            schema_mapping_dict=schema_mapping_dict,
-            schema_calculated_dict=schema_calculated_dict,
-            city_shape=city_shape
-        )
+        new_trees = read_intermediate(f"{ROOT_DIR}/resources/trees/{args.trees_file_name}", args.intermediate_format)
+        if args.incremental:
+            transform_key = get_transform_key(get_transform_config_paths(args))
+            transformed_trees, fingerprints, delta = transform_trees_incrementally(
+                args, new_trees, city_shape, schema_mapping_dict, schema_calculated_dict, executor, transform_key)
+        else:
+            transformed_trees = transform_trees(new_trees, city_shape, schema_mapping_dict, schema_calculated_dict,
+                                                executor, args.workers)
     else:
-        transformed_trees = read_geojson(f"{ROOT_DIR}/resources/trees/{args.geojson_file_name}.geojson")
+        transformed_trees = read_intermediate(f"{ROOT_DIR}/resources/trees/{args.geojson_file_name}",
+                                              args.intermediate_format)
+
+    if 'aend_dat' in transformed_trees:
+        transformed_trees['aend_dat'] = pandas.to_datetime(transformed_trees['aend_dat'], errors='coerce')
 
     if not args.skip_store_as_geojson:
-        if 'aend_dat' in transformed_trees:
-            def try_date_to_str(value):
-                if value is None:
-                    return None
-                try:
-                    if type(value) is str:
-                        return value
-                    else:
-                        return value.strftime('%Y-%m-%d')
-                except Exception as e:
-                    logging.exception(f"cannot transform date to string {type(value)}: {e}")
-                    return None
-            transformed_trees['aend_dat'] = transformed_trees['aend_dat'].apply(try_date_to_str)
-        store_as_geojson(transformed_trees, f"{ROOT_DIR}/resources/trees/{args.geojson_file_name}")
+        write_intermediate(
+            transformed_trees,
+            f"{ROOT_DIR}/resources/trees/{args.geojson_file_name}",
+            args.intermediate_format,
+            date_format='%Y-%m-%d'
+        )
 
     if not args.skip_upload_to_db:
         logger.info("Adding new trees to database...")
         db_engine = get_db_engine()
-        if 'aend_dat' in transformed_trees:
-            transformed_trees['aend_dat'] = pandas.to_datetime(transformed_trees['aend_dat'], format='%Y-%m-%d')
-        add_to_db(db_engine, transformed_trees, args.database_table_name)
-        sync_trees(
-            engine=db_engine,
-            original_tree_table='trees',
-            tmp_tree_table=args.database_table_name
-        )
+        if delta is not None:
+            add_to_db(db_engine, delta['trees'], args.database_table_name)
+            sync_trees(
+                engine=db_engine,
+                original_tree_table='trees',
+                tmp_tree_table=args.database_table_name,
+                removed_ids=delta['removed_ids']
+            )
+        else:
+            add_to_db(db_engine, transformed_trees, args.database_table_name)
+            sync_trees(
+                engine=db_engine,
+                original_tree_table='trees',
+                tmp_tree_table=args.database_table_name
+            )
+
+    # only advanced after the database sync succeeded, so that the next delta starts from the synced state,
+    # without a sync the database did not receive the trees and the snapshot is kept as it is
+    if fingerprints is not None and not args.skip_upload_to_db:
+        write_snapshot(f"{ROOT_DIR}/resources/trees/{args.geojson_file_name}-snapshot.parquet",
+                       transformed_trees, fingerprints, transform_key)
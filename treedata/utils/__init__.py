@@ -1,3 +1,10 @@
-from . import get_data_from_wfs
-from . import interact_with_database
-from . import wfs_with_args
+import importlib
+
+# the submodules are imported on first access, importing one of them does not load the others
+__all__ = ['get_data_from_wfs', 'interact_with_database', 'wfs_with_args']
+
+
+def __getattr__(name):
+    if name in __all__:
+        return importlib.import_module(f".{name}", __name__)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
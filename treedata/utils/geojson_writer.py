@@ -0,0 +1,113 @@
+import datetime
+import gzip
+import logging
+import os
+
+import numpy as np
+import orjson
+import pandas as pd
+import shapely
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+write_buffer_size = 1024 * 1024
+frame_chunk_size = 10000
+
+
+def default_handler(value):
+    if value is None or value is pd.NaT or value is pd.NA:
+        return None
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"Unknown type: {type(value)}")
+
+
+def dumps(value):
+    return orjson.dumps(value, default=default_handler, option=orjson.OPT_SERIALIZE_NUMPY)
+
+
+def geometry_fragments(geometries, precision=None):
+    geometries = np.asarray(geometries, dtype=object)
+    if precision is not None:
+        geometries = shapely.transform(geometries, lambda coords: np.round(coords, precision))
+    return [b"null" if fragment is None else fragment.encode('utf-8')
+            for fragment in shapely.to_geojson(geometries)]
+
+
+# writes a GeoJSON FeatureCollection feature by feature, so that neither the
+# collection dict nor the whole output string has to be kept in memory
+class GeoJsonWriter:
+    def __init__(self, file_path, properties=None, precision=None, compress=False, date_format=None):
+        self.file_path = file_path
+        self.properties = properties
+        self.precision = precision
+        self.compress = compress
+        self.date_format = date_format
+        self.feature_count = 0
+        self.file = None
+
+    def __enter__(self):
+        if self.compress:
+            self.file = gzip.open(self.file_path, 'wb', compresslevel=6)
+        else:
+            self.file = open(self.file_path, 'wb', buffering=write_buffer_size)
+        self.file.write(b'{"type": "FeatureCollection"')
+        if self.properties is not None:
+            self.file.write(b', "properties": ' + dumps(self.properties))
+        self.file.write(b', "features": [')
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            # never leave a truncated but valid-looking collection behind
+            self.file.close()
+            if os.path.exists(self.file_path):
+                os.remove(self.file_path)
+            return False
+        try:
+            self.file.write(b']}')
+        finally:
+            self.file.close()
+        logger.info(f"Wrote {self.feature_count} features to {self.file_path}")
+        return False
+
+    # pre-serialized feature, e.g. with a geometry fragment from a cache
+    def write_raw_feature(self, feature):
+        if isinstance(feature, str):
+            feature = feature.encode('utf-8')
+        if self.feature_count > 0:
+            self.file.write(b', ')
+        self.file.write(feature)
+        self.feature_count += 1
+
+    def write_feature(self, feature):
+        self.write_raw_feature(dumps(feature))
+
+    def write_frame(self, data, chunk_size=frame_chunk_size):
+        property_columns = [column for column in data.columns if column != data.geometry.name]
+        date_columns = [column for column in property_columns
+                        if self.date_format is not None and pd.api.types.is_datetime64_any_dtype(data[column])]
+        for start in range(0, len(data), chunk_size):
+            chunk = data.iloc[start:start + chunk_size]
+            geometries = geometry_fragments(chunk.geometry.values, self.precision)
+            properties = chunk[property_columns].assign(**{
+                column: chunk[column].dt.strftime(self.date_format) for column in date_columns
+            })
+            records = properties.to_dict('records')
+            for feature_id, geometry, record in zip(chunk.index, geometries, records):
+                self.write_raw_feature(
+                    b'{"id": ' + dumps(str(feature_id)) +
+                    b', "type": "Feature", "properties": ' + dumps(record) +
+                    b', "geometry": ' + geometry + b'}'
+                )
+
+
+def write_geojson(data, file_path, precision=None, compress=False, date_format=None, to_wgs84=True):
+    if to_wgs84 and data.crs is not None and not data.crs.equals("epsg:4326"):
+        data = data.to_crs("epsg:4326")
+    with GeoJsonWriter(file_path, precision=precision, compress=compress, date_format=date_format) as writer:
+        writer.write_frame(data)
+    return file_path
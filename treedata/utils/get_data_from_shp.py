@@ -2,9 +2,11 @@ import os
 import ssl
 import logging
 import geopandas as gpd
-from requests import Request, get
+from requests import Request
 
-from requests import Request, get
+from .geojson_writer import write_geojson
+from .intermediate_files import write_intermediate
+from .source_fetch import fetch_source
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
@@ -19,25 +21,21 @@ def get_shp_request_url(shp_url):
     return Request('GET', shp_url).prepare().url
 
 
-def download_shp(shp_url, outfile_path, chunk_size=128):
+def download_shp(shp_url, outfile_path):
     logger.info(f"Request Shapefile from {shp_url}")
-    r = get(shp_url, stream=True)
-    with open(f"{outfile_path}.zip", 'wb') as fd:
-        for chunk in r.iter_content(chunk_size=chunk_size):
-            fd.write(chunk)
+    return fetch_source(shp_url, f"{outfile_path}.zip")
 
 
-def convert_shp_to_geojson(infile_path, source_encoding, outfile_path):
+def convert_shp_to_geojson(infile_path, source_encoding, outfile_path, intermediate_format='geojson'):
     logger.info(f'Load Shapefile {infile_path}.zip')
     data = gpd.read_file(f"{infile_path}.zip", encoding=source_encoding, crs_wkt='2100')
-    store_as_geojson(data, outfile_path)
+    write_intermediate(data, outfile_path, intermediate_format)
 
 
-def store_as_geojson(data, outfile_name):
-    geojson_str = data.to_json(to_wgs84=True)
-    with open(f"{outfile_name}.geojson", 'w', encoding='utf-8') as fd:
-        fd.write(geojson_str)
-    logger.info(f"WFS was written to file {outfile_name}.geojson")
+def store_as_geojson(data, outfile_name, precision=None, compress=False, date_format=None):
+    file_path = f"{outfile_name}.geojson.gz" if compress else f"{outfile_name}.geojson"
+    write_geojson(data, file_path, precision=precision, compress=compress, date_format=date_format)
+    logger.info(f"WFS was written to file {file_path}")
 
 
 def read_geojson(infile_name):
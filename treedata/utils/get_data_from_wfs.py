@@ -1,9 +1,15 @@
 import os
 import ssl
 import logging
+
 import geopandas as gpd
 from owslib.wfs import WebFeatureService
-from requests import Request, get
+from requests import Request
+
+from .geojson_writer import write_geojson
+from .intermediate_files import write_intermediate
+from .source_fetch import fetch_source
+from .wfs_harvester import get_response_fingerprint
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
@@ -21,26 +27,25 @@ def get_wfs_request_url(wfs_url, layer):
     return Request('GET', wfs_url, params=params).prepare().url
 
 
-def download_wfs_to_xml(wfs_url, source_encoding, outfile_path):
+# the response is stored as received, so that its XML declaration matches its encoding
+def download_wfs_to_xml(wfs_url, outfile_path):
     logger.info(f"Request WFS from {wfs_url}")
-    r = get(wfs_url)
-    with open(f"{outfile_path}.xml", 'w', encoding=source_encoding) as fd:
-        fd.write(r.text)
+    return fetch_source(wfs_url, f"{outfile_path}.xml", content_fingerprint=get_response_fingerprint)
 
 
-def convert_xml_to_geojson(infile_path, source_encoding, outfile_path):
+def convert_xml_to_geojson(infile_path, source_encoding, outfile_path, intermediate_format='geojson'):
     logger.info(f'Load XML {infile_path}.xml')
     data = gpd.read_file(f"{infile_path}.xml", encoding=source_encoding, crs_wkt='2100')
     data['letzte_bewaesserung'] = data['letzte_bewaesserung'].dt.strftime('%Y-%m-%d')
-    store_as_geojson(data, outfile_path)
+    write_intermediate(data, outfile_path, intermediate_format)
 
 
-def store_as_geojson(data, outfile_name):
-    geojson_str = data.to_json(to_wgs84=True)
-    with open(f"{outfile_name}.geojson", 'w', encoding='utf-8') as fd:
-        fd.write(geojson_str)
-    logger.info(f"WFS was written to file {outfile_name}.geojson")
+def store_as_geojson(data, outfile_name, precision=None, compress=False, date_format=None):
+    file_path = f"{outfile_name}.geojson.gz" if compress else f"{outfile_name}.geojson"
+    write_geojson(data, file_path, precision=precision, compress=compress, date_format=date_format)
+    logger.info(f"WFS was written to file {file_path}")
 
 
 def read_geojson(infile_name):
     return gpd.read_file(infile_name, encoding='utf-8') # (..., rows=50) for testing
+
@@ -1,14 +1,32 @@
+import io
 import logging
 import os
+import time
 
-import geopandas as gpd
-from sqlalchemy import create_engine
+import numpy as np
+import pandas
+import shapely
+from sqlalchemy import create_engine, text
+
+from migrations.migrate import apply_migrations
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
 ROOT_DIR = os.path.abspath(os.curdir)
 
+# schema of the staging table as created by the migrations, in COPY column order
+staging_table_template = 'trees_tmp'
+staging_columns = [
+    'id', 'strname', 'artbot', 'artdtsch', 'standortnr', 'baumhoehe', 'stammdurch', 'kronedurch', 'aend_dat',
+    'gattung', 'gattungdeutsch', 'pflanzjahr', 'stammumfg', 'lat', 'lng', 'bezirk', 'geom'
+]
+staging_int_columns = ['baumhoehe', 'stammdurch', 'kronedurch', 'pflanzjahr']
+staging_float_columns = ['stammumfg', 'lat', 'lng']
+# columns sync_trees joins the staging table on
+staging_index_columns = ['id', 'standortnr']
+copy_chunk_size = 50000
+
 
 def get_db_engine():
     for env_var in ["PG_DB", "PG_PORT", "PG_USER", "PG_PASS", "PG_DB"]:
@@ -27,8 +45,71 @@ def get_db_engine():
     return create_engine(conn_string, connect_args={"options": "-c statement_timeout=300000"})
 
 
-def add_to_db(engine, result, table_name):
-    result['geometry'] = gpd.points_from_xy(result.lng, result.lat)
-    result = result.rename(columns={'geometry': 'geom'}).set_geometry('geom')
-    result.to_postgis(table_name, engine, if_exists='replace', index=False)
+def prepare_staging_table(engine, table_name):
+    # the schema of trees_tmp is owned by the migrations, other staging tables are created like it
+    apply_migrations(engine)
+    with engine.connect() as conn:
+        if table_name != staging_table_template:
+            conn.execute(text(f'''
+                CREATE UNLOGGED TABLE IF NOT EXISTS public."{table_name}" (LIKE public."{staging_table_template}")
+            '''))
+        # indexes are built once after the load instead of being maintained row by row during COPY
+        for column in staging_index_columns:
+            conn.execute(text(f'DROP INDEX IF EXISTS public."{table_name}_{column}_idx"'))
+        conn.execute(text(f'TRUNCATE public."{table_name}"'))
+        conn.commit()
+
+
+def build_staging_indexes(engine, table_name):
+    with engine.connect() as conn:
+        for column in staging_index_columns:
+            conn.execute(text(f'''
+                CREATE INDEX IF NOT EXISTS "{table_name}_{column}_idx" ON public."{table_name}" ("{column}")
+            '''))
+        conn.commit()
+
+
+# trees as rows of the staging table, the geometry is built from lng/lat as hex EWKB
+def get_staging_rows(trees):
+    rows = {}
+    for column in staging_columns[:-1]:
+        if column in trees:
+            values = trees[column]
+        else:
+            values = pandas.Series([None] * len(trees), index=trees.index, dtype=object)
+        if column in staging_int_columns:
+            values = pandas.to_numeric(values, errors='coerce').round().astype('Int64')
+        elif column in staging_float_columns:
+            values = pandas.to_numeric(values, errors='coerce')
+        elif column == 'aend_dat':
+            values = pandas.to_datetime(values, errors='coerce')
+        rows[column] = values
+    points = shapely.points(rows['lng'].to_numpy(dtype=float), rows['lat'].to_numpy(dtype=float))
+    points[np.isnan(rows['lng'].to_numpy(dtype=float)) | np.isnan(rows['lat'].to_numpy(dtype=float))] = None
+    rows['geom'] = shapely.to_wkb(shapely.set_srid(points, 4326), hex=True, include_srid=True)
+    return pandas.DataFrame(rows, index=trees.index)
+
+
+def copy_to_staging_table(engine, trees, table_name, chunk_size=copy_chunk_size):
+    start_time = time.time()
+    rows = get_staging_rows(trees)
+    column_names = ', '.join(f'"{column}"' for column in staging_columns)
+    with engine.begin() as conn:
+        cursor = conn.connection.cursor()
+        for start in range(0, len(rows), chunk_size):
+            buffer = io.StringIO()
+            rows.iloc[start:start + chunk_size].to_csv(
+                buffer, index=False, header=False, date_format='%Y-%m-%d %H:%M:%S')
+            buffer.seek(0)
+            cursor.copy_expert(f'COPY public."{table_name}" ({column_names}) FROM STDIN WITH (FORMAT csv)', buffer)
+    elapsed = max(time.time() - start_time, 1e-6)
+    logger.info(f'Copied {len(rows)} trees to table {table_name} in {elapsed:.1f}s ({len(rows) / elapsed:.0f} rows/s)')
+    return len(rows)
+
+
+def add_to_db(engine, result, table_name, if_exists='replace'):
+    if if_exists == 'replace':
+        prepare_staging_table(engine, table_name)
+    copy_to_staging_table(engine, result, table_name)
+    build_staging_indexes(engine, table_name)
     logger.info(f'Imported data to table {table_name}')
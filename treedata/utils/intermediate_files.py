@@ -0,0 +1,165 @@
+import json
+import logging
+import os
+from itertools import islice
+
+import fiona
+import geopandas as gpd
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from geopandas.io.file import infer_schema
+
+from .geojson_writer import GeoJsonWriter, write_geojson
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+# formats of the files handed over between the tree commands, by file extension,
+# GeoParquet and FlatGeobuf are read through Arrow, GeoJSON is meant for publishing
+intermediate_formats = ['parquet', 'fgb', 'geojson']
+intermediate_format_default = 'parquet'
+
+
+def get_intermediate_file_path(file_name, intermediate_format):
+    return f"{file_name}.{intermediate_format}"
+
+
+def write_intermediate(data, file_name, intermediate_format, date_format=None):
+    file_path = get_intermediate_file_path(file_name, intermediate_format)
+    if data.crs is not None and not data.crs.equals("epsg:4326"):
+        data = data.to_crs("epsg:4326")
+    if intermediate_format == 'geojson':
+        write_geojson(data, file_path, date_format=date_format)
+    elif intermediate_format == 'parquet':
+        data.to_parquet(file_path)
+    elif intermediate_format == 'fgb':
+        # without the spatial index, which would reorder the features
+        data.to_file(file_path, driver='FlatGeobuf', engine='pyogrio', SPATIAL_INDEX='NO')
+    else:
+        raise Exception(f"Unknown intermediate format {intermediate_format}")
+    logger.info(f"Wrote {len(data)} features to {file_path}")
+    return file_path
+
+
+# GeoParquet table of a batch, with the geometries as WKB
+def get_parquet_batch_table(data):
+    table = pa.Table.from_pandas(data.to_wkb(), preserve_index=False)
+    geometry_metadata = {"encoding": "WKB", "geometry_types": []}
+    if data.crs is not None:
+        geometry_metadata["crs"] = data.crs.to_json_dict()
+    geo_metadata = {"version": "1.0.0", "primary_column": data.geometry.name,
+                    "columns": {data.geometry.name: geometry_metadata}}
+    return table.replace_schema_metadata({**(table.schema.metadata or {}), b'geo': json.dumps(geo_metadata).encode()})
+
+
+# writes an intermediate file frame by frame, so that the features never have to be kept in memory at once,
+# the file is written next to the target and only moved in place when complete
+class IntermediateWriter:
+    def __init__(self, file_name, intermediate_format, date_format=None):
+        if intermediate_format not in intermediate_formats:
+            raise Exception(f"Unknown intermediate format {intermediate_format}")
+        self.file_name = file_name
+        self.file_path = get_intermediate_file_path(file_name, intermediate_format)
+        self.tmp_file_path = f"{self.file_path}.tmp"
+        self.intermediate_format = intermediate_format
+        self.date_format = date_format
+        self.feature_count = 0
+        self.schema = None
+        self.writer = None
+
+    def __enter__(self):
+        if self.intermediate_format == 'geojson':
+            self.writer = GeoJsonWriter(self.tmp_file_path, date_format=self.date_format).__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.writer is not None:
+            if self.intermediate_format == 'geojson':
+                self.writer.__exit__(exc_type, exc_value, traceback)
+            else:
+                self.writer.close()
+        if exc_type is not None:
+            if os.path.exists(self.tmp_file_path):
+                os.remove(self.tmp_file_path)
+            return False
+        if self.writer is None:
+            # an empty source, the file of the previous run must not be kept
+            write_intermediate(gpd.GeoDataFrame(geometry=[], crs="epsg:4326"), self.file_name,
+                               self.intermediate_format)
+            return False
+        os.replace(self.tmp_file_path, self.file_path)
+        logger.info(f"Wrote {self.feature_count} features to {self.file_path}")
+        return False
+
+    def write_frame(self, data):
+        if data.crs is not None and not data.crs.equals("epsg:4326"):
+            data = data.to_crs("epsg:4326")
+        if self.intermediate_format == 'geojson':
+            self.writer.write_frame(data)
+            self.feature_count += len(data)
+            return
+        # categories are stored as their values, as the categories differ between the batches
+        data = data.astype({column: object for column in data.columns
+                            if isinstance(data[column].dtype, pd.CategoricalDtype)})
+        if self.intermediate_format == 'parquet':
+            table = get_parquet_batch_table(data)
+            if self.writer is None:
+                # the first batch defines the schema, e.g. the transformed trees always have the same dtypes,
+                # only columns without any value in it are taken to be text
+                self.schema = pa.schema([
+                    field.with_type(pa.string()) if pa.types.is_null(field.type) else field for field in table.schema
+                ], metadata=table.schema.metadata)
+                self.writer = pq.ParquetWriter(self.tmp_file_path, self.schema)
+            self.writer.write_table(table.cast(self.schema))
+        else:
+            if self.writer is None:
+                # without the spatial index, which would reorder the features
+                self.writer = fiona.open(self.tmp_file_path, 'w', driver='FlatGeobuf', schema=infer_schema(data),
+                                         crs_wkt=data.crs.to_wkt() if data.crs is not None else None,
+                                         SPATIAL_INDEX='NO')
+            self.writer.writerecords(data.iterfeatures(na='null'))
+        self.feature_count += len(data)
+
+
+def read_intermediate(file_name, intermediate_format):
+    file_path = get_intermediate_file_path(file_name, intermediate_format)
+    if intermediate_format == 'parquet':
+        return gpd.read_parquet(file_path)
+    if intermediate_format == 'fgb':
+        return gpd.read_file(file_path, engine='pyogrio', use_arrow=True)
+    return gpd.read_file(file_path, encoding='utf-8')
+
+
+def read_parquet_batches(file_path, batch_size):
+    parquet_file = pq.ParquetFile(file_path)
+    geo_metadata = json.loads(parquet_file.schema_arrow.metadata[b'geo'])
+    geometry_column = geo_metadata['primary_column']
+    crs = geo_metadata['columns'][geometry_column].get('crs', 'epsg:4326')
+    offset = 0
+    for batch in parquet_file.iter_batches(batch_size=batch_size):
+        data = batch.to_pandas()
+        data[geometry_column] = gpd.GeoSeries.from_wkb(data[geometry_column], crs=crs)
+        data = gpd.GeoDataFrame(data, geometry=geometry_column, crs=crs)
+        data.index = range(offset, offset + len(data))
+        offset += len(data)
+        yield data
+
+
+# yields the features in GeoDataFrames of batch_size rows, indexed by their position in the file
+def read_intermediate_batches(file_name, intermediate_format, batch_size):
+    file_path = get_intermediate_file_path(file_name, intermediate_format)
+    if intermediate_format == 'parquet':
+        yield from read_parquet_batches(file_path, batch_size)
+        return
+    with fiona.open(file_path, encoding='utf-8') as source:
+        features = iter(source)
+        offset = 0
+        while True:
+            batch = list(islice(features, batch_size))
+            if len(batch) == 0:
+                break
+            data = gpd.GeoDataFrame.from_features(batch, crs=source.crs)
+            data.index = range(offset, offset + len(data))
+            offset += len(data)
+            yield data
@@ -1,19 +1,34 @@
 import argparse
+import logging
+
 from .get_data_from_shp import download_shp as download_shapefile
 from .get_data_from_shp import get_shp_request_url, convert_shp_to_geojson
+from .intermediate_files import intermediate_formats, intermediate_format_default, get_intermediate_file_path
+from .source_fetch import is_up_to_date, mark_up_to_date
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
 
 source_encoding_default = 'cp1252'
 
 
 def __download_shp_to_geojson__(shp_url_base, shp_file_path, geojson_file_path,
-                                source_encoding=source_encoding_default, download_shp=True, convert_to_geojson=True):
+                                source_encoding=source_encoding_default, download_shp=True, convert_to_geojson=True,
+                                intermediate_format=intermediate_format_default, force=False):
     if download_shp:
         shp_url_with_params = get_shp_request_url(shp_url_base)
         download_shapefile(shp_url=shp_url_with_params, outfile_path=shp_file_path)
 
     if convert_to_geojson:
+        source_paths = [f"{shp_file_path}.zip"]
+        output_path = get_intermediate_file_path(geojson_file_path, intermediate_format)
+        # an unchanged source short-circuits the conversion and with it the following trees_process run
+        if not force and is_up_to_date(source_paths, output_path):
+            logger.info(f"✅ Shapefile unchanged since {output_path} was converted, skipping conversion")
+            return
         convert_shp_to_geojson(infile_path=shp_file_path, source_encoding=source_encoding,
-                               outfile_path=geojson_file_path)
+                               outfile_path=geojson_file_path, intermediate_format=intermediate_format)
+        mark_up_to_date(source_paths, output_path)
 
 
 def configure_shp_args(
@@ -36,6 +51,11 @@ def configure_shp_args(
                         help='use existing Shapefile instead downloading anew', default=False)
     parser.add_argument('--skip-convert-to-geojson', dest='skip_convert_to_geojson', action='store_true',
                         help='skip step of converting Shapefile to GeoJSON file', default=False)
+    parser.add_argument('--intermediate-format', dest='intermediate_format', action='store',
+                        choices=intermediate_formats, default=intermediate_format_default,
+                        help='format of the converted file, GeoJSON only when it is published as is')
+    parser.add_argument('--force', dest='force', action='store_true',
+                        help='convert even if the source did not change since the last conversion', default=False)
 
 
 def handle_shp(args, base_folder):
@@ -43,4 +63,6 @@ def handle_shp(args, base_folder):
                                 shp_file_path=f"{base_folder}/{args.shp_file_name}",
                                 geojson_file_path=f"{base_folder}/{args.geojson_file_name}",
                                 download_shp=not args.skip_download_shp,
-                                convert_to_geojson=not args.skip_convert_to_geojson)
+                                convert_to_geojson=not args.skip_convert_to_geojson,
+                                intermediate_format=args.intermediate_format,
+                                force=args.force)
@@ -0,0 +1,203 @@
+import hashlib
+import json
+import logging
+import os
+
+from requests import Session, HTTPError
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+# network reads are kept small, as the chunk being read is lost when a transfer breaks off,
+# writes go through a large file buffer
+fetch_chunk_size = 64 * 1024
+fetch_buffer_size = 8 * 1024 * 1024
+fetch_timeout = 300
+
+
+def get_meta_path(file_path):
+    return f"{file_path}.meta.json"
+
+
+def read_meta(meta_path):
+    if not os.path.isfile(meta_path):
+        return None
+    try:
+        with open(meta_path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_meta(meta_path, meta):
+    with open(f"{meta_path}.tmp", 'w') as f:
+        json.dump(meta, f)
+    os.replace(f"{meta_path}.tmp", meta_path)
+
+
+def file_sha256(file_path, sha256=None):
+    sha256 = sha256 or hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(fetch_chunk_size), b''):
+            sha256.update(chunk)
+    return sha256
+
+
+def get_validators(response):
+    return {"etag": response.headers.get('ETag'), "last_modified": response.headers.get('Last-Modified')}
+
+
+# total size of the resource, from the Content-Range of a partial or the Content-Length of a full response
+def get_expected_size(response, offset):
+    content_range = response.headers.get('Content-Range')
+    if content_range is not None and '/' in content_range:
+        total = content_range.rsplit('/', 1)[1]
+        return int(total) if total.isdigit() else None
+    content_length = response.headers.get('Content-Length')
+    if content_length is not None and content_length.isdigit() and 'Content-Encoding' not in response.headers:
+        return offset + int(content_length)
+    return None
+
+
+def remove_part(part_path):
+    for path in [part_path, get_meta_path(part_path)]:
+        if os.path.isfile(path):
+            os.remove(path)
+
+
+# writes the response to part_path, appended at offset if the server resumed the transfer, returns
+# the validators, the SHA-256 of the whole part and the expected size, None if not modified
+def download_part(session, url, params, headers, part_path, offset):
+    with session.get(url, params=params, headers=headers, stream=True, timeout=fetch_timeout) as response:
+        if response.status_code == 304:
+            return None
+        response.raise_for_status()
+        validators = get_validators(response)
+        if response.status_code == 206:
+            logger.info(f"Resuming download of {url} at byte {offset}")
+            sha256 = file_sha256(part_path)
+            mode = 'ab'
+        else:
+            offset = 0
+            sha256 = hashlib.sha256()
+            mode = 'wb'
+        write_meta(get_meta_path(part_path), {"url": url, "params": params, **validators})
+        expected_size = get_expected_size(response, offset)
+        with open(part_path, mode, buffering=fetch_buffer_size) as f:
+            for chunk in response.iter_content(chunk_size=fetch_chunk_size):
+                f.write(chunk)
+                sha256.update(chunk)
+    return validators, sha256, expected_size
+
+
+# downloads url to file_path, unless the source did not change since the last fetch, returns whether it changed:
+# - the ETag and Last-Modified of the last fetch are sent as If-None-Match/If-Modified-Since
+# - an interrupted transfer left in file_path.part is resumed with a Range request, if the source is still the same,
+#   a rejected resume starts over
+# - the size is checked against the announced length, the SHA-256 against expected_sha256 if given
+# - the content is compared against the last fetch, so sources without validators are still recognized
+#   as unchanged, by the SHA-256 or by content_fingerprint(file_path) for responses embedding e.g. a timestamp
+def fetch_source(url, file_path, session=None, params=None, expected_sha256=None, content_fingerprint=None):
+    meta_path = get_meta_path(file_path)
+    part_path = f"{file_path}.part"
+    part_meta_path = get_meta_path(part_path)
+    meta = read_meta(meta_path)
+    # the validators are only trusted if the local file is still the one they were recorded for
+    if meta is not None and (not os.path.isfile(file_path) or meta.get('url') != url or meta.get('params') != params
+                             or file_sha256(file_path).hexdigest() != meta.get('sha256')):
+        meta = None
+
+    headers = {}
+    if meta is not None:
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+    part_meta = read_meta(part_meta_path)
+    offset = 0
+    if part_meta is not None and os.path.isfile(part_path) and part_meta.get('url') == url \
+            and part_meta.get('params') == params and (part_meta.get('etag') or part_meta.get('last_modified')):
+        offset = os.path.getsize(part_path)
+        headers['Range'] = f"bytes={offset}-"
+        # the server sends the whole resource instead, if it changed since the partial transfer
+        headers['If-Range'] = part_meta.get('etag') or part_meta.get('last_modified')
+
+    own_session = session is None
+    session = session or Session()
+    try:
+        try:
+            transfer = download_part(session, url, params, headers, part_path, offset)
+        except HTTPError as error:
+            if 'Range' not in headers:
+                raise
+            # e.g. 416 for a partial file that is complete already, which would be resumed again on every run
+            logger.warning(f"Resuming download of {url} failed with {error}, downloading it again")
+            remove_part(part_path)
+            del headers['Range'], headers['If-Range']
+            transfer = download_part(session, url, params, headers, part_path, 0)
+    finally:
+        if own_session:
+            session.close()
+    if transfer is None:
+        logger.info(f"{url} not modified since last fetch, keeping {file_path}")
+        return False
+    validators, sha256, expected_size = transfer
+
+    size = os.path.getsize(part_path)
+    if expected_size is not None and size > expected_size:
+        remove_part(part_path)
+        raise Exception(f"Download of {url} too large, got {size} of {expected_size} bytes")
+    if expected_size is not None and size != expected_size:
+        # the partial file is kept for the next attempt to resume
+        raise Exception(f"Download of {url} incomplete, got {size} of {expected_size} bytes")
+    digest = sha256.hexdigest()
+    if expected_sha256 is not None and digest != expected_sha256.lower():
+        remove_part(part_path)
+        raise Exception(f"Checksum mismatch for {url}: expected {expected_sha256}, got {digest}")
+    fingerprint = content_fingerprint(part_path) if content_fingerprint is not None else digest
+    previous_meta = read_meta(meta_path)
+    changed = previous_meta is None or get_fingerprint(previous_meta) != fingerprint or not os.path.isfile(file_path)
+    os.replace(part_path, file_path)
+    os.remove(part_meta_path)
+    write_meta(meta_path, {"url": url, "params": params, "sha256": digest, "fingerprint": fingerprint, "size": size,
+                           **validators})
+    if changed:
+        logger.info(f"Fetched {size} bytes from {url} to {file_path}")
+    else:
+        logger.info(f"Content of {url} unchanged since last fetch")
+    return changed
+
+
+def get_fingerprint(meta):
+    return meta.get('fingerprint', meta.get('sha256'))
+
+
+# fingerprint of a fetched file as recorded by fetch_source, the SHA-256 of other files
+def get_source_fingerprint(file_path):
+    meta = read_meta(get_meta_path(file_path))
+    if meta is not None and get_fingerprint(meta) is not None:
+        return get_fingerprint(meta)
+    return file_sha256(file_path).hexdigest()
+
+
+def get_sources_marker_path(output_path):
+    return f"{output_path}.sources.json"
+
+
+# fingerprints of the source files, and the key of everything else the output depends on, if given
+def get_sources_marker(source_paths, key=None):
+    marker = {os.path.basename(path): get_source_fingerprint(path) for path in source_paths}
+    if key is not None:
+        marker['key'] = key
+    return marker
+
+
+# whether output_path was produced from exactly these source files with this key, as recorded by mark_up_to_date
+def is_up_to_date(source_paths, output_path, key=None):
+    if not os.path.isfile(output_path) or not all(os.path.isfile(source_path) for source_path in source_paths):
+        return False
+    return read_meta(get_sources_marker_path(output_path)) == get_sources_marker(source_paths, key)
+
+
+def mark_up_to_date(source_paths, output_path, key=None):
+    write_meta(get_sources_marker_path(output_path), get_sources_marker(source_paths, key))
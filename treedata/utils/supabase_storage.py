@@ -9,6 +9,17 @@ def check_file_exists_in_supabase_storage(supabase_url, supabase_bucket_name, fi
     return response.status_code == 200
 
 
+# content of a public JSON file, None if it was not uploaded yet
+def download_json_from_supabase_storage(supabase_url, supabase_bucket_name, file_name):
+    url = f'{supabase_url}/storage/v1/object/public/{supabase_bucket_name}/{file_name}'
+    response = requests.get(url)
+    # the storage api answers missing objects with 400 or 404 depending on its version
+    if response.status_code in (400, 404):
+        return None
+    response.raise_for_status()
+    return response.json()
+
+
 def upload_file_to_supabase_storage(supabase_url, supabase_bucket_name, supabase_role_key, file_path, file_name):
     try:
         file = open(file_path, 'rb')
@@ -26,6 +37,7 @@ def upload_file_to_supabase_storage(supabase_url, supabase_bucket_name, supabase
         )
         if response.status_code == 200:
             logging.info("✅ Uploaded {} to supabase storage".format(file_name))
+            return True
         else:
             logging.warning(response.status_code)
             logging.warning(response.content)
@@ -33,14 +45,18 @@ def upload_file_to_supabase_storage(supabase_url, supabase_bucket_name, supabase
     except Exception as error:
         logging.warning(error)
         logging.warning("❌ Could not upload {} supabase storage".format(file_name))
+    return False
 
 
+# uploads all files, also if some fail, returns whether all of them were uploaded
 def upload_files_to_supabase_storage(supabase_url, supabase_bucket_name, supabase_role_key, file_path_to_file_name):
+    uploaded = True
     for file_path in file_path_to_file_name:
-        upload_file_to_supabase_storage(
+        uploaded &= upload_file_to_supabase_storage(
             supabase_url=supabase_url,
             supabase_bucket_name=supabase_bucket_name,
             supabase_role_key=supabase_role_key,
             file_path=file_path,
             file_name=file_path_to_file_name[file_path]
         )
+    return uploaded
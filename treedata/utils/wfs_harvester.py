@@ -0,0 +1,232 @@
+import hashlib
+import json
+import logging
+import math
+import os
+import re
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+import geopandas as gpd
+import pandas
+from requests import Session
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from .geojson_writer import GeoJsonWriter
+from .intermediate_files import write_intermediate
+from .source_fetch import fetch_source, read_meta, fetch_chunk_size
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+
+page_size_default = 10000
+download_workers_default = 4
+# without sortBy a WFS does not guarantee the same order across startIndex requests
+sort_by_default = 'objectid'
+request_timeout = 300
+
+# output formats GDAL reads much faster than GML, in order of preference
+preferred_output_formats = [
+    'application/geo+json',
+    'application/json',
+    'json',
+    'geojson',
+    'application/vnd.ogc.fg+json',
+]
+json_output_formats = set(preferred_output_formats)
+wfs_request_params = {'service', 'version', 'request', 'typename', 'typenames', 'count', 'startindex',
+                      'outputformat', 'resulttype', 'sortby'}
+manifest_file_name = 'pages.json'
+# response metadata differing between otherwise equal responses, in the GML root element
+# or the GeoJSON collection members, which are written before respectively after the features
+response_metadata_pattern = re.compile(rb'\btimeStamp="[^"]*"|"timeStamp"\s*:\s*"[^"]*"')
+response_metadata_size = 64 * 1024
+
+
+def create_session(workers):
+    session = Session()
+    retries = Retry(total=3, backoff_factor=2, status_forcelist=[429, 500, 502, 503, 504])
+    # one connection per download worker, kept alive over all pages
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers, max_retries=retries)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+# the configured URLs carry parameters like REQUEST=GetCapabilities, they are replaced per request
+def get_service_url(wfs_url):
+    url = urlsplit(wfs_url)
+    query = [(key, value) for key, value in parse_qsl(url.query) if key.lower() not in wfs_request_params]
+    return urlunsplit((url.scheme, url.netloc, url.path, urlencode(query), url.fragment))
+
+
+def local_name(element):
+    return element.tag.rsplit('}', 1)[-1]
+
+
+# output formats offered for GetFeature and whether startIndex paging is implemented
+def read_capabilities(session, service_url):
+    response = session.get(service_url, params=dict(service='WFS', version='2.0.0', request='GetCapabilities'),
+                           timeout=request_timeout)
+    response.raise_for_status()
+    root = ET.fromstring(response.content)
+    output_formats = []
+    paging = False
+    for element in root.iter():
+        name = local_name(element)
+        if name == 'Operation' and element.get('name') == 'GetFeature':
+            for parameter in element.iter():
+                if local_name(parameter) == 'Parameter' and parameter.get('name') == 'outputFormat':
+                    output_formats += [value.text.strip() for value in parameter.iter()
+                                       if local_name(value) == 'Value' and value.text]
+        elif name == 'Constraint' and element.get('name') == 'ImplementsResultPaging':
+            paging = any(local_name(value) == 'DefaultValue' and (value.text or '').strip().upper() == 'TRUE'
+                         for value in element.iter())
+    return output_formats, paging
+
+
+def choose_output_format(output_formats, output_format=None):
+    if output_format is not None:
+        return output_format
+    offered = {offered_format.lower(): offered_format for offered_format in output_formats}
+    for preferred_format in preferred_output_formats:
+        if preferred_format in offered:
+            return offered[preferred_format]
+    # GML, the default of the service
+    return None
+
+
+def get_hits(session, service_url, layer):
+    response = session.get(service_url, params=dict(
+        service='WFS', version='2.0.0', request='GetFeature', typeNames=layer, resultType='hits'
+    ), timeout=request_timeout)
+    response.raise_for_status()
+    number_matched = ET.fromstring(response.content).get('numberMatched')
+    if number_matched is None or not number_matched.isdigit():
+        return None
+    return int(number_matched)
+
+
+def is_json_format(output_format):
+    return output_format is not None and output_format.lower() in json_output_formats
+
+
+# SHA-256 of a GetFeature response without its timeStamp, only the head and tail of the response are searched
+def get_response_fingerprint(file_path):
+    sha256 = hashlib.sha256()
+    size = os.path.getsize(file_path)
+    with open(file_path, 'rb') as f:
+        if size <= 2 * response_metadata_size:
+            sha256.update(response_metadata_pattern.sub(b'', f.read()))
+            return sha256.hexdigest()
+        sha256.update(response_metadata_pattern.sub(b'', f.read(response_metadata_size)))
+        remaining = size - 2 * response_metadata_size
+        while remaining > 0:
+            chunk = f.read(min(fetch_chunk_size, remaining))
+            sha256.update(chunk)
+            remaining -= len(chunk)
+        sha256.update(response_metadata_pattern.sub(b'', f.read()))
+    return sha256.hexdigest()
+
+
+def download_page(session, service_url, layer, page_path, output_format=None, start_index=None, count=None,
+                  sort_by=None):
+    params = dict(service='WFS', version='2.0.0', request='GetFeature', typeNames=layer)
+    if output_format is not None:
+        params['outputFormat'] = output_format
+    if start_index is not None:
+        params['startIndex'] = start_index
+        params['count'] = count
+    if sort_by is not None:
+        params['sortBy'] = sort_by
+    # streamed to disk as received, the response is never held in memory as a whole
+    return fetch_source(service_url, page_path, session=session, params=params,
+                        content_fingerprint=get_response_fingerprint)
+
+
+# pages of an earlier harvest with more pages or another format, including their fetch metadata
+def remove_stale_pages(pages_path, page_file_names):
+    for file_name in os.listdir(pages_path):
+        if file_name.startswith('page-') and not any(file_name.startswith(name) for name in page_file_names):
+            os.remove(f"{pages_path}/{file_name}")
+
+
+# downloads the layer page by page with WFS 2.0 count/startIndex into pages_path,
+# a manifest lists the pages in order together with their format and the expected number of features,
+# returns whether any page changed since the last harvest
+def harvest_wfs_pages(wfs_url, layer, pages_path, page_size=page_size_default, workers=download_workers_default,
+                      output_format=None, sort_by=sort_by_default):
+    service_url = get_service_url(wfs_url)
+    os.makedirs(pages_path, exist_ok=True)
+    previous_manifest = read_meta(f"{pages_path}/{manifest_file_name}")
+    with create_session(workers) as session:
+        output_formats, paging = read_capabilities(session, service_url)
+        output_format = choose_output_format(output_formats, output_format)
+        hits = get_hits(session, service_url, layer)
+        extension = 'json' if is_json_format(output_format) else 'xml'
+        logger.info(f"Harvesting {hits} features of {layer} as {output_format or 'GML'}")
+        if paging and hits is not None:
+            start_indexes = [page * page_size for page in range(max(math.ceil(hits / page_size), 1))]
+            if len(start_indexes) > 1 and not sort_by:
+                raise Exception("Paging a WFS layer needs a sort key for a stable order of the features, "
+                                "pass sort_by or a page size covering the whole layer")
+        else:
+            logger.info("Service does not implement result paging, requesting all features at once")
+            start_indexes = [None]
+        page_file_names = [f"page-{page:05d}.{extension}" for page in range(len(start_indexes))]
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(download_page, session, service_url, layer, f"{pages_path}/{file_name}",
+                                output_format, start_index, page_size, sort_by)
+                for file_name, start_index in zip(page_file_names, start_indexes)
+            ]
+            changed = [future.result() for future in futures]
+    remove_stale_pages(pages_path, page_file_names)
+    manifest = {"layer": layer, "output_format": output_format, "hits": hits, "pages": page_file_names}
+    with open(f"{pages_path}/{manifest_file_name}", 'w') as fd:
+        json.dump(manifest, fd)
+    return any(changed) or manifest != previous_manifest
+
+
+def is_harvested(pages_path):
+    return os.path.isfile(f"{pages_path}/{manifest_file_name}")
+
+
+def get_page_paths(pages_path):
+    manifest = read_meta(f"{pages_path}/{manifest_file_name}")
+    return [f"{pages_path}/{page_file_name}" for page_file_name in manifest['pages']]
+
+
+def read_pages(pages_path, manifest, source_encoding):
+    encoding = 'utf-8' if is_json_format(manifest['output_format']) else source_encoding
+    offset = 0
+    for page_file_name in manifest['pages']:
+        page = gpd.read_file(f"{pages_path}/{page_file_name}", encoding=encoding)
+        if page.crs is not None and not page.crs.equals("epsg:4326"):
+            page = page.to_crs("epsg:4326")
+        page.index = range(offset, offset + len(page))
+        offset += len(page)
+        yield page
+
+
+# converts the harvested pages in order to one file in WGS84, GeoJSON is written one page at a time
+def convert_pages_to_geojson(pages_path, source_encoding, outfile_path, intermediate_format='geojson'):
+    with open(f"{pages_path}/{manifest_file_name}", 'r') as fd:
+        manifest = json.load(fd)
+    feature_count = 0
+    if intermediate_format == 'geojson':
+        with GeoJsonWriter(f"{outfile_path}.geojson", date_format='%Y-%m-%d') as writer:
+            for page in read_pages(pages_path, manifest, source_encoding):
+                writer.write_frame(page)
+                feature_count += len(page)
+    else:
+        data = pandas.concat(list(read_pages(pages_path, manifest, source_encoding)))
+        write_intermediate(data, outfile_path, intermediate_format)
+        feature_count = len(data)
+    if manifest['hits'] is not None and feature_count != manifest['hits']:
+        logger.warning(f"Expected {manifest['hits']} features but harvested {feature_count}, "
+                       f"the layer may have changed while paging")
+    logger.info(f"WFS was written to file {outfile_path}.{intermediate_format}")
+    return feature_count
@@ -1,19 +1,49 @@
 import argparse
+import logging
+
 from .get_data_from_wfs import download_wfs_to_xml
 from .get_data_from_wfs import get_wfs_request_url, convert_xml_to_geojson
+from .wfs_harvester import harvest_wfs_pages, is_harvested, convert_pages_to_geojson, page_size_default, \
+    download_workers_default, sort_by_default, get_page_paths
+from .intermediate_files import intermediate_formats, intermediate_format_default, get_intermediate_file_path
+from .source_fetch import is_up_to_date, mark_up_to_date
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
 
 source_encoding_default = 'iso-8859-1'
 
 
 def __download_wfs_to_geojson__(wfs_url_base, layer, xml_file_path, geojson_file_path,
-                                source_encoding=source_encoding_default, download_wfs=True, convert_to_geojson=True):
+                                source_encoding=source_encoding_default, download_wfs=True, convert_to_geojson=True,
+                                page_size=page_size_default, download_workers=download_workers_default,
+                                output_format=None, sort_by=sort_by_default, intermediate_format=intermediate_format_default,
+                                force=False):
+    # the paged harvest stores its pages in a folder next to where the single XML was stored
+    pages_path = f"{xml_file_path}-pages"
     if download_wfs:
-        wfs_url_with_params = get_wfs_request_url(wfs_url_base, layer)
-        download_wfs_to_xml(wfs_url=wfs_url_with_params, source_encoding=source_encoding, outfile_path=xml_file_path)
+        if page_size > 0:
+            harvest_wfs_pages(wfs_url_base, layer, pages_path, page_size=page_size, workers=download_workers,
+                              output_format=output_format, sort_by=sort_by)
+        else:
+            wfs_url_with_params = get_wfs_request_url(wfs_url_base, layer)
+            download_wfs_to_xml(wfs_url=wfs_url_with_params, outfile_path=xml_file_path)
 
     if convert_to_geojson:
-        convert_xml_to_geojson(infile_path=xml_file_path, source_encoding=source_encoding,
-                               outfile_path=geojson_file_path)
+        paged = page_size > 0 and is_harvested(pages_path)
+        source_paths = get_page_paths(pages_path) if paged else [f"{xml_file_path}.xml"]
+        output_path = get_intermediate_file_path(geojson_file_path, intermediate_format)
+        # an unchanged source short-circuits the conversion and with it the following trees_process run
+        if not force and is_up_to_date(source_paths, output_path):
+            logger.info(f"✅ WFS unchanged since {output_path} was converted, skipping conversion")
+            return
+        if paged:
+            convert_pages_to_geojson(pages_path=pages_path, source_encoding=source_encoding,
+                                     outfile_path=geojson_file_path, intermediate_format=intermediate_format)
+        else:
+            convert_xml_to_geojson(infile_path=xml_file_path, source_encoding=source_encoding,
+                                   outfile_path=geojson_file_path, intermediate_format=intermediate_format)
+        mark_up_to_date(source_paths, output_path)
 
 
 def configure_wfs_args(
@@ -39,6 +69,22 @@ def configure_wfs_args(
                         help='use existing XML instead downloading anew', default=False)
     parser.add_argument('--skip-convert-to-geojson', dest='skip_convert_to_geojson', action='store_true',
                         help='skip step of converting WFS XML to GeoJSON file', default=False)
+    parser.add_argument('--page-size', dest='page_size', action='store', type=int,
+                        help='features per WFS GetFeature page, 0 requests the whole layer at once',
+                        default=page_size_default)
+    parser.add_argument('--download-workers', dest='download_workers', action='store', type=int,
+                        help='number of pages downloaded concurrently', default=download_workers_default)
+    parser.add_argument('--output-format', dest='output_format', action='store',
+                        help='WFS output format to request, by default GeoJSON if offered by the service, else GML',
+                        default=None)
+    parser.add_argument('--sort-by', dest='sort_by', action='store',
+                        help='WFS sortBy for a stable order of the features across pages, required for paging',
+                        default=sort_by_default)
+    parser.add_argument('--intermediate-format', dest='intermediate_format', action='store',
+                        choices=intermediate_formats, default=intermediate_format_default,
+                        help='format of the converted file, GeoJSON only when it is published as is')
+    parser.add_argument('--force', dest='force', action='store_true',
+                        help='convert even if the source did not change since the last conversion', default=False)
 
 
 def handle_wfs(args, base_folder):
@@ -48,4 +94,10 @@ def handle_wfs(args, base_folder):
                                 xml_file_path=f"{base_folder}/{args.xml_file_name}",
                                 geojson_file_path=f"{base_folder}/{args.geojson_file_name}",
                                 download_wfs=not args.skip_download_wfs,
-                                convert_to_geojson=not args.skip_convert_to_geojson)
+                                convert_to_geojson=not args.skip_convert_to_geojson,
+                                page_size=args.page_size,
+                                download_workers=args.download_workers,
+                                output_format=args.output_format,
+                                sort_by=args.sort_by,
+                                intermediate_format=args.intermediate_format,
+                                force=args.force)
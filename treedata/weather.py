@@ -1,9 +1,10 @@
 import os
 import argparse
 from datetime import datetime, timedelta
+from functools import partial
 import logging
 
-from radolan.buffer_city_shape import create_buffered_city_shape
+from radolan.buffer_city_shape import create_buffered_city_shape, read_buffered_city_shape
 from radolan.download_weather_data import download_weather_data
 from radolan.extract_weather_data import extract_weather_data
 from radolan.polygonize_weather_data import polygonize_weather_data, polygonize_asc_file
@@ -11,14 +12,23 @@ from radolan.join_radolan_data import join_radolan_data
 from radolan.upload_radolan import upload_radolan_data, purge_data_older_than_time_limit_days, purge_duplicates, \
     update_radolan_geometry, exist_radolan_geometry
 from radolan.create_radolan_schemas import create_radolan_schema
-from radolan.update_tree_radolan_days import get_weather_data_grid_cells, get_sorted_cleaned_grid_cells, \
-    update_tree_radolan_days, update_statistics_db, get_sorted_cleaned_grid
+from radolan.update_tree_radolan_days import get_sorted_cleaned_grid_cells, update_tree_radolan_days, \
+    update_statistics_db
+from radolan.radolan_cell_window import advance_radolan_cell_window, get_window_cells, get_measured_dates
 from radolan.write_radolan_geojsons import write_radolan_geojsons, get_radolan_files_for_upload
-from radolan.write_radolan_csvs import write_radolan_csvs
-from radolan.write_radolan_mvts import write_radolan_mvts
-from radolan.write_radolan_geoarrow import write_radolan_geoarrow
+from radolan.write_radolan_csvs import write_trees_csvs, write_trees_csv_partitions, partition_zoom_default
+from radolan.write_radolan_mvts import write_trees_mvts, min_zoom_default, max_zoom_default, \
+    cluster_max_zoom_default
+from radolan.write_radolan_geoarrow import write_trees_geoarrow, row_group_size_default
+from radolan.write_radolan_delta import write_trees_delta, publish_trees_delta, get_export_sequence, \
+    delta_file_name
+from radolan.export_trees import export_trees
 from radolan.create_radolan_grid import create_radolon_grid
-from utils.supabase_storage import upload_files_to_supabase_storage
+from radolan.grid_geometry_cache import get_grid_geometries
+from radolan.write_radolan_values import get_radolan_values_files_for_upload
+from radolan.write_radolan_cog import write_radolan_cog
+from utils.supabase_storage import upload_files_to_supabase_storage, check_file_exists_in_supabase_storage, \
+    download_json_from_supabase_storage
 from utils.mapbox_upload import get_mapbox_s3_data, notify_mapbox_upload
 from utils.gzip_file import gzip_files
 from utils.s3_client import create_s3_client, upload_files_to_s3
@@ -65,14 +75,61 @@ def configure_weather_args(parser=argparse.ArgumentParser(description='Process w
                         help='skip step of radolan data MVT file generation and S3 upload', default=False)
     parser.add_argument('--skip-upload-geoarrow-to-s3', dest='skip_upload_geoarrow_to_s3', action='store_true',
                         help='skip step of radolan data GeoArrow file generation and S3 upload', default=False)
+    parser.add_argument('--skip-upload-delta-to-s3', dest='skip_upload_delta_to_s3', action='store_true',
+                        help='skip step of trees delta file generation and S3 upload', default=False)
+    parser.add_argument('--skip-upload-cog-to-s3', dest='skip_upload_cog_to_s3', action='store_true',
+                        help='skip step of radolan data Cloud-Optimized GeoTIFF generation and S3 upload',
+                        default=False)
+    parser.add_argument('--csv-partition-zoom', dest='csv_partition_zoom', action='store', type=int,
+                        help='zoom level of the map tiles the trees CSV is partitioned by',
+                        default=partition_zoom_default)
+    parser.add_argument('--mvt-min-zoom', dest='mvt_min_zoom', action='store', type=int,
+                        help='lowest zoom level of the trees vector tiles', default=min_zoom_default)
+    parser.add_argument('--mvt-max-zoom', dest='mvt_max_zoom', action='store', type=int,
+                        help='highest zoom level of the trees vector tiles', default=max_zoom_default)
+    parser.add_argument('--mvt-cluster-max-zoom', dest='mvt_cluster_max_zoom', action='store', type=int,
+                        help='highest zoom level at which trees are clustered in the vector tiles',
+                        default=cluster_max_zoom_default)
+    parser.add_argument('--mvt-workers', dest='mvt_workers', action='store', type=int,
+                        help='number of processes encoding vector tiles', default=1)
+    parser.add_argument('--geoarrow-row-group-size', dest='geoarrow_row_group_size', action='store', type=int,
+                        help='number of trees per row group of the GeoParquet export',
+                        default=row_group_size_default)
     parser.add_argument('--skip-upload-csvs-to-mapbox', dest='skip_upload_csvs_to_mapbox', action='store_true',
                         help='skip step of radolan data CSV file Mapbox S3 upload', default=False)
     parser.set_defaults(which='weather', func=handle_weather)
 
 
+# writers of the enabled tree exports, all fed from one read of the trees
+def get_export_writers(args):
+    path = f"{RADOLAN_PATH}/"
+    writers = {}
+    # trees-total.csv is also uploaded to Mapbox
+    if not args.skip_upload_csvs_to_s3 or not args.skip_upload_csvs_to_mapbox:
+        writers['csv'] = partial(write_trees_csvs, path=path)
+    if not args.skip_upload_csvs_to_s3:
+        writers['csv_partitions'] = partial(write_trees_csv_partitions, path=path,
+                                            partition_zoom=args.csv_partition_zoom)
+    if not args.skip_upload_mvts_to_s3:
+        writers['mvt'] = partial(
+            write_trees_mvts,
+            path=path,
+            min_zoom=args.mvt_min_zoom,
+            max_zoom=args.mvt_max_zoom,
+            cluster_max_zoom=args.mvt_cluster_max_zoom,
+            workers=args.mvt_workers
+        )
+    if not args.skip_upload_geoarrow_to_s3:
+        writers['geoarrow'] = partial(write_trees_geoarrow, path=path, row_group_size=args.geoarrow_row_group_size)
+    if not args.skip_upload_delta_to_s3:
+        writers['delta'] = partial(write_trees_delta, path=path)
+    return writers
+
+
 def handle_weather(args):
+    city_shape_buffer = None
     if not args.skip_buffer_city_shape:
-        create_buffered_city_shape(
+        city_shape_buffer = create_buffered_city_shape(
             input_file_name=args.city_shape_file_name,
             output_file_name=args.city_shape_buffer_file_name,
             buffer_radius=args.city_shape_buffer,
@@ -86,7 +143,8 @@ def handle_weather(args):
     if not args.skip_unzip_weather_data:
         extract_weather_data()
     if not args.skip_polygonize_weather_data:
-        filelist, last_received = polygonize_weather_data(args.city_shape_buffer_file_name)
+        city_shape_buffer = city_shape_buffer or read_buffered_city_shape(args.city_shape_buffer_file_name)
+        filelist, last_received = polygonize_weather_data(city_shape_buffer)
         db_engine = get_db_engine()
         update_statistics_db(filelist, db_engine, TIME_LIMIT_DAYS, last_received)
     joined_path = f"{RADOLAN_PATH}/radolan-joined"
@@ -101,8 +159,9 @@ def handle_weather(args):
         exists = exist_radolan_geometry(db_engine)
         if not exists:
             create_radolon_grid()
+            city_shape_buffer = city_shape_buffer or read_buffered_city_shape(args.city_shape_buffer_file_name)
             polygonize_asc_file(
-                buffer_file_name=args.city_shape_buffer_file_name,
+                city_shape_buffer=city_shape_buffer,
                 input_file=f"{RADOLAN_PATH}/grid-transform.asc",
                 output_file=f"{RADOLAN_PATH}/grid-buffer.asc",
                 file_name="grid-transform"
@@ -114,10 +173,18 @@ def handle_weather(args):
         upload_radolan_data(db_engine, radolan_data)
         purge_data_older_than_time_limit_days(db_engine, TIME_LIMIT_DAYS)
         purge_duplicates(db_engine)
+        advance_radolan_cell_window(db_engine, TIME_LIMIT_DAYS, get_measured_dates(radolan_data))
     if not args.skip_update_tree_radolan_days:
         db_engine = get_db_engine()
-        grid = get_weather_data_grid_cells(engine=db_engine, time_limit_days=TIME_LIMIT_DAYS)
-        clean = get_sorted_cleaned_grid(grid, TIME_LIMIT_DAYS)
+        grid_version, grid_geometries = get_grid_geometries(
+            engine=db_engine,
+            cache_path=f"{RADOLAN_PATH}/grid-geometries.json"
+        )
+        grid, clean = get_window_cells(
+            engine=db_engine,
+            time_limit_days=TIME_LIMIT_DAYS,
+            grid_geometries=grid_geometries
+        )
         start_date = datetime.now() + timedelta(days=-TIME_LIMIT_DAYS)
         start_date = start_date.replace(hour=0, minute=50, second=0, microsecond=0)
         end_date = datetime.now() + timedelta(days=-1)
@@ -127,11 +194,22 @@ def handle_weather(args):
             start_date=start_date,
             end_date=end_date,
             grid=grid,
-            clean=clean
+            clean=clean,
+            grid_version=grid_version,
+            grid_geometries=grid_geometries
         )
+        if not args.skip_upload_cog_to_s3:
+            write_radolan_cog(
+                path=f"{RADOLAN_PATH}/",
+                start_date=start_date,
+                end_date=end_date,
+                grid=grid,
+                clean=clean,
+                grid_geometries=grid_geometries
+            )
         values = get_sorted_cleaned_grid_cells(clean, grid)
-        update_tree_radolan_days(db_engine, values)
-    if not args.skip_upload_geojsons_to_s3 or not args.skip_upload_csvs_to_s3:
+        update_tree_radolan_days(db_engine, values, TIME_LIMIT_DAYS)
+    if not args.skip_upload_geojsons_to_s3 or not args.skip_upload_csvs_to_s3 or not args.skip_upload_delta_to_s3:
         for env_var in ["SUPABASE_URL", "SUPABASE_BUCKET_NAME", "SUPABASE_SERVICE_ROLE_KEY"]:
             if env_var not in os.environ:
                 msg = "❌Environmental Variable {} does not exist but is required".format(env_var)
@@ -143,6 +221,12 @@ def handle_weather(args):
     supabase_role_key = os.getenv('SUPABASE_SERVICE_ROLE_KEY')
     if not args.skip_upload_geojsons_to_s3:
         file_path_to_file_name = get_radolan_files_for_upload(path=f"{RADOLAN_PATH}/")
+        values_file_path_to_file_name, grid_file_name = get_radolan_values_files_for_upload(path=f"{RADOLAN_PATH}/")
+        file_path_to_file_name = file_path_to_file_name | values_file_path_to_file_name
+        # the grid geometries are versioned by file name and only published once
+        if grid_file_name is not None and not check_file_exists_in_supabase_storage(
+                supabase_url, supabase_bucket_name, grid_file_name):
+            file_path_to_file_name[f"{RADOLAN_PATH}/{grid_file_name}"] = grid_file_name
         gzip_file_path_to_file_name = gzip_files(file_path_to_file_name)
         file_path_to_file_name_union = file_path_to_file_name | gzip_file_path_to_file_name
         upload_files_to_supabase_storage(
@@ -151,41 +235,71 @@ def handle_weather(args):
             supabase_role_key=supabase_role_key,
             file_path_to_file_name=file_path_to_file_name_union
         )
-    if not args.skip_upload_csvs_to_s3:
-        db_engine = get_db_engine()
-        file_path_to_file_name = write_radolan_csvs(
-            engine=db_engine,
+    if not args.skip_upload_cog_to_s3 and os.path.isfile(f"{RADOLAN_PATH}/weather.tif"):
+        upload_files_to_supabase_storage(
+            supabase_url=supabase_url,
+            supabase_bucket_name=supabase_bucket_name,
+            supabase_role_key=supabase_role_key,
+            file_path_to_file_name={
+                f"{RADOLAN_PATH}/weather.tif": "weather.tif"
+            }
+        )
+    export_writers = get_export_writers(args)
+    if len(export_writers) > 0:
+        sequence = None
+        if 'delta' in export_writers:
+            # the published sequence also continues if the cached snapshots of the last runs are lost
+            published_delta = download_json_from_supabase_storage(
+                supabase_url, supabase_bucket_name, f"{delta_file_name}.json")
+            sequence = get_export_sequence(f"{RADOLAN_PATH}/",
+                                           published_delta["sequence"] if published_delta is not None else 0)
+        export_files, _ = export_trees(
+            engine=get_db_engine(),
             time_limit_days=TIME_LIMIT_DAYS,
-            path=f"{RADOLAN_PATH}/"
+            writers=export_writers,
+            # the full exports are the base the deltas are applied to
+            sequence=sequence
         )
-        gzip_files(file_path_to_file_name)
-    if not args.skip_upload_mvts_to_s3:
-        write_radolan_mvts(
-            path=f"{RADOLAN_PATH}/"
+    if not args.skip_upload_csvs_to_s3:
+        upload_files_to_supabase_storage(
+            supabase_url=supabase_url,
+            supabase_bucket_name=supabase_bucket_name,
+            supabase_role_key=supabase_role_key,
+            file_path_to_file_name=export_files['csv']
         )
-        file_path_to_file_name = {
-            f"{RADOLAN_PATH}/trees.mvt": "trees.mvt"
-        }
+        # the quadkey partitions with their index files, so that clients fetch only the tiles of their view
         upload_files_to_supabase_storage(
             supabase_url=supabase_url,
             supabase_bucket_name=supabase_bucket_name,
             supabase_role_key=supabase_role_key,
-            file_path_to_file_name=file_path_to_file_name
+            file_path_to_file_name=export_files['csv_partitions']
         )
-    if not args.skip_upload_geoarrow_to_s3:
-        write_radolan_geoarrow(
-            path=f"{RADOLAN_PATH}/"
+    if not args.skip_upload_mvts_to_s3:
+        upload_files_to_supabase_storage(
+            supabase_url=supabase_url,
+            supabase_bucket_name=supabase_bucket_name,
+            supabase_role_key=supabase_role_key,
+            file_path_to_file_name=export_files['mvt']
         )
-        file_path_to_file_name = {
-            f"{RADOLAN_PATH}/trees.feather": "trees.feather",
-            f"{RADOLAN_PATH}/trees.parquet": "trees.parquet"
-        }
+    if not args.skip_upload_geoarrow_to_s3:
         upload_files_to_supabase_storage(
             supabase_url=supabase_url,
             supabase_bucket_name=supabase_bucket_name,
             supabase_role_key=supabase_role_key,
-            file_path_to_file_name=file_path_to_file_name
+            file_path_to_file_name=export_files['geoarrow']
+        )
+    if not args.skip_upload_delta_to_s3:
+        uploaded = upload_files_to_supabase_storage(
+            supabase_url=supabase_url,
+            supabase_bucket_name=supabase_bucket_name,
+            supabase_role_key=supabase_role_key,
+            file_path_to_file_name=export_files['delta']
         )
+        # only a published delta becomes the base of the next one
+        if uploaded:
+            publish_trees_delta(f"{RADOLAN_PATH}/")
+        else:
+            logging.warning("❌ Trees delta not uploaded completely, the next delta is built against the last one")
     if not args.skip_upload_csvs_to_mapbox:
         for env_var in ["MAPBOXUSERNAME", "MAPBOXTOKEN", "MAPBOXTILESET"]:
             if env_var not in os.environ: